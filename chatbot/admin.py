@@ -1,9 +1,35 @@
+from django import forms
 from django.contrib import admin
-from .models import AIModel
+from .models import (AIModel,
+                     AIModelEndpoint)
+
+
+class AIModelEndpointForm(forms.ModelForm):
+    """
+    Form of an AI Model Endpoint keeping its API key out of the rendered page.
+    The stored API key is kept when the field is left blank.
+    """
+
+    class Meta:
+        model = AIModelEndpoint
+        fields = '__all__'
+        widgets = {'api_key': forms.PasswordInput(render_value=False)}
+        help_texts = {'api_key': 'Leave blank to keep the current API key.'}
+
+    def clean_api_key(self):
+        return self.cleaned_data['api_key'] or (self.instance.api_key if self.instance.pk else '')
+
+
+class AIModelEndpointInline(admin.TabularInline):
+    model = AIModelEndpoint
+    form = AIModelEndpointForm
+    extra = 0
 
 
 class AIModelAdmin(admin.ModelAdmin):
-    list_display = ['model_id', 'max_tokens', 'compatibility']
+    list_display = ['model_id', 'max_tokens', 'compatibility', 'response_cache_enabled', 'response_cache_timeout',
+                    'tokens_per_minute', 'max_concurrent_streams', 'routing_policy']
+    inlines = [AIModelEndpointInline]
 
 
 # Register your models here.
@@ -0,0 +1,171 @@
+import math
+import time
+import asyncio
+import threading
+from uuid import uuid4
+from itertools import count
+from functools import partial
+from collections import defaultdict
+
+from django.conf import settings
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from rest_framework import status
+
+from utilities.messages import ERROR_CODES
+from utilities.exception import CustomAPIException
+from .metrics import ADMISSION_WAIT
+from .constants import ADMISSION_STREAM_LEASE_TIMEOUT
+
+
+def increment(key, delta, timeout):
+    """
+    Function to atomically increment a counter of the Django cache, creating it with a timeout if it is missing.
+    :return: Incremented value
+    """
+    cache.add(key, 0, timeout=timeout)
+    try:
+        return cache.incr(key, delta)
+    except ValueError:
+        # The counter expired in between.
+        cache.add(key, delta, timeout=timeout)
+        return delta
+
+
+class AdmissionController:
+    """
+    Admission control of the upstream completion streams against the tokens per minute and concurrent streams
+    budgets of their AI Model, shared by the worker processes through the Django cache: a counter of the tokens
+    of each minute, and a lease key per stream slot expiring on its own, so that a stream that was never
+    released only holds its slot for ADMISSION_STREAM_LEASE_TIMEOUT.
+    Requests over budget wait their turn in a bounded first-come first-served queue of their worker process,
+    and are rejected with a 429 and a retry hint once the queue is full or they waited ADMISSION['MAX_WAIT'].
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tickets = count()
+        self._queues = defaultdict(list)
+
+    @property
+    def config(self):
+        return settings.CHATBOT_ADMISSION
+
+    @staticmethod
+    def get_stream_keys(ai_model_instance):
+        return [f'chatbot:admission:{ai_model_instance.model_id}:streams:{slot}'
+                for slot in range(ai_model_instance.max_concurrent_streams)]
+
+    @staticmethod
+    def get_tokens_key(model_id, minute):
+        return f'chatbot:admission:{model_id}:tokens:{minute}'
+
+    def lease_stream(self, ai_model_instance):
+        """
+        Method to lease a free stream slot of an AI Model.
+        :param ai_model_instance: Instance of requested AI Model
+        :return: Lease of the slot, i.e. its key and lease ID, or None if every slot is leased
+        """
+        stream_keys = self.get_stream_keys(ai_model_instance)
+        leased_keys = cache.get_many(stream_keys)
+        lease_id = uuid4().hex
+        for stream_key in stream_keys:
+            if stream_key not in leased_keys and cache.add(stream_key, lease_id,
+                                                           timeout=ADMISSION_STREAM_LEASE_TIMEOUT):
+                return stream_key, lease_id
+        return None
+
+    def try_acquire(self, ai_model_instance, tokens_count):
+        """
+        Method to reserve a stream and tokens of the current minute if both budgets allow it.
+        A request larger than the tokens per minute is let through alone in its minute.
+        :param ai_model_instance: Instance of requested AI Model
+        :param tokens_count: Tokens to reserve
+        :return: Whether the stream was reserved, seconds before the budgets may allow it otherwise,
+                 and the lease of the stream if the AI Model has a concurrency budget
+        """
+        lease = None
+        if ai_model_instance.max_concurrent_streams:
+            lease = self.lease_stream(ai_model_instance)
+            if lease is None:
+                return False, self.config['POLL_INTERVAL'], None
+
+        if ai_model_instance.tokens_per_minute:
+            now = time.time()
+            tokens_key = self.get_tokens_key(ai_model_instance.model_id, int(now // 60))
+            minute_tokens_count = increment(tokens_key, tokens_count, 120)
+            if minute_tokens_count > ai_model_instance.tokens_per_minute and minute_tokens_count > tokens_count:
+                cache.decr(tokens_key, tokens_count)
+                if lease:
+                    self.release(lease)
+                return False, 60 - now % 60, None
+
+        return True, 0, lease
+
+    def reject(self, ai_model_instance, retry_after, waited):
+        ADMISSION_WAIT.labels(model=ai_model_instance.model_id, result='rejected').observe(waited)
+        raise CustomAPIException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            error_code='admission_rejected',
+            error_detail=ERROR_CODES['admission_rejected'],
+            wait=max(math.ceil(retry_after), 1)
+        )
+
+    async def admit(self, ai_model_instance, tokens_count):
+        """
+        Method to wait for the budgets of an AI Model to allow a stream, in turn with the other waiting requests.
+        :param ai_model_instance: Instance of requested AI Model
+        :param tokens_count: Tokens reserved in the tokens per minute budget
+        :return: Coroutine function releasing the stream once it is over, or None if the AI Model has no
+                 concurrency budget
+        """
+        if not ai_model_instance.tokens_per_minute and not ai_model_instance.max_concurrent_streams:
+            return None
+
+        model_id = ai_model_instance.model_id
+        with self._lock:
+            queue = self._queues[model_id]
+            if len(queue) >= self.config['MAX_QUEUE']:
+                self.reject(ai_model_instance, self.config['MAX_WAIT'], 0)
+            ticket = next(self._tickets)
+            queue.append(ticket)
+
+        started_at = time.monotonic()
+        retry_after = self.config['POLL_INTERVAL']
+        try:
+            while True:
+                if queue[0] == ticket:
+                    acquired, retry_after, lease = await sync_to_async(self.try_acquire, thread_sensitive=False)(
+                        ai_model_instance, tokens_count)
+                    if acquired:
+                        break
+
+                waited = time.monotonic() - started_at
+                if waited + self.config['POLL_INTERVAL'] > self.config['MAX_WAIT']:
+                    self.reject(ai_model_instance, retry_after, waited)
+                await asyncio.sleep(self.config['POLL_INTERVAL'])
+        finally:
+            with self._lock:
+                queue.remove(ticket)
+                if not queue:
+                    self._queues.pop(model_id, None)
+
+        ADMISSION_WAIT.labels(model=model_id, result='admitted').observe(time.monotonic() - started_at)
+        return partial(self.arelease, lease) if lease else None
+
+    def release(self, lease):
+        """
+        Method to free the slot of a stream lease, unless the lease expired and the slot was leased again.
+        """
+        stream_key, lease_id = lease
+        if cache.get(stream_key) == lease_id:
+            cache.delete(stream_key)
+
+    async def arelease(self, lease):
+        """
+        Asynchronous version of release(), making the cache requests outside of the event loop.
+        """
+        await sync_to_async(self.release, thread_sensitive=False)(lease)
+
+
+admission_controller = AdmissionController()
@@ -0,0 +1,145 @@
+import json
+import time
+import random
+import asyncio
+import argparse
+import threading
+
+from aiohttp import web
+
+
+class FakeOpenAIServer:
+    """
+    Local stand-in for the Open AI API streaming canned completions and serving moderation results,
+    used to benchmark the chatbot without network latency or API costs.
+    :param chunks_count: Chunks of each completion, bounded by the requested max_tokens
+    :param tokens_per_second: Streaming rate of the completion chunks, unlimited if None
+    :param first_token_latency: Seconds before the first completion chunk
+    :param latency: Seconds before any response headers
+    :param error_rate: Ratio of requests failed with a 500 or 429 error
+    :param seed: Seed of the error sampling
+    """
+
+    def __init__(self, chunks_count=20, tokens_per_second=None, first_token_latency=0.0, latency=0.0,
+                 error_rate=0.0, seed=None):
+        self.chunks_count = chunks_count
+        self.tokens_per_second = tokens_per_second
+        self.first_token_latency = first_token_latency
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.stats = {'requests': 0, 'errors': 0, 'chunks': 0}
+        self.runner = None
+        self.url = None
+
+    def get_application(self):
+        application = web.Application(middlewares=[self.fault_middleware])
+        application.router.add_post('/v1/completions', self.completions)
+        application.router.add_post('/v1/chat/completions', self.completions)
+        application.router.add_post('/v1/moderations', self.moderations)
+        return application
+
+    @web.middleware
+    async def fault_middleware(self, request, handler):
+        self.stats['requests'] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.stats['errors'] += 1
+            if self.random.random() < 0.5:
+                return web.json_response({'error': {'message': 'Rate limit reached', 'type': 'requests',
+                                                    'param': None, 'code': 'rate_limit_exceeded'}},
+                                         status=429, headers={'Retry-After': '1'})
+            return web.json_response({'error': {'message': 'The server had an error', 'type': 'server_error',
+                                                'param': None, 'code': None}}, status=500)
+        return await handler(request)
+
+    def get_chunk(self, request_path, model_id, index):
+        if request_path.endswith('/chat/completions'):
+            choice = {'index': 0, 'delta': {'content': f' token{index}'}, 'finish_reason': None}
+            return {'id': 'chatcmpl-fake', 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                    'model': model_id, 'choices': [choice]}
+        choice = {'index': 0, 'text': f' token{index}', 'finish_reason': None}
+        return {'id': 'cmpl-fake', 'object': 'text_completion', 'created': int(time.time()),
+                'model': model_id, 'choices': [choice]}
+
+    async def completions(self, request):
+        request_data = await request.json()
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+        await response.prepare(request)
+        if self.first_token_latency:
+            await asyncio.sleep(self.first_token_latency)
+
+        for index in range(min(self.chunks_count, request_data.get('max_tokens') or self.chunks_count)):
+            if self.tokens_per_second and index:
+                await asyncio.sleep(1 / self.tokens_per_second)
+            chunk = self.get_chunk(request.path, request_data.get('model'), index)
+            await response.write(f'data: {json.dumps(chunk)}\n\n'.encode())
+            self.stats['chunks'] += 1
+        await response.write(b'data: [DONE]\n\n')
+        await response.write_eof()
+        return response
+
+    async def moderations(self, request):
+        request_data = await request.json()
+        inputs = request_data['input'] if isinstance(request_data['input'], list) else [request_data['input']]
+        return web.json_response({'id': 'modr-fake', 'model': request_data.get('model'),
+                                  'results': [{'flagged': False, 'categories': {}, 'category_scores': {}}
+                                              for _ in inputs]})
+
+    async def start(self, host='127.0.0.1', port=0):
+        """
+        Method to serve the fake API on the running event loop.
+        :return: Base URL of the fake API, to be set as openai.api_base
+        """
+        self.runner = web.AppRunner(self.get_application())
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        host, port = site._server.sockets[0].getsockname()[:2]
+        self.url = f'http://{host}:{port}/v1'
+        return self.url
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+    def start_in_thread(self, host='127.0.0.1', port=0):
+        """
+        Method to serve the fake API from a daemon thread running its own event loop,
+        for callers that are not running an event loop themselves.
+        :return: Base URL of the fake API
+        """
+        loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        def serve():
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(self.start(host, port))
+            started.set()
+            loop.run_forever()
+
+        threading.Thread(target=serve, name='fake-openai', daemon=True).start()
+        started.wait()
+        return self.url
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve a fake Open AI API.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8100)
+    parser.add_argument('--chunks', type=int, default=20)
+    parser.add_argument('--tokens-per-second', type=float, default=None)
+    parser.add_argument('--first-token-latency', type=float, default=0.0)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=None)
+    arguments = parser.parse_args()
+
+    fake_openai_server = FakeOpenAIServer(chunks_count=arguments.chunks,
+                                          tokens_per_second=arguments.tokens_per_second,
+                                          first_token_latency=arguments.first_token_latency,
+                                          latency=arguments.latency,
+                                          error_rate=arguments.error_rate,
+                                          seed=arguments.seed)
+    web.run_app(fake_openai_server.get_application(), host=arguments.host, port=arguments.port)
@@ -0,0 +1,179 @@
+import time
+import uuid
+import threading
+from statistics import (mean,
+                        quantiles)
+
+from asgiref.sync import async_to_sync
+from django.db import connection
+from django.urls import reverse
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from chatbot.models import (AIModel,
+                            ChatQuery,
+                            ChatSession,
+                            ChatResponse)
+from chatbot.persistence import conversation_writer
+from chatbot.constants import AIModel_COMPATIBILITY_CHOICES
+
+ENDPOINTS = ('get-ai-models', 'create-chat-session', 'get-chat-sessions', 'create-conversation',
+             'get-conversations', 'content-moderation', 'content-moderation-batch')
+
+
+def get_percentiles(values):
+    """
+    Function to get the p50, p95 and p99 of a list of values, in milliseconds.
+    """
+    if not values:
+        return None
+    if len(values) == 1:
+        values = values * 2
+    percentiles = quantiles(values, n=100, method='inclusive')
+    return {'p50': round(percentiles[49] * 1000, 2),
+            'p95': round(percentiles[94] * 1000, 2),
+            'p99': round(percentiles[98] * 1000, 2)}
+
+
+class LoadDriver:
+    """
+    Load driver calling every chatbot endpoint in-process through the Django test client,
+    measuring latencies, time to first token, streamed tokens per second and database queries per request.
+    :param requests_count: Requests per endpoint
+    :param concurrency: Concurrent clients
+    :param model_id: Open AI model ID of the AI Model used by the completions
+    :param compatibility: Compatibility of the AI Model
+    :param history_length: Conversations of the seeded chat session
+    """
+
+    def __init__(self, requests_count, concurrency, model_id='gpt-3.5-turbo',
+                 compatibility=AIModel_COMPATIBILITY_CHOICES[1][0], history_length=50):
+        self.requests_count = requests_count
+        self.concurrency = concurrency
+        self.model_id = model_id
+        self.compatibility = compatibility
+        self.history_length = history_length
+        self.chat_session = None
+        self._local = threading.local()
+
+    def setup_data(self):
+        """
+        Method to create the AI Model and a chat session with a conversation history.
+        """
+        AIModel.objects.update_or_create(model_id=self.model_id,
+                                         defaults={'max_tokens': 4096, 'compatibility': self.compatibility})
+        self.chat_session = ChatSession.objects.create(title=f'Benchmark {uuid.uuid4()}')
+        for index in range(self.history_length):
+            chat_query = ChatQuery.objects.create(content=f'Benchmark history query {index}',
+                                                  chat_session=self.chat_session)
+            ChatResponse.objects.create(content=f'Benchmark history response {index}', chat_query=chat_query)
+
+    def get_request(self, endpoint, index):
+        """
+        Method to get the method, path and data of the request of an endpoint.
+        """
+        if endpoint == 'create-chat-session':
+            return 'post', reverse(endpoint), {'title': f'Benchmark {uuid.uuid4()}', 'model_id': self.model_id,
+                                               'query_content': f'Benchmark query {index}'}
+        if endpoint == 'create-conversation':
+            return 'post', reverse(endpoint, args=[self.chat_session.id]), {'model_id': self.model_id,
+                                                                            'query_content': f'Benchmark query {index}'}
+        if endpoint == 'get-conversations':
+            return 'get', reverse(endpoint, args=[self.chat_session.id]), None
+        if endpoint == 'content-moderation':
+            return 'post', reverse(endpoint), {'content': f'Benchmark content {index}'}
+        if endpoint == 'content-moderation-batch':
+            return 'post', reverse(endpoint), {'contents': [f'Benchmark content {index}.{item}' for item in range(20)]}
+        return 'get', reverse(endpoint), None
+
+    @staticmethod
+    async def read_async_stream(streaming_content):
+        chunk_times = list()
+        async for chunk in streaming_content:
+            if chunk:
+                chunk_times.append(time.perf_counter())
+        return chunk_times
+
+    def measure(self, endpoint, index):
+        """
+        Method to make one request of an endpoint and measure it.
+        Exceptions raised while streaming, after the response headers, are sampled as errors.
+        :return: Request sample
+        """
+        if not hasattr(self._local, 'client'):
+            self._local.client = Client()
+        method, path, data = self.get_request(endpoint, index)
+
+        with CaptureQueriesContext(connection) as captured_queries:
+            started_at = time.perf_counter()
+            if method == 'post':
+                response = self._local.client.post(path, data, content_type='application/json')
+            else:
+                response = self._local.client.get(path)
+
+            status_code = response.status_code
+            try:
+                if not response.streaming:
+                    chunk_times = [time.perf_counter()]
+                elif response.is_async:
+                    chunk_times = async_to_sync(self.read_async_stream)(response.streaming_content)
+                else:
+                    chunk_times = [time.perf_counter() for chunk in response.streaming_content if chunk]
+            except Exception:
+                status_code, chunk_times = None, list()
+            finished_at = time.perf_counter()
+
+        return {'status_code': status_code,
+                'latency': finished_at - started_at,
+                'time_to_first_token': chunk_times[0] - started_at if chunk_times else None,
+                'tokens_per_second': (len(chunk_times) - 1) / (chunk_times[-1] - chunk_times[0])
+                if response.streaming and len(chunk_times) > 1 and chunk_times[-1] > chunk_times[0] else None,
+                'db_queries': len(captured_queries)}
+
+    def run_endpoint(self, endpoint):
+        """
+        Method to load an endpoint and summarize its samples.
+        """
+        indexes = iter(range(self.requests_count))
+        indexes_lock = threading.Lock()
+        samples = list()
+
+        def work():
+            while True:
+                with indexes_lock:
+                    index = next(indexes, None)
+                if index is None:
+                    break
+                samples.append(self.measure(endpoint, index))
+            connection.close()
+
+        started_at = time.perf_counter()
+        workers = [threading.Thread(target=work) for _ in range(self.concurrency)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        duration = time.perf_counter() - started_at
+
+        succeeded = [sample for sample in samples if sample['status_code'] and 200 <= sample['status_code'] < 300]
+        tokens_per_second = [sample['tokens_per_second'] for sample in succeeded if sample['tokens_per_second']]
+        return {'requests': len(samples),
+                'errors': len(samples) - len(succeeded),
+                'requests_per_second': round(len(samples) / duration, 2),
+                'latency_ms': get_percentiles([sample['latency'] for sample in succeeded]),
+                'time_to_first_token_ms': get_percentiles([sample['time_to_first_token'] for sample in succeeded
+                                                           if sample['time_to_first_token'] is not None]),
+                'tokens_per_second': round(mean(tokens_per_second), 2) if tokens_per_second else None,
+                'db_queries_per_request': round(mean(sample['db_queries'] for sample in samples), 2)}
+
+    def run(self, endpoints=ENDPOINTS):
+        """
+        Method to load every endpoint in turn.
+        :return: Summaries by endpoint
+        """
+        self.setup_data()
+        report = dict()
+        for endpoint in endpoints:
+            report[endpoint] = self.run_endpoint(endpoint)
+            conversation_writer.flush()
+        return report
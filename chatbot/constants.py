@@ -7,4 +7,77 @@ AIModel_COMPATIBILITY_CHOICES = (
     ('CHAT_COMPLETION', 'Chat Completion')
 )
 
+AIModel_ROUTING_POLICY_CHOICES = (
+    ('LEAST_OUTSTANDING', 'Weighted least outstanding requests'),
+    ('EWMA_LATENCY', 'Weighted EWMA latency')
+)
+
 AI_CHAT_SYSTEM_INSTRUCTION = 'You are a friendly chatbot capable of providing precise answers to human queries'
+
+# Instruction of the chat session summaries, and message carrying the summary in the prompts
+AI_CHAT_SUMMARY_INSTRUCTION = 'Update the summary of a conversation between a user and a chatbot with its new turns. ' \
+                              'Keep the facts, names, preferences and open questions needed to continue the ' \
+                              'conversation, and answer with the summary only'
+AI_CHAT_SUMMARY_MESSAGE = 'Summary of the earlier conversation: {}'
+
+# Maximum number of latest conversations considered for the prompt context window
+CHAT_HISTORY_LIMIT = 100
+
+# Django cache key of the AI Model registry version stamp
+AI_MODEL_REGISTRY_VERSION_KEY = 'chatbot:ai_model_registry:version'
+
+# Seconds between two checks of the AI Model registry version stamp
+AI_MODEL_REGISTRY_CHECK_INTERVAL = 1
+
+# Open AI moderation model
+MODERATION_MODEL = 'text-moderation-latest'
+
+# Moderation results cache size and timeout in seconds
+MODERATION_CACHE_MAX_ENTRIES = 10000
+MODERATION_CACHE_TIMEOUT = 24 * 60 * 60
+
+# Limits of the contents packed into a single moderation request
+MODERATION_BATCH_MAX_ITEMS = 32
+MODERATION_BATCH_MAX_CHARACTERS = 32000
+
+# Maximum number of concurrent moderation requests of a batch
+MODERATION_BATCH_CONCURRENCY = 4
+
+# Maximum number of contents accepted by the batch moderation API
+MODERATION_BATCH_MAX_CONTENTS = 2000
+
+# Retries of Open AI requests: attempts, base and maximum backoff delays in seconds
+RETRY_MAX_ATTEMPTS = 4
+RETRY_BASE_DELAY = 1
+RETRY_MAX_DELAY = 8
+
+# Circuit breaker of Open AI requests: failures within the window (seconds) that open the
+# circuit, and seconds before an open circuit lets requests through again
+CIRCUIT_BREAKER_FAILURE_THRESHOLD = 5
+CIRCUIT_BREAKER_FAILURE_WINDOW = 60
+CIRCUIT_BREAKER_RECOVERY_TIMEOUT = 30
+
+# Routing across the endpoints of an AI Model: smoothing factor of the EWMA latencies, and seconds a rate limited
+# endpoint is avoided when its response has no Retry-After header
+ROUTING_EWMA_ALPHA = 0.3
+ROUTING_THROTTLE_COOLDOWN = 10
+
+# Routing policy of the moderation requests across the endpoints serving them
+MODERATION_ROUTING_POLICY = 'EWMA_LATENCY'
+
+# Seconds a stream lease of an AI Model lives, bounding how long a stream that was never released holds its slot
+ADMISSION_STREAM_LEASE_TIMEOUT = 10 * 60
+
+# Completion responses cache size and default timeout in seconds
+COMPLETION_CACHE_MAX_ENTRIES = 1000
+COMPLETION_CACHE_TIMEOUT = 60 * 60
+
+# Fine-tuning datasets: maximum tokens of a training example, maximum shard size in bytes,
+# and training price in dollars per thousand tokens
+FINE_TUNE_MAX_EXAMPLE_TOKENS = 4096
+FINE_TUNE_SHARD_MAX_BYTES = 100 * 1024 * 1024
+FINE_TUNE_PRICE_PER_1K_TOKENS = 0.008
+
+# Fine-tuning datasets: Jaccard similarity from which examples are near-duplicates, and fraction of the validation split
+FINE_TUNE_DUPLICATE_THRESHOLD = 0.8
+FINE_TUNE_VALIDATION_RATIO = 0.1
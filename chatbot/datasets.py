@@ -0,0 +1,145 @@
+import re
+import csv
+import sys
+import json
+import zlib
+import hashlib
+
+import numpy as np
+
+# Mersenne prime of the MinHash permutations, and mask keeping the permuted hashes on 32 bits.
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+
+
+def read_records(input_path):
+    """
+    Function to lazily read the records of a CSV file, or of a JSONL file for any other extension.
+    :param input_path: Path of the data file
+    :return: Generator of record dictionaries
+    """
+    with open(input_path, newline='') as input_file:
+        if input_path.endswith('.csv'):
+            csv.field_size_limit(sys.maxsize)
+            yield from csv.DictReader(input_file)
+        else:
+            yield from (json.loads(line) for line in input_file if line.strip())
+
+
+class RecordWriter:
+    """
+    Writer of records to a CSV file, or to a JSONL file for any other extension.
+    :param output_path: Path of the data file
+    :param field_names: CSV columns
+    """
+
+    def __init__(self, output_path, field_names=None):
+        self.output_path = output_path
+        self._file = open(output_path, 'w', newline='')
+        self._csv_writer = None
+        if output_path.endswith('.csv'):
+            self._csv_writer = csv.DictWriter(self._file, fieldnames=field_names)
+            self._csv_writer.writeheader()
+
+    def write(self, record):
+        if self._csv_writer:
+            self._csv_writer.writerow(record)
+        else:
+            self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    def close(self):
+        self._file.close()
+
+
+class MinHasher:
+    """
+    MinHash signatures of texts, estimating the Jaccard similarity of their sets of word shingles
+    as the fraction of equal signature values.
+    :param num_perm: Signature length
+    :param shingle_size: Words by shingle
+    :param seed: Seed of the permutations, signatures are only comparable under the same seed
+    """
+
+    def __init__(self, num_perm=128, shingle_size=3, seed=1):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        random_generator = np.random.default_rng(seed)
+        self.a = random_generator.integers(1, MAX_HASH, num_perm, dtype=np.uint64)
+        self.b = random_generator.integers(0, MAX_HASH, num_perm, dtype=np.uint64)
+
+    def get_shingles(self, text):
+        """
+        Method to get the 32 bits hashes of the word shingles of a normalized text.
+        """
+        words = re.findall(r'\w+', text.lower())
+        return {zlib.crc32(' '.join(words[index:index + self.shingle_size]).encode())
+                for index in range(max(len(words) - self.shingle_size + 1, 1))}
+
+    def get_signature(self, text):
+        """
+        Method to get the MinHash signature of a text.
+        :return: Array of num_perm 32 bits values
+        """
+        shingles = np.fromiter(self.get_shingles(text), dtype=np.uint64)[:, np.newaxis]
+        permuted = ((shingles * self.a + self.b) % MERSENNE_PRIME) & MAX_HASH
+        return permuted.min(axis=0).astype(np.uint32)
+
+
+def get_bands(threshold, num_perm):
+    """
+    Function to get the LSH banding whose candidate probability curve, 1 - (1 - s ** rows) ** bands,
+    rises steepest at the similarity threshold.
+    :param threshold: Jaccard similarity threshold
+    :param num_perm: Signature length
+    :return: Bands count and rows by band
+    """
+    return min(((bands, num_perm // bands) for bands in range(1, num_perm + 1)),
+               key=lambda banding: abs((1 / banding[0]) ** (1 / banding[1]) - threshold))
+
+
+def find_clusters(signatures, threshold):
+    """
+    Function to cluster near-duplicate signatures with LSH, in linear time. Within each band the rows
+    sharing a bucket are compared with the first row of the bucket only, and the pairs estimated at least
+    as similar as the threshold are merged, transitively.
+    :param signatures: Array of the MinHash signatures of the rows
+    :param threshold: Jaccard similarity threshold
+    :return: Array of the cluster of each row, the lowest row index of the cluster
+    """
+    rows_count, num_perm = signatures.shape
+    parents = np.arange(rows_count)
+
+    def find(index):
+        while parents[index] != index:
+            parents[index] = parents[parents[index]]
+            index = parents[index]
+        return index
+
+    bands, rows = get_bands(threshold, num_perm)
+    for band in range(bands):
+        band_values = np.ascontiguousarray(signatures[:, band * rows:(band + 1) * rows])
+        _, first_indexes, buckets = np.unique(band_values.view(np.dtype((np.void, rows * 4))).ravel(),
+                                              return_index=True, return_inverse=True)
+        candidates = np.flatnonzero(first_indexes[buckets] != np.arange(rows_count))
+        representatives = first_indexes[buckets[candidates]]
+        similarities = (signatures[candidates] == signatures[representatives]).mean(axis=1)
+
+        for index, representative in zip(candidates[similarities >= threshold],
+                                         representatives[similarities >= threshold]):
+            index_root, representative_root = find(index), find(representative)
+            if index_root != representative_root:
+                parents[max(index_root, representative_root)] = min(index_root, representative_root)
+
+    return np.array([find(index) for index in range(rows_count)])
+
+
+def get_split(text, validation_ratio, seed=0):
+    """
+    Function to deterministically assign a text to the train or validation split from its hash.
+    :param text: Text of the cluster representative
+    :param validation_ratio: Expected fraction of the validation split
+    :param seed: Seed of the split
+    :return: 'train' or 'validation'
+    """
+    digest = hashlib.blake2b(f'{seed}:{text}'.encode(), digest_size=8).digest()
+    return 'validation' if int.from_bytes(digest, 'big') / 2 ** 64 < validation_ratio else 'train'
@@ -0,0 +1,85 @@
+"""
+API docs of the chatbot views.
+Kept apart from the views and imported along with the docs URLs only, so that the workers serving
+the APIs alone do not import drf_yasg.
+"""
+from drf_yasg import openapi
+from drf_yasg.utils import swagger_auto_schema
+
+from .views import (GetChatSessions,
+                    GetConversations,
+                    CreateChatSession,
+                    ContentModeration,
+                    CreateConversation,
+                    ContentModerationBatch)
+
+swagger_auto_schema(
+    request_body=openapi.Schema(
+        type=openapi.TYPE_OBJECT,
+        required=['data', 'title', 'model_id', 'query_content'],
+        properties={
+            'title': openapi.Schema(type=openapi.TYPE_STRING,
+                                    description='Chat session title'),
+            'model_id': openapi.Schema(type=openapi.TYPE_STRING,
+                                       description='Open AI model ID'),
+            'query_content': openapi.Schema(type=openapi.TYPE_STRING,
+                                            description='Query text')
+        }
+    ),
+    responses={'200': 'Streaming text completion response'}
+)(CreateChatSession.post)
+
+swagger_auto_schema(
+    manual_parameters=[openapi.Parameter(name='expand', in_=openapi.IN_QUERY, type='string',
+                                         description='Comma separated expandable fields: '
+                                                     'queries_count, last_activity_at, last_model, '
+                                                     'summary, summarized_query',
+                                         required=False)],
+)(GetChatSessions.get)
+
+swagger_auto_schema(
+    request_body=openapi.Schema(
+        type=openapi.TYPE_OBJECT,
+        required=['data', 'model_id', 'query_content'],
+        properties={
+            'model_id': openapi.Schema(type=openapi.TYPE_STRING,
+                                       description='Open AI model ID'),
+            'query_content': openapi.Schema(type=openapi.TYPE_STRING,
+                                            description='Query text')
+        }
+    ),
+    manual_parameters=[openapi.Parameter(name='id', in_=openapi.IN_PATH,
+                                         type='string', description='ChatSession ID'),
+                       openapi.Parameter(name='regenerate', in_=openapi.IN_QUERY,
+                                         type='string', description='ChatQuery ID', required=False)],
+    responses={'200': 'Streaming text completion response'}
+)(CreateConversation.post)
+
+swagger_auto_schema(
+    manual_parameters=[openapi.Parameter(name='id', in_=openapi.IN_PATH, type='string',
+                                         description='ChatSession ID'),
+                       openapi.Parameter(name='expand', in_=openapi.IN_QUERY, type='string',
+                                         description='Comma separated expandable fields: chat_responses',
+                                         required=False)],
+)(GetConversations.get)
+
+swagger_auto_schema(
+    request_body=openapi.Schema(
+        type=openapi.TYPE_OBJECT,
+        required=['data', 'content'],
+        properties={'content': openapi.Schema(type=openapi.TYPE_STRING,
+                                              description='Text-content to be moderated')}
+    ),
+    responses={'200': 'Moderation results'}
+)(ContentModeration.post)
+
+swagger_auto_schema(
+    request_body=openapi.Schema(
+        type=openapi.TYPE_OBJECT,
+        required=['data', 'contents'],
+        properties={'contents': openapi.Schema(type=openapi.TYPE_ARRAY,
+                                               items=openapi.Schema(type=openapi.TYPE_STRING),
+                                               description='Text-contents to be moderated')}
+    ),
+    responses={'200': 'Moderation results in input order'}
+)(ContentModerationBatch.post)
@@ -1,58 +1,40 @@
 import os
-import time
+import asyncio
+import logging
 import openai
-import pandas as pd
 from dotenv import load_dotenv
 
+from chatbot.synthetic_data import SyntheticDataGenerator
+
 load_dotenv()
 openai.api_key = os.getenv("OPENAI_API_KEY")
+logging.basicConfig(level=logging.INFO)
+
+output_dir = os.path.dirname(os.path.abspath(__file__))
 
-gender_list = ["male", "female"]
-age_list = [6, 13, 18, 24, 30, 42, 50, 60, 75, 90]
-disease_list = ["flu", "common cold", "mononucleosis", "dengue", "malaria", "anemia",
-                "alcoholism", "tuberculosis", "herpes simplex", "migraine"]
+parameter_grid = {
+    'age': [6, 13, 18, 24, 30, 42, 50, 60, 75, 90],
+    'gender': ["male", "female"],
+    'disease': ["flu", "common cold", "mononucleosis", "dengue", "malaria", "anemia",
+                "alcoholism", "tuberculosis", "herpes simplex", "migraine"],
+}
 
 prompt_format = ("Generate a structured and comprehensive treatment plan for a "
                  "{age} year old {gender} diagnosed with {disease}.")
 sub_prompt_format = "{age}, {gender}, {disease}"
 
-training_data = pd.DataFrame()
-for age in age_list:
-    for gender in gender_list:
-        for disease in disease_list:
-            for attempt in range(5):
-                try:
-                    prompt = prompt_format.format(age=age, gender=gender, disease=disease)
-                    sub_prompt = sub_prompt_format.format(age=age, gender=gender, disease=disease)
-
-                    completion_response = openai.ChatCompletion.create(
-                        model='gpt-3.5-turbo',
-                        messages=[{'role': 'user', 'content': prompt}],
-                    )
-
-                    training_data = pd.concat([
-                        training_data,
-                        pd.DataFrame([{
-                            'age': age,
-                            'gender': gender,
-                            'disease': disease,
-                            'prompt': prompt,
-                            'sub_prompt': sub_prompt,
-                            'response_text': completion_response['choices'][0]['message']['content'],
-                            'finish_reason': completion_response['choices'][0]['finish_reason']
-                        }])
-                    ], axis=0, ignore_index=True)
-
-                    time.sleep(20)
-
-                except openai.error.OpenAIError as exception:
-                    if isinstance(exception, (openai.error.Timeout,
-                                              openai.error.APIError,
-                                              openai.error.RateLimitError,
-                                              openai.error.APIConnectionError,
-                                              openai.error.ServiceUnavailableError)) and attempt < 4:
-                        time.sleep(attempt * 3)
-                        continue
-                    raise exception
-
-training_data.to_csv('training_data.csv')
+synthetic_data_generator = SyntheticDataGenerator(
+    prompt_format=prompt_format,
+    sub_prompt_format=sub_prompt_format,
+    parameter_grid=parameter_grid,
+    samples_count=5,
+    max_tokens=1024,
+    output_path=os.path.join(output_dir, 'training_data.jsonl'),
+    requests_per_minute=int(os.getenv("OPENAI_REQUESTS_PER_MINUTE", 3500)),
+    tokens_per_minute=int(os.getenv("OPENAI_TOKENS_PER_MINUTE", 90000)),
+)
+
+summary = asyncio.run(synthetic_data_generator.run())
+logging.info('Synthetic training data: %s', summary)
+if not summary['failed']:
+    synthetic_data_generator.export_csv(os.path.join(output_dir, 'training_data.csv'))
@@ -0,0 +1,53 @@
+from django.db.models import Q
+from django.core.management.base import BaseCommand
+
+from chatbot.models import (AIModel,
+                            ChatQuery,
+                            ChatResponse)
+from chatbot.tokens import get_encoding
+
+
+class Command(BaseCommand):
+    help = 'Compute and store the missing per-encoding tokens count of Chat Queries and Chat Responses.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of rows tokenized and updated at a time')
+
+    def handle(self, *args, **options):
+        encodings = {encoding.name: encoding
+                     for encoding in map(get_encoding, AIModel.objects.values_list('model_id', flat=True))}
+
+        for model in (ChatQuery, ChatResponse):
+            missing_filter = Q()
+            for encoding_name in encodings:
+                missing_filter |= ~Q(tokens_count__has_key=encoding_name)
+
+            updated_count = 0
+            batch = list()
+            for instance in model.objects.filter(missing_filter).only('id', 'content', 'tokens_count').iterator(
+                    chunk_size=options['batch_size']):
+                batch.append(instance)
+                if len(batch) >= options['batch_size']:
+                    updated_count += self.update_tokens_count(model, batch, encodings)
+                    batch = list()
+            updated_count += self.update_tokens_count(model, batch, encodings)
+
+            self.stdout.write(self.style.SUCCESS(f'{model.__name__} instances updated: {updated_count}'))
+
+    @staticmethod
+    def update_tokens_count(model, instances, encodings):
+        """
+        Method to tokenize a batch of instances with every encoding they miss and save them.
+        :param model: Chat Query or Chat Response model
+        :param instances: Batch of model instances
+        :param encodings: Encoding instances mapped by name
+        :return: Number of updated instances
+        """
+        for encoding_name, encoding in encodings.items():
+            missing = [instance for instance in instances if encoding_name not in instance.tokens_count]
+            for instance, tokens in zip(missing, encoding.encode_batch([instance.content for instance in missing])):
+                instance.tokens_count[encoding_name] = len(tokens)
+
+        model.objects.bulk_update(instances, ['tokens_count'])
+        return len(instances)
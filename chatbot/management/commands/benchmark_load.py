@@ -0,0 +1,72 @@
+import json
+import subprocess
+
+import openai
+from django.db import connection
+from django.test.utils import (setup_test_environment,
+                               teardown_test_environment)
+from django.core.management.base import BaseCommand
+
+from chatbot.benchmarks.load_driver import (ENDPOINTS,
+                                            LoadDriver)
+from chatbot.benchmarks.fake_openai import FakeOpenAIServer
+
+
+class Command(BaseCommand):
+    help = 'Load every chatbot endpoint against a local fake Open AI server, on a test database, ' \
+           'and report latencies, time to first token, tokens per second and database queries as JSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=100, help='Requests per endpoint')
+        parser.add_argument('--concurrency', type=int, default=10)
+        parser.add_argument('--endpoints', nargs='+', choices=ENDPOINTS, default=ENDPOINTS)
+        parser.add_argument('--model-id', default='gpt-3.5-turbo')
+        parser.add_argument('--chunks', type=int, default=50, help='Tokens streamed by each completion')
+        parser.add_argument('--tokens-per-second', type=float, default=None)
+        parser.add_argument('--first-token-latency', type=float, default=0.0)
+        parser.add_argument('--latency', type=float, default=0.0)
+        parser.add_argument('--error-rate', type=float, default=0.0)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--keepdb', action='store_true', help='Preserve the test database between runs')
+        parser.add_argument('--output', help='Path of the JSON report, printed if omitted')
+
+    @staticmethod
+    def get_commit():
+        try:
+            return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                  check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def handle(self, *args, **options):
+        fake_openai_server = FakeOpenAIServer(chunks_count=options['chunks'],
+                                              tokens_per_second=options['tokens_per_second'],
+                                              first_token_latency=options['first_token_latency'],
+                                              latency=options['latency'],
+                                              error_rate=options['error_rate'],
+                                              seed=options['seed'])
+        api_base, openai.api_base = openai.api_base, fake_openai_server.start_in_thread()
+        api_key, openai.api_key = openai.api_key, openai.api_key or 'fake-key'
+
+        setup_test_environment()
+        database_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options['keepdb'])
+        try:
+            load_driver = LoadDriver(requests_count=options['requests'], concurrency=options['concurrency'],
+                                     model_id=options['model_id'])
+            report = {'commit': self.get_commit(),
+                      'options': {key: options[key] for key in ('requests', 'concurrency', 'model_id', 'chunks',
+                                                                'tokens_per_second', 'first_token_latency',
+                                                                'latency', 'error_rate', 'seed')},
+                      'endpoints': load_driver.run(options['endpoints']),
+                      'fake_openai': fake_openai_server.stats}
+        finally:
+            connection.creation.destroy_test_db(database_name, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+            openai.api_base, openai.api_key = api_base, api_key
+
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                json.dump(report, output_file, indent=2)
+        else:
+            self.stdout.write(json.dumps(report, indent=2))
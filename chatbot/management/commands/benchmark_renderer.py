@@ -0,0 +1,71 @@
+import json
+import time
+import random
+from datetime import (datetime,
+                      timedelta,
+                      timezone)
+
+from rest_framework.response import Response
+from django.core.management.base import BaseCommand
+
+from utilities.utilities import (CustomResponseRenderer,
+                                 CustomCursorPagination)
+
+
+class Command(BaseCommand):
+    help = 'Compare the response renderer with stdlib json.dumps on conversation pages.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, default=200)
+        parser.add_argument('--response-length', type=int, default=2000)
+        parser.add_argument('--responses-count', type=int, default=0,
+                            help='Chat responses per conversation, as expanded by ?expand=chat_responses')
+
+    @staticmethod
+    def get_words(count):
+        return ' '.join(random.choice(('model', 'output', 'token', 'context', 'réponse', '応答'))
+                        for _ in range(count))
+
+    def get_conversation_page(self, page, options):
+        created_at = datetime(2023, 9, 1, tzinfo=timezone.utc) + timedelta(hours=page)
+        results = list()
+        for index in range(CustomCursorPagination.page_size):
+            chat_responses = [{'id': index * 10 + response_index,
+                               'content': self.get_words(options['response_length'] // 7),
+                               'tokens_count': {'cl100k_base': options['response_length'] // 4},
+                               'created_at': created_at.isoformat(),
+                               'chat_query': index}
+                              for response_index in range(max(options['responses_count'], 1))]
+            conversation = {'id': index,
+                            'content': self.get_words(40),
+                            'tokens_count': {'cl100k_base': 50},
+                            'created_at': created_at.isoformat(),
+                            'chat_session': page,
+                            'latest_response': chat_responses[-1],
+                            'responses_count': len(chat_responses)}
+            if options['responses_count']:
+                conversation['chat_responses'] = chat_responses
+            results.append(conversation)
+
+        return {'data': {'links': {'next': None, 'previous': None}, 'results': results},
+                'message': 'Conversations fetched successfully.'}
+
+    @staticmethod
+    def time_render(render, pages):
+        started_at = time.perf_counter()
+        size = sum(len(render(page)) for page in pages)
+        return {'ms_per_page': round((time.perf_counter() - started_at) * 1000 / len(pages), 3),
+                'bytes_per_page': size // len(pages)}
+
+    def handle(self, *args, **options):
+        pages = [self.get_conversation_page(page, options) for page in range(options['pages'])]
+        renderer = CustomResponseRenderer()
+        renderer_context = {'response': Response(status=200)}
+
+        def render_stdlib(data):
+            return json.dumps(renderer.get_envelope(data, 200)).encode()
+
+        report = {'stdlib_json': self.time_render(render_stdlib, pages),
+                  'renderer': self.time_render(lambda data: renderer.render(data, None, renderer_context), pages)}
+        report['speedup'] = round(report['stdlib_json']['ms_per_page'] / report['renderer']['ms_per_page'], 2)
+        self.stdout.write(json.dumps(report, indent=2))
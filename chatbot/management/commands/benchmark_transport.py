@@ -0,0 +1,69 @@
+import json
+import time
+import asyncio
+from statistics import quantiles
+
+import openai
+from django.core.management.base import BaseCommand
+
+from chatbot.transport import upstream_transport
+from chatbot.benchmarks.fake_openai import FakeOpenAIServer
+
+
+class Command(BaseCommand):
+    help = 'Compare streaming completion latencies with and without the pooled keep-alive transport ' \
+           'against a local fake Open AI server.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--concurrency', type=int, default=20)
+        parser.add_argument('--chunks', type=int, default=20)
+
+    async def stream(self, pooled):
+        if pooled:
+            upstream_transport.activate()
+        else:
+            openai.aiosession.set(None)
+
+        started_at = time.perf_counter()
+        async for _ in upstream_transport.iter_stream(openai.ChatCompletion.acreate(
+            stream=True,
+            model='gpt-3.5-turbo',
+            messages=[{'role': 'user', 'content': 'Benchmark'}],
+            request_timeout=upstream_transport.stream_timeout
+        )):
+            pass
+        return time.perf_counter() - started_at
+
+    async def run(self, pooled, requests_count, concurrency):
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def limited_stream():
+            async with semaphore:
+                return await self.stream(pooled)
+
+        started_at = time.perf_counter()
+        latencies = await asyncio.gather(*[limited_stream() for _ in range(requests_count)])
+        duration = time.perf_counter() - started_at
+        percentiles = quantiles(latencies, n=100)
+        return {'requests_per_second': round(requests_count / duration, 2),
+                'p50_ms': round(percentiles[49] * 1000, 2),
+                'p95_ms': round(percentiles[94] * 1000, 2),
+                'p99_ms': round(percentiles[98] * 1000, 2)}
+
+    async def benchmark(self, options):
+        server = FakeOpenAIServer(chunks_count=options['chunks'])
+        api_base, openai.api_base = openai.api_base, await server.start()
+        api_key, openai.api_key = openai.api_key, openai.api_key or 'fake-key'
+        try:
+            report = {'unpooled': await self.run(False, options['requests'], options['concurrency']),
+                      'pooled': await self.run(True, options['requests'], options['concurrency'])}
+            report['pool'] = upstream_transport.get_pool_stats()
+            await upstream_transport.get_aiohttp_session().close()
+            return report
+        finally:
+            openai.api_base, openai.api_key = api_base, api_key
+            await server.stop()
+
+    def handle(self, *args, **options):
+        self.stdout.write(json.dumps(asyncio.run(self.benchmark(options)), indent=2))
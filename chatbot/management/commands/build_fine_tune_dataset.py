@@ -0,0 +1,130 @@
+import os
+import json
+from itertools import islice
+
+from django.core.management.base import (BaseCommand,
+                                         CommandError)
+
+from chatbot.datasets import read_records
+from chatbot.tokens import (get_encoding,
+                            get_message_overhead)
+from chatbot.constants import (FINE_TUNE_SHARD_MAX_BYTES,
+                               FINE_TUNE_MAX_EXAMPLE_TOKENS,
+                               FINE_TUNE_PRICE_PER_1K_TOKENS,
+                               AIModel_COMPATIBILITY_CHOICES)
+
+
+class ShardWriter:
+    """
+    Writer of JSONL lines split into files of a bounded size.
+    """
+
+    def __init__(self, output_dir, prefix, max_bytes):
+        self.output_dir = output_dir
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.paths = list()
+        self._file = None
+        self._size = 0
+
+    def write(self, record):
+        line = (json.dumps(record, ensure_ascii=False) + '\n').encode()
+        if self._file is None or (self._size and self._size + len(line) > self.max_bytes):
+            self.rotate()
+        self._file.write(line)
+        self._size += len(line)
+
+    def rotate(self):
+        self.close()
+        self.paths.append(os.path.join(self.output_dir, f'{self.prefix}_{len(self.paths):03d}.jsonl'))
+        self._file = open(self.paths[-1], 'wb')
+        self._size = 0
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class Command(BaseCommand):
+    help = 'Convert CSV or JSONL training data into size-bounded chat format JSONL shards, chunk by chunk, ' \
+           'with per example token accounting and a training cost estimate.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('input_path', help='CSV or JSONL training data')
+        parser.add_argument('--output-dir', default='.')
+        parser.add_argument('--prefix', default='training_file')
+        parser.add_argument('--model-id', default='gpt-3.5-turbo', help='Model to fine-tune, selects the encoding')
+        parser.add_argument('--prompt-field', default='sub_prompt', help='Field of the user message')
+        parser.add_argument('--completion-field', default='response_text', help='Field of the assistant message')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Examples read and tokenized at a time')
+        parser.add_argument('--max-example-tokens', type=int, default=FINE_TUNE_MAX_EXAMPLE_TOKENS)
+        parser.add_argument('--flag-overflow', action='store_true',
+                            help='Write the examples over the tokens limit to an overflow file '
+                                 'instead of dropping them')
+        parser.add_argument('--shard-max-bytes', type=int, default=FINE_TUNE_SHARD_MAX_BYTES)
+        parser.add_argument('--epochs', type=int, default=2)
+        parser.add_argument('--price-per-1k-tokens', type=float, default=FINE_TUNE_PRICE_PER_1K_TOKENS)
+
+    @staticmethod
+    def read_examples(input_path, prompt_field, completion_field):
+        """
+        Method to lazily read the training examples in chat format.
+        Records holding 'messages' are taken as they are.
+        """
+        for record in read_records(input_path):
+            if 'messages' in record:
+                yield record['messages']
+            else:
+                yield [{'role': 'user', 'content': record[prompt_field]},
+                       {'role': 'assistant', 'content': record[completion_field]}]
+
+    @staticmethod
+    def count_tokens(examples, encoding):
+        """
+        Method to count the tokens of a chunk of examples with a single batched encoding.
+        """
+        contents = [message['content'] for messages in examples for message in messages]
+        contents_tokens = iter(encoding.encode_batch(contents))
+        return [sum(len(next(contents_tokens)) + get_message_overhead(encoding, AIModel_COMPATIBILITY_CHOICES[1][0],
+                                                                      message['role'])
+                    for message in messages)
+                for messages in examples]
+
+    def handle(self, *args, **options):
+        if not os.path.exists(options['input_path']):
+            raise CommandError(f"{options['input_path']} does not exist.")
+
+        os.makedirs(options['output_dir'], exist_ok=True)
+        encoding = get_encoding(options['model_id'])
+        shard_writer = ShardWriter(options['output_dir'], options['prefix'], options['shard_max_bytes'])
+        overflow_writer = ShardWriter(options['output_dir'], f"{options['prefix']}_overflow",
+                                      options['shard_max_bytes']) if options['flag_overflow'] else None
+        report = {'examples': 0, 'written': 0, 'over_limit': 0, 'training_tokens': 0, 'max_example_tokens': 0}
+
+        examples = self.read_examples(options['input_path'], options['prompt_field'], options['completion_field'])
+        try:
+            while chunk := list(islice(examples, options['chunk_size'])):
+                for messages, tokens_count in zip(chunk, self.count_tokens(chunk, encoding)):
+                    report['examples'] += 1
+                    if tokens_count > options['max_example_tokens']:
+                        report['over_limit'] += 1
+                        if overflow_writer:
+                            overflow_writer.write({'messages': messages, 'tokens_count': tokens_count})
+                        continue
+
+                    shard_writer.write({'messages': messages})
+                    report['written'] += 1
+                    report['training_tokens'] += tokens_count
+                    report['max_example_tokens'] = max(report['max_example_tokens'], tokens_count)
+        finally:
+            shard_writer.close()
+            if overflow_writer:
+                overflow_writer.close()
+
+        report['epochs'] = options['epochs']
+        report['estimated_cost'] = round(report['training_tokens'] * options['epochs']
+                                         * options['price_per_1k_tokens'] / 1000, 2)
+        report['shards'] = shard_writer.paths
+        report['overflow_shards'] = overflow_writer.paths if overflow_writer else list()
+        self.stdout.write(json.dumps(report, indent=2))
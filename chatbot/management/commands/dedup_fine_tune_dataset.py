@@ -0,0 +1,92 @@
+import os
+import json
+
+import numpy as np
+from django.core.management.base import (BaseCommand,
+                                         CommandError)
+
+from chatbot.datasets import (MinHasher,
+                              RecordWriter,
+                              get_split,
+                              read_records,
+                              find_clusters)
+from chatbot.constants import (FINE_TUNE_VALIDATION_RATIO,
+                               FINE_TUNE_DUPLICATE_THRESHOLD)
+
+
+class Command(BaseCommand):
+    help = 'Collapse the near-duplicate examples of CSV or JSONL training data with MinHash LSH, and split ' \
+           'them into train and validation files keeping each cluster of near-duplicates on the same side.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('input_path', help='CSV or JSONL training data')
+        parser.add_argument('--output-dir', default='.')
+        parser.add_argument('--text-field', default='response_text', help='Field compared between examples')
+        parser.add_argument('--threshold', type=float, default=FINE_TUNE_DUPLICATE_THRESHOLD,
+                            help='Estimated Jaccard similarity of word shingles from which examples '
+                                 'are near-duplicates')
+        parser.add_argument('--num-perm', type=int, default=128, help='MinHash signature length')
+        parser.add_argument('--shingle-size', type=int, default=3, help='Words by shingle')
+        parser.add_argument('--max-per-cluster', type=int, default=1, help='Examples kept of each cluster')
+        parser.add_argument('--validation-ratio', type=float, default=FINE_TUNE_VALIDATION_RATIO)
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the split')
+
+    def handle(self, *args, **options):
+        if not os.path.exists(options['input_path']):
+            raise CommandError(f"{options['input_path']} does not exist.")
+
+        os.makedirs(options['output_dir'], exist_ok=True)
+        min_hasher = MinHasher(num_perm=options['num_perm'], shingle_size=options['shingle_size'])
+
+        # First pass: only the signatures are held in memory, 4 bytes by permutation and example.
+        signatures = [min_hasher.get_signature(record[options['text_field']] or '')
+                      for record in read_records(options['input_path'])]
+        if not signatures:
+            raise CommandError(f"{options['input_path']} holds no examples.")
+        clusters = find_clusters(np.array(signatures), options['threshold'])
+        del signatures
+
+        cluster_ids, cluster_sizes = np.unique(clusters, return_counts=True)
+        duplicate_clusters = {int(cluster_id): {'cluster': int(cluster_id), 'size': int(cluster_size), 'rows': list()}
+                              for cluster_id, cluster_size in zip(cluster_ids, cluster_sizes) if cluster_size > 1}
+
+        # Second pass: each example goes to the split of its cluster representative, its first example.
+        stem, extension = os.path.splitext(os.path.basename(options['input_path']))
+        writers, splits, kept_counts = dict(), dict(), dict()
+        report = {'examples': len(clusters), 'clusters': len(cluster_ids),
+                  'duplicate_clusters': len(duplicate_clusters), 'removed': 0, 'train': 0, 'validation': 0}
+        try:
+            for index, record in enumerate(read_records(options['input_path'])):
+                cluster = int(clusters[index])
+                if cluster == index:
+                    splits[cluster] = get_split(record[options['text_field']] or '', options['validation_ratio'],
+                                                options['seed'])
+                if cluster in duplicate_clusters:
+                    duplicate_clusters[cluster]['rows'].append(index)
+                    if cluster == index:
+                        duplicate_clusters[cluster].update(split=splits[cluster],
+                                                           representative=record[options['text_field']])
+
+                kept_counts[cluster] = kept_counts.get(cluster, 0) + 1
+                if kept_counts[cluster] > options['max_per_cluster']:
+                    report['removed'] += 1
+                    continue
+
+                split = splits[cluster]
+                if split not in writers:
+                    writers[split] = RecordWriter(os.path.join(options['output_dir'], f'{stem}_{split}{extension}'),
+                                                  field_names=list(record))
+                writers[split].write(record)
+                report[split] += 1
+        finally:
+            for writer in writers.values():
+                writer.close()
+
+        report_path = os.path.join(options['output_dir'], f'{stem}_clusters.jsonl')
+        with open(report_path, 'w') as report_file:
+            for cluster_report in sorted(duplicate_clusters.values(), key=lambda cluster: -cluster['size']):
+                report_file.write(json.dumps(cluster_report, ensure_ascii=False) + '\n')
+
+        report['outputs'] = {split: writer.output_path for split, writer in writers.items()}
+        report['cluster_report'] = report_path
+        self.stdout.write(json.dumps(report, indent=2))
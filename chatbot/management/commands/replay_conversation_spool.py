@@ -0,0 +1,19 @@
+import os
+from glob import glob
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from chatbot.persistence import conversation_writer
+
+
+class Command(BaseCommand):
+    help = 'Write the conversations spooled by the write-behind persistence of stopped workers.'
+
+    def handle(self, *args, **options):
+        for spool_path in sorted(glob(os.path.join(settings.CHATBOT_WRITE_BEHIND['SPOOL_DIR'],
+                                                   'conversation_spool_*.jsonl'))):
+            entries = conversation_writer.read_spool(spool_path)
+            conversation_writer.write(entries)
+            os.remove(spool_path)
+            self.stdout.write(self.style.SUCCESS(f'{os.path.basename(spool_path)}: {len(entries)} conversations'))
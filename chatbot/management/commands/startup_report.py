@@ -0,0 +1,80 @@
+import os
+import sys
+import json
+import subprocess
+
+from django.conf import settings
+from django.urls import reverse
+from django.core.management.base import (BaseCommand,
+                                         CommandError)
+
+# Boots the WSGI application in a fresh interpreter, then measures its first requests.
+PROBE_SCRIPT = '''
+import sys
+import json
+import time
+
+started_at = time.perf_counter()
+from {wsgi_module} import application
+boot_duration = time.perf_counter() - started_at
+
+from django.test.utils import setup_test_environment
+from chatbot.startup import (warm_up_report,
+                             measure_first_requests)
+
+setup_test_environment()
+first_requests = measure_first_requests({paths!r})
+sys.stdout.write(json.dumps({{'boot': boot_duration, 'warm_up': warm_up_report, 'first_requests': first_requests}}))
+'''
+
+
+class Command(BaseCommand):
+    help = 'Report the import times of a fresh worker boot, and the latency of its first requests ' \
+           'with and without the warm-up.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=15, help='Slowest top-level imports reported')
+        parser.add_argument('--path', action='append', dest='paths',
+                            help='URL path requested with GET, the AI Models and chat sessions lists by default')
+
+    @staticmethod
+    def get_slowest_imports(import_times, top):
+        """
+        Method to get the modules slowest to import out of the -X importtime output, by the time spent in their own
+        body, along with the cumulative time of the imports they trigger, in milliseconds.
+        """
+        imports = list()
+        for line in import_times.splitlines():
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+            self_duration, cumulative_duration, module = line[len('import time:'):].split('|')
+            imports.append({'module': module.strip(),
+                            'self_ms': round(int(self_duration) / 1000, 2),
+                            'cumulative_ms': round(int(cumulative_duration) / 1000, 2)})
+        return sorted(imports, key=lambda item: -item['self_ms'])[:top]
+
+    def probe(self, warm_up, paths):
+        wsgi_module = settings.WSGI_APPLICATION.rsplit('.', 1)[0]
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                                 PROBE_SCRIPT.format(wsgi_module=wsgi_module, paths=paths)],
+                                capture_output=True, text=True,
+                                env={**os.environ, 'WARM_UP_ENABLED': str(warm_up)})
+        if result.returncode:
+            raise CommandError(result.stderr.splitlines()[-1] if result.stderr else 'Probe failed.')
+        return json.loads(result.stdout), result.stderr
+
+    def handle(self, *args, **options):
+        paths = options['paths'] or [reverse('get-ai-models'), reverse('get-chat-sessions')]
+        report = dict()
+        for warm_up in (False, True):
+            probe_report, import_times = self.probe(warm_up, paths)
+            report['warm' if warm_up else 'cold'] = {
+                'boot_ms': round(probe_report['boot'] * 1000, 2),
+                'warm_up_ms': {step: round(duration * 1000, 2) for step, duration in probe_report['warm_up'].items()},
+                'first_requests_ms': {name: [round(latency * 1000, 2) for latency in latencies]
+                                      for name, latencies in probe_report['first_requests'].items()}
+            }
+            if not warm_up:
+                report['slowest_imports'] = self.get_slowest_imports(import_times, options['top'])
+
+        self.stdout.write(json.dumps(report, indent=2))
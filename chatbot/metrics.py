@@ -0,0 +1,55 @@
+from prometheus_client import (Gauge,
+                               Counter,
+                               Histogram)
+
+STREAM_BUCKETS = (.05, .1, .25, .5, 1, 2.5, 5, 10, 20, 40, 80)
+
+UPSTREAM_TIME_TO_FIRST_CHUNK = Histogram('chatbot_upstream_time_to_first_chunk_seconds',
+                                         'Time from the Open AI completion request to its first chunk.',
+                                         ['model', 'endpoint'], buckets=STREAM_BUCKETS)
+UPSTREAM_STREAM_DURATION = Histogram('chatbot_upstream_stream_duration_seconds',
+                                     'Duration of the Open AI completion streams.',
+                                     ['model', 'endpoint'], buckets=STREAM_BUCKETS)
+UPSTREAM_RETRIES = Counter('chatbot_upstream_retries_total',
+                           'Retried Open AI requests, by upstream and exception class.',
+                           ['upstream', 'exception'])
+UPSTREAM_REQUESTS = Counter('chatbot_upstream_requests_total',
+                            'Open AI request attempts, by upstream and result: success or failed.',
+                            ['upstream', 'result'])
+COMPLETION_TOKENS = Counter('chatbot_completion_tokens_total',
+                            'Completion tokens delivered to the clients, by source: upstream, coalesced or cache.',
+                            ['model', 'endpoint', 'source'])
+COMPLETION_TOKENS_PER_SECOND = Histogram('chatbot_completion_tokens_per_second',
+                                         'Completion tokens per second delivered to the clients.',
+                                         ['model', 'endpoint', 'source'],
+                                         buckets=(1, 5, 10, 20, 40, 80, 160, 320, 640, 1280))
+PROMPT_ASSEMBLY_DURATION = Histogram('chatbot_prompt_assembly_seconds',
+                                     'Duration of the prompt assembly.',
+                                     ['model'], buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25))
+MODERATION_DURATION = Histogram('chatbot_moderation_seconds',
+                                'Duration of the Open AI moderation requests, retries included.',
+                                ['model'])
+CHAT_SUMMARY_REFRESHES = Counter('chatbot_chat_summary_refreshes_total',
+                                 'Chat session summary refreshes, by result: updated, superseded or failed.',
+                                 ['result'])
+ADMISSION_WAIT = Histogram('chatbot_admission_wait_seconds',
+                           'Wait of the completion streams for the budgets of their AI Model, by result: '
+                           'admitted or rejected.',
+                           ['model', 'result'], buckets=(.001, .01, .05, .1, .25, .5, 1, 2.5, 5, 10))
+UPSTREAM_POOL_REQUESTS = Counter('chatbot_upstream_pool_requests_total',
+                                 'Open AI requests made through the pooled aiohttp sessions.')
+UPSTREAM_POOL_CONNECTIONS = Counter('chatbot_upstream_pool_connections_total',
+                                    'Connections of the pooled aiohttp sessions, by event: created or reused.',
+                                    ['event'])
+UPSTREAM_POOL_WAITING = Gauge('chatbot_upstream_pool_waiting_requests',
+                              'Open AI requests waiting for a connection of a full pool.',
+                              multiprocess_mode='livesum')
+UPSTREAM_POOL_IDLE_CONNECTIONS = Gauge('chatbot_upstream_pool_idle_connections',
+                                       'Idle keep-alive connections of the pooled aiohttp sessions.',
+                                       multiprocess_mode='livesum')
+UPSTREAM_POOLS = Gauge('chatbot_upstream_pools',
+                       'Pooled aiohttp sessions, one per event loop.',
+                       multiprocess_mode='livesum')
+UPSTREAM_POOL_SIZE = Gauge('chatbot_upstream_pool_size',
+                           'Maximum connections of each pooled aiohttp session.',
+                           multiprocess_mode='livemax')
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.5 on 2026-10-18 16:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0002_chatquery_chatsession_alter_aimodel_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatquery',
+            name='tokens_count',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='chatresponse',
+            name='tokens_count',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
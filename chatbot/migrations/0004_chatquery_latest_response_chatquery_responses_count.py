@@ -0,0 +1,39 @@
+# Generated by Django 4.2.5 on 2026-10-18 16:09
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+def set_latest_response(apps, schema_editor):
+    ChatQuery = apps.get_model('chatbot', 'ChatQuery')
+    ChatResponse = apps.get_model('chatbot', 'ChatResponse')
+
+    chat_responses = ChatResponse.objects.filter(chat_query=OuterRef('pk'))
+    ChatQuery.objects.update(
+        latest_response=Subquery(chat_responses.order_by('-created_at', '-id').values('id')[:1]),
+        responses_count=Coalesce(Subquery(chat_responses.values('chat_query').annotate(
+            responses_count=Count('id')).values('responses_count')), 0)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0003_chatquery_tokens_count_chatresponse_tokens_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatquery',
+            name='latest_response',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chatbot.chatresponse'),
+        ),
+        migrations.AddField(
+            model_name='chatquery',
+            name='responses_count',
+            field=models.PositiveIntegerField(blank=True, default=0),
+        ),
+        migrations.RunPython(set_latest_response, migrations.RunPython.noop),
+    ]
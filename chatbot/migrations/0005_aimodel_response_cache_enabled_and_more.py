@@ -0,0 +1,23 @@
+# Generated by Django 4.2.5 on 2026-10-18 16:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0004_chatquery_latest_response_chatquery_responses_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aimodel',
+            name='response_cache_enabled',
+            field=models.BooleanField(blank=True, default=False),
+        ),
+        migrations.AddField(
+            model_name='aimodel',
+            name='response_cache_timeout',
+            field=models.PositiveIntegerField(blank=True, default=3600),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 4.2.5 on 2026-10-18 16:20
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def set_chat_session_aggregates(apps, schema_editor):
+    ChatQuery = apps.get_model('chatbot', 'ChatQuery')
+    ChatSession = apps.get_model('chatbot', 'ChatSession')
+    ChatResponse = apps.get_model('chatbot', 'ChatResponse')
+
+    chat_queries = ChatQuery.objects.filter(chat_session=OuterRef('pk'))
+    chat_responses = ChatResponse.objects.filter(chat_query__chat_session=OuterRef('pk'))
+    ChatSession.objects.update(
+        queries_count=Coalesce(Subquery(chat_queries.values('chat_session').annotate(
+            queries_count=Count('id')).values('queries_count')), 0),
+        last_activity_at=Coalesce(Subquery(chat_responses.order_by('-created_at').values('created_at')[:1]),
+                                  Subquery(chat_queries.order_by('-created_at').values('created_at')[:1]))
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0005_aimodel_response_cache_enabled_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatsession',
+            name='last_activity_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='chatsession',
+            name='last_model',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='chatsession',
+            name='queries_count',
+            field=models.PositiveIntegerField(blank=True, default=0),
+        ),
+        migrations.AddIndex(
+            model_name='chatsession',
+            index=models.Index(fields=['updated_at', 'id'], name='chatsession_updated_at_id_idx'),
+        ),
+        migrations.RunPython(set_chat_session_aggregates, migrations.RunPython.noop),
+    ]
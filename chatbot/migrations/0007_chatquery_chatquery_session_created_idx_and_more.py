@@ -0,0 +1,21 @@
+# Generated by Django 4.2.5 on 2026-10-18 16:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0006_chatsession_last_activity_at_chatsession_last_model_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chatquery',
+            index=models.Index(fields=['chat_session', 'created_at', 'id'], name='chatquery_session_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chatresponse',
+            index=models.Index(fields=['chat_query', 'created_at', 'id'], name='chatresponse_query_created_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.5 on 2026-10-18 16:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0008_chatsession_summarized_query_chatsession_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aimodel',
+            name='max_concurrent_streams',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='aimodel',
+            name='tokens_per_minute',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
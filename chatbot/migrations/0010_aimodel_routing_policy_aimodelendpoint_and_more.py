@@ -0,0 +1,41 @@
+# Generated by Django 4.2.5 on 2026-10-18 16:48
+
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0009_aimodel_max_concurrent_streams_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aimodel',
+            name='routing_policy',
+            field=models.CharField(blank=True, choices=[('LEAST_OUTSTANDING', 'Weighted least outstanding requests'), ('EWMA_LATENCY', 'Weighted EWMA latency')], default='LEAST_OUTSTANDING', max_length=100),
+        ),
+        migrations.CreateModel(
+            name='AIModelEndpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('api_key', models.CharField(blank=True, default='', max_length=200)),
+                ('organization', models.CharField(blank=True, default='', max_length=100)),
+                ('api_base', models.URLField(blank=True, default='')),
+                ('weight', models.PositiveIntegerField(blank=True, default=1, validators=[django.core.validators.MinValueValidator(1)])),
+                ('is_active', models.BooleanField(blank=True, default=True)),
+                ('serves_moderation', models.BooleanField(blank=True, default=False)),
+                ('ai_model', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='r_endpoints', to='chatbot.aimodel')),
+            ],
+            options={
+                'verbose_name': 'AI Model Endpoint',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='aimodelendpoint',
+            constraint=models.UniqueConstraint(fields=('ai_model', 'name'), name='aimodelendpoint_model_name_unique'),
+        ),
+    ]
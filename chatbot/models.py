@@ -1,8 +1,12 @@
 from django.db import models
+from django.core.validators import MinValueValidator
+from django.db.models import F
 
 from utilities.mixins import (ModelCreatedAtMixin,
                               ModelTimeStampMixin)
-from .constants import AIModel_COMPATIBILITY_CHOICES
+from .constants import (COMPLETION_CACHE_TIMEOUT,
+                        AIModel_COMPATIBILITY_CHOICES,
+                        AIModel_ROUTING_POLICY_CHOICES)
 
 
 class AIModel(models.Model):
@@ -12,16 +16,51 @@ class AIModel(models.Model):
     model_id = models.CharField(null=False, blank=False, unique=True, max_length=100)
     max_tokens = models.IntegerField(null=False, blank=False)
     compatibility = models.CharField(null=False, blank=False, max_length=100, choices=AIModel_COMPATIBILITY_CHOICES)
+    response_cache_enabled = models.BooleanField(null=False, blank=True, default=False)
+    response_cache_timeout = models.PositiveIntegerField(null=False, blank=True, default=COMPLETION_CACHE_TIMEOUT)
+    tokens_per_minute = models.PositiveIntegerField(null=True, blank=True)
+    max_concurrent_streams = models.PositiveIntegerField(null=True, blank=True)
+    routing_policy = models.CharField(null=False, blank=True, max_length=100, choices=AIModel_ROUTING_POLICY_CHOICES,
+                                      default=AIModel_ROUTING_POLICY_CHOICES[0][0])
 
     class Meta:
         verbose_name = 'AI Model'
 
 
+class AIModelEndpoint(models.Model):
+    """
+    Model for the endpoints serving an AI Model: API keys, organizations or compatible API bases.
+    Blank credentials default to the ones of the Open AI client.
+    """
+    ai_model = models.ForeignKey(AIModel, null=False, blank=False,
+                                 related_name='r_endpoints', on_delete=models.CASCADE)
+    name = models.CharField(null=False, blank=False, max_length=100)
+    api_key = models.CharField(null=False, blank=True, default='', max_length=200)
+    organization = models.CharField(null=False, blank=True, default='', max_length=100)
+    api_base = models.URLField(null=False, blank=True, default='')
+    weight = models.PositiveIntegerField(null=False, blank=True, default=1, validators=[MinValueValidator(1)])
+    is_active = models.BooleanField(null=False, blank=True, default=True)
+    serves_moderation = models.BooleanField(null=False, blank=True, default=False)
+
+    class Meta:
+        verbose_name = 'AI Model Endpoint'
+        constraints = [models.UniqueConstraint(fields=['ai_model', 'name'], name='aimodelendpoint_model_name_unique')]
+
+
 class ChatSession(ModelTimeStampMixin):
     """
     Model for managing chat sessions.
     """
     title = models.CharField(null=False, blank=False, unique=True, max_length=200)
+    queries_count = models.PositiveIntegerField(null=False, blank=True, default=0)
+    last_activity_at = models.DateTimeField(null=True, blank=True)
+    last_model = models.CharField(null=True, blank=True, max_length=100)
+    summary = models.TextField(null=False, blank=True, default='')
+    summarized_query = models.ForeignKey('ChatQuery', null=True, blank=True,
+                                         related_name='+', on_delete=models.SET_NULL)
+
+    class Meta:
+        indexes = [models.Index(fields=['updated_at', 'id'], name='chatsession_updated_at_id_idx')]
 
 
 class ChatQuery(ModelCreatedAtMixin):
@@ -29,8 +68,15 @@ class ChatQuery(ModelCreatedAtMixin):
     Model for user chat queries.
     """
     content = models.TextField(null=False, blank=False)
+    tokens_count = models.JSONField(null=False, blank=True, default=dict)
     chat_session = models.ForeignKey(ChatSession, null=False, blank=False,
                                      related_name='r_chat_queries', on_delete=models.CASCADE)
+    latest_response = models.ForeignKey('ChatResponse', null=True, blank=True,
+                                        related_name='+', on_delete=models.SET_NULL)
+    responses_count = models.PositiveIntegerField(null=False, blank=True, default=0)
+
+    class Meta:
+        indexes = [models.Index(fields=['chat_session', 'created_at', 'id'], name='chatquery_session_created_idx')]
 
 
 class ChatResponse(ModelCreatedAtMixin):
@@ -38,5 +84,18 @@ class ChatResponse(ModelCreatedAtMixin):
     Model for LLM responses.
     """
     content = models.TextField(null=False, blank=False)
+    tokens_count = models.JSONField(null=False, blank=True, default=dict)
     chat_query = models.ForeignKey(ChatQuery, null=False, blank=False,
                                    related_name='r_chat_responses', on_delete=models.CASCADE)
+
+    class Meta:
+        indexes = [models.Index(fields=['chat_query', 'created_at', 'id'], name='chatresponse_query_created_idx')]
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+
+        if adding:
+            # Keep the denormalized latest response pointer of the Chat Query up to date.
+            ChatQuery.objects.filter(id=self.chat_query_id).update(latest_response=self,
+                                                                  responses_count=F('responses_count') + 1)
@@ -1,66 +1,269 @@
 import os
+import json
 import time
+import unicodedata
+import asyncio
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from itertools import accumulate
 import openai
-import tiktoken
+from django.conf import settings
 from rest_framework import status
+from rest_framework.fields import CharField
+from asgiref.sync import (sync_to_async,
+                          async_to_sync)
 from utilities.messages import ERROR_CODES
 from utilities.exception import CustomAPIException
-from .constants import (AI_CHAT_SYSTEM_INSTRUCTION,
+from utilities.metrics import current_endpoint
+from utilities.cache import (TieredCache,
+                             get_hash_key)
+from .constants import (MODERATION_MODEL,
+                        MODERATION_ROUTING_POLICY,
+                        COMPLETION_CACHE_TIMEOUT,
+                        COMPLETION_CACHE_MAX_ENTRIES,
+                        CHAT_HISTORY_LIMIT,
+                        MODERATION_CACHE_TIMEOUT,
+                        MODERATION_CACHE_MAX_ENTRIES,
+                        MODERATION_BATCH_MAX_ITEMS,
+                        MODERATION_BATCH_CONCURRENCY,
+                        MODERATION_BATCH_MAX_CHARACTERS,
+                        AI_CHAT_SUMMARY_MESSAGE,
+                        AI_CHAT_SYSTEM_INSTRUCTION,
                         AIModel_COMPATIBILITY_CHOICES)
-from .models import (AIModel,
-                     ChatQuery)
-from .serializers import (ConversationSerializer,
-                          ChatResponseSerializer)
+from .models import (ChatQuery,
+                     ChatResponse)
+from .serializers import ConversationSerializer
+from .persistence import conversation_writer
+from .single_flight import SingleFlight
+from .admission import admission_controller
+from .summaries import chat_summarizer
+from .registry import ai_model_registry
+from .transport import upstream_transport
+from .routing import (endpoint_router,
+                      get_completion_upstreams)
+from .metrics import (COMPLETION_TOKENS,
+                      MODERATION_DURATION,
+                      PROMPT_ASSEMBLY_DURATION,
+                      UPSTREAM_STREAM_DURATION,
+                      COMPLETION_TOKENS_PER_SECOND,
+                      UPSTREAM_TIME_TO_FIRST_CHUNK)
+from .tokens import (MESSAGE_FORMATS,
+                     count_tokens,
+                     get_encoding,
+                     get_message_overhead,
+                     get_message_tokens_count,
+                     set_missing_tokens_count,
+                     get_system_instruction_tokens_count)
 
 openai.api_key = os.getenv('OPENAI_API_KEY')
+openai.requestssession = upstream_transport.build_requests_session
 
+query_content_field = CharField()
 
-def moderation(content):
+
+completion_cache = TieredCache(prefix='chatbot:completion',
+                               max_entries=COMPLETION_CACHE_MAX_ENTRIES,
+                               timeout=COMPLETION_CACHE_TIMEOUT)
+
+completion_flights = SingleFlight()
+
+moderation_cache = TieredCache(prefix='chatbot:moderation',
+                               max_entries=MODERATION_CACHE_MAX_ENTRIES,
+                               timeout=MODERATION_CACHE_TIMEOUT)
+
+
+def get_moderation_cache_key(content):
+    """
+    Function to get the moderation cache key of a text content.
+    :param content: Text content
+    :return: Hash of the normalized content and the moderation model
+    """
+    return get_hash_key(MODERATION_MODEL, ' '.join(unicodedata.normalize('NFC', content).split()))
+
+
+def request_moderation(api_key=None, organization=None, api_base=None, **params):
+    """
+    Function to make an Open AI moderation request with the credentials of an upstream,
+    as Moderation.create() only takes an API key.
+    :return: Moderation result
+    """
+    if organization or api_base:
+        moderation_instance = openai.Moderation(api_key=api_key, organization=organization, api_base=api_base)
+        return moderation_instance.request('post', openai.Moderation.get_url(), params)
+
+    return openai.Moderation.create(api_key=api_key, **params)
+
+
+def create_moderation(moderation_input, upstreams):
     """
     Function to make Open AI text content moderation request.
+    :param moderation_input: Text content or list of text contents
+    :param upstreams: Upstreams of the moderation requests
+    :return: Moderation result without the API credentials held by Open AI objects
+    """
+    try:
+        with MODERATION_DURATION.labels(model=MODERATION_MODEL).time():
+            return json.loads(json.dumps(endpoint_router.call(upstreams, MODERATION_ROUTING_POLICY,
+                                                              request_moderation,
+                                                              input=moderation_input,
+                                                              model=MODERATION_MODEL)))
+
+    except openai.error.OpenAIError as exception:
+        raise CustomAPIException(
+            status_code=exception.http_status,
+            error_code=exception.code if exception.code else type(exception).__name__,
+            error_detail=exception.user_message
+        )
+
+
+def moderation(content):
+    """
+    Function to get the moderation result of a text content.
+    Results are cached by content hash, so resubmitted content is not moderated again.
     :param content: Text content
     :return: Moderation result
     """
-    for attempt in range(1, 5):
+    cache_key = get_moderation_cache_key(content)
+    moderation_result = moderation_cache.get(cache_key)
+    if moderation_result is None:
+        moderation_result = create_moderation(content, ai_model_registry.get_moderation_upstreams())
+        moderation_cache.set(cache_key, moderation_result)
+
+    return moderation_result
+
+
+def pack_moderation_inputs(contents):
+    """
+    Function to pack text contents into as few moderation requests as the input limits allow.
+    :param contents: Text contents
+    :return: Lists of text contents, one per moderation request
+    """
+    packs = list()
+    pack_characters_count = 0
+    for content in contents:
+        if not packs or len(packs[-1]) >= MODERATION_BATCH_MAX_ITEMS or \
+                pack_characters_count + len(content) > MODERATION_BATCH_MAX_CHARACTERS:
+            packs.append(list())
+            pack_characters_count = 0
+        packs[-1].append(content)
+        pack_characters_count += len(content)
+
+    return packs
+
+
+def moderation_batch(contents):
+    """
+    Function to get the moderation results of many text contents.
+    Contents are deduplicated, looked up in the moderation cache and the rest is packed
+    into concurrent moderation requests.
+    :param contents: Text contents
+    :return: Moderation result or error of each content, in input order
+    """
+    cache_keys = [get_moderation_cache_key(content) for content in contents]
+    moderation_results = dict()
+    missing_contents = dict()
+    for cache_key, content in zip(cache_keys, contents):
+        if cache_key in moderation_results or cache_key in missing_contents:
+            continue
+        moderation_result = moderation_cache.get(cache_key)
+        if moderation_result is None:
+            missing_contents[cache_key] = content
+        else:
+            moderation_results[cache_key] = {'data': moderation_result, 'error': None, 'message': None}
+
+    upstreams = ai_model_registry.get_moderation_upstreams()
+
+    def moderate_pack(pack):
         try:
-            return openai.Moderation.create(input=content)
+            moderation_result = create_moderation(pack, upstreams)
+        except CustomAPIException as exception:
+            return [{'data': None, 'error': exception.default_code, 'message': exception.default_detail}] * len(pack)
 
-        except openai.error.OpenAIError as exception:
-            if isinstance(exception, (openai.error.Timeout,
-                                      openai.error.APIError,
-                                      openai.error.RateLimitError,
-                                      openai.error.APIConnectionError,
-                                      openai.error.ServiceUnavailableError)) and attempt < 4:
-                time.sleep(attempt * 3)
-                continue
-            raise CustomAPIException(
-                status_code=exception.http_status,
-                error_code=exception.code if exception.code else type(exception).__name__,
-                error_detail=exception.user_message
-            )
+        pack_results = list()
+        for result in moderation_result['results']:
+            pack_result = {**moderation_result, 'results': [result]}
+            pack_results.append({'data': pack_result, 'error': None, 'message': None})
+        return pack_results
+
+    packs = pack_moderation_inputs(list(missing_contents.values()))
+    with ThreadPoolExecutor(max_workers=MODERATION_BATCH_CONCURRENCY) as executor:
+        pack_results = [pack_result for pack_results in executor.map(moderate_pack, packs)
+                        for pack_result in pack_results]
+
+    for cache_key, pack_result in zip(missing_contents, pack_results):
+        moderation_results[cache_key] = pack_result
+        if pack_result['data']:
+            moderation_cache.set(cache_key, pack_result['data'])
+
+    return [moderation_results[cache_key] for cache_key in cache_keys]
+
+
+def get_formatted_message(content, role, compatibility):
+    """
+    Function to format a prompt message based on model compatibility.
+    :param content: Message content
+    :param role: Message role
+    :param compatibility: AI Model compatibility
+    :return: Formatted message
+    """
+    if compatibility == AIModel_COMPATIBILITY_CHOICES[0][0]:
+        return MESSAGE_FORMATS[compatibility][role].format(content)
+    return {'role': role, 'content': content}
+
+
+def get_context_window(chat_history, tokens_budget, encoding, compatibility):
+    """
+    Function to select the longest run of latest conversations that fits in a tokens budget.
+    :param chat_history: Serialized conversations, latest first
+    :param tokens_budget: Tokens available for the conversation history
+    :param encoding: Encoding instance of the requested AI Model
+    :param compatibility: AI Model compatibility
+    :return: Formatted history messages, oldest first
+    :return: Tokens count of the selected conversations
+    :return: Conversations left out, latest first
+    """
+    chat_history = [conversation for conversation in chat_history if conversation['latest_response']]
+    prefix_tokens_count = list(accumulate(
+        (get_message_tokens_count(conversation, encoding, compatibility, 'user') +
+         get_message_tokens_count(conversation['latest_response'], encoding, compatibility, 'assistant')
+         for conversation in chat_history), initial=0))
+    conversations_count = max(bisect_right(prefix_tokens_count, tokens_budget) - 1, 0)
+
+    messages = list()
+    for conversation in reversed(chat_history[:conversations_count]):
+        messages.append(get_formatted_message(conversation['content'], 'user', compatibility))
+        messages.append(get_formatted_message(conversation['latest_response']['content'], 'assistant',
+                                              compatibility))
+
+    return messages, prefix_tokens_count[conversations_count], chat_history[conversations_count:]
 
 
-def get_formatted_prompt(current_conversation, chat_history, ai_model_instance):
+def get_formatted_prompt(current_conversation, chat_history, ai_model_instance, chat_summary=''):
     """
     Function to format request prompt based on model compatibility.
     :param current_conversation: Current query
-    :param chat_history: Conversation history of the Chat Session
+    :param chat_history: Conversation history of the Chat Session not covered by its summary, latest first
     :param ai_model_instance: Instance of requested AI Model
+    :param chat_summary: Rolling summary of the earlier conversations of the Chat Session
     :return: Formatted prompt
     :return: Maximum response tokens
+    :return: Conversations left out of the context window, latest first
     """
     max_prompt_tokens = int(0.75 * ai_model_instance.max_tokens)
-    encoding = tiktoken.encoding_for_model(ai_model_instance.model_id)
+    encoding = get_encoding(ai_model_instance.model_id)
+    compatibility = ai_model_instance.compatibility
 
-    if ai_model_instance.compatibility == AIModel_COMPATIBILITY_CHOICES[0][0]:
-        prompt = [f'-s> {AI_CHAT_SYSTEM_INSTRUCTION}\n',
-                  f'-u> {current_conversation["content"]}\n-a> ']
-        tokens_count = sum([len(encoding.encode(message)) for message in prompt])
-    else:
-        prompt = [{'role': 'system', 'content': AI_CHAT_SYSTEM_INSTRUCTION},
-                  {'role': 'user', 'content': current_conversation['content']}]
-        tokens_count = sum([len(encoding.encode(f'role:{message["role"]}\ncontent:{message["content"]}\n'))
-                            for message in prompt])
+    tokens_count = (get_system_instruction_tokens_count(encoding, compatibility) +
+                    get_message_tokens_count(current_conversation, encoding, compatibility, 'user'))
+    if compatibility == AIModel_COMPATIBILITY_CHOICES[0][0]:
+        tokens_count += get_message_overhead(encoding, compatibility, 'assistant')
+
+    prompt = [get_formatted_message(AI_CHAT_SYSTEM_INSTRUCTION, 'system', compatibility)]
+    if chat_summary:
+        summary_message = AI_CHAT_SUMMARY_MESSAGE.format(chat_summary)
+        tokens_count += (count_tokens(summary_message, encoding) +
+                         get_message_overhead(encoding, compatibility, 'system'))
+        prompt.append(get_formatted_message(summary_message, 'system', compatibility))
 
     if ai_model_instance.max_tokens - tokens_count < 1:
         raise CustomAPIException(
@@ -69,114 +272,430 @@ def get_formatted_prompt(current_conversation, chat_history, ai_model_instance):
             error_detail=ERROR_CODES['token_limit_exceeded']
         )
 
-    for conversation in chat_history:
-        if ai_model_instance.compatibility == AIModel_COMPATIBILITY_CHOICES[0][0]:
-            messages = [f'-u> {conversation["content"]}\n',
-                        f'-a> {conversation["chat_responses"][-1]["content"]}\n']
-            conversation_tokens_count = sum([len(encoding.encode(message)) for message in messages])
-        else:
-            messages = [{'role': 'user', 'content': conversation['content']},
-                        {'role': 'assistant', 'content': conversation['chat_responses'][-1]['content']}]
-            conversation_tokens_count = sum([len(encoding.encode(
-                f'role:{message["role"]}\ncontent:{message["content"]}\n')) for message in messages])
-
-        if (tokens_count + conversation_tokens_count) <= max_prompt_tokens:
-            tokens_count += conversation_tokens_count
-            prompt.insert(1, messages[0])
-            prompt.insert(2, messages[1])
-        else:
-            break
+    history_messages, history_tokens_count, left_out_history = get_context_window(
+        chat_history=chat_history,
+        tokens_budget=max_prompt_tokens - tokens_count,
+        encoding=encoding,
+        compatibility=compatibility
+    )
+    tokens_count += history_tokens_count
+
+    prompt.extend(history_messages)
+    if compatibility == AIModel_COMPATIBILITY_CHOICES[0][0]:
+        prompt.append(f'-u> {current_conversation["content"]}\n-a> ')
+    else:
+        prompt.append(get_formatted_message(current_conversation['content'], 'user', compatibility))
 
-    return prompt, ai_model_instance.max_tokens - tokens_count
+    return prompt, ai_model_instance.max_tokens - tokens_count, left_out_history
 
 
-def completion(model_id, chat_session_instance, query_content, regenerate=None):
+def get_chat_history_queryset(chat_session_instance, limit, **filters):
     """
-    Function to make Open AI chat completion API request and save the conversation.
-    :param model_id: Open AI model ID
+    Function to build the query of the latest conversations of a chat session,
+    served by the (chat_session_id, created_at, id) index.
+    """
+    return ChatQuery.objects.filter(
+        chat_session=chat_session_instance, **filters
+    ).select_related('latest_response').order_by('-created_at', '-id')[:limit]
+
+
+@sync_to_async
+def get_chat_history(chat_session_instance, limit, **filters):
+    """
+    Function to fetch the latest serialized conversations of a chat session.
     :param chat_session_instance: Instance of the Chat Session
-    :param query_content: Current query string
-    :param regenerate: Chat Query instance ID for which response is to regenerated
-    :return: Streaming chunks of Open AI model response
+    :param limit: Maximum number of conversations to fetch
+    :param filters: Additional Chat Query filters
+    :return: Serialized conversations, latest first
     """
-    ai_model_instance = AIModel.objects.get(model_id=model_id)
+    return ConversationSerializer(get_chat_history_queryset(chat_session_instance, limit, **filters), many=True).data
 
-    if regenerate:
-        chat_history = ConversationSerializer(ChatQuery.objects.filter(
-            chat_session=chat_session_instance, id__lte=regenerate
-        ).order_by('-created_at')[:6], many=True).data
 
-        current_conversation = chat_history.pop(0)
+@sync_to_async
+def save_missing_tokens_count(chat_history, encoding):
+    """
+    Function to compute and store the tokens count of conversations not yet tokenized with an encoding.
+    :param chat_history: Serialized conversations
+    :param encoding: Encoding instance
+    """
+    chat_queries = set_missing_tokens_count(chat_history, encoding)
+    chat_responses = set_missing_tokens_count([conversation['latest_response'] for conversation in chat_history
+                                               if conversation['latest_response']], encoding)
+
+    ChatQuery.objects.bulk_update([ChatQuery(id=chat_query['id'], tokens_count=chat_query['tokens_count'])
+                                   for chat_query in chat_queries], ['tokens_count'])
+    ChatResponse.objects.bulk_update([ChatResponse(id=chat_response['id'], tokens_count=chat_response['tokens_count'])
+                                      for chat_response in chat_responses], ['tokens_count'])
 
+
+def save_conversation(chat_session_instance, ai_model_instance, current_conversation, chat_response_data):
+    """
+    Function to queue the writes of a conversation to the write-behind persistence.
+    :param chat_session_instance: Instance of the Chat Session
+    :param ai_model_instance: Instance of requested AI Model
+    :param current_conversation: Current query, with an ID if it is already saved
+    :param chat_response_data: Chat Response data with its tokens count, or None
+    """
+    if current_conversation['id']:
+        chat_query = {'id': current_conversation['id']}
     else:
-        chat_history = ConversationSerializer(ChatQuery.objects.filter(
-            chat_session=chat_session_instance
-        ).order_by('-created_at')[:5], many=True).data
+        chat_query = {'content': current_conversation['content'],
+                      'tokens_count': current_conversation['tokens_count']}
 
-        chat_query_serialized = ConversationSerializer(data={
-            'content': query_content,
-            'chat_session': chat_session_instance.id
-        })
-        chat_query_serialized.is_valid(raise_exception=True)
-        chat_query_serialized.save()
-        current_conversation = chat_query_serialized.data
+    if chat_response_data and chat_response_data['content']:
+        chat_response = {'content': chat_response_data['content'],
+                         'tokens_count': chat_response_data['tokens_count']}
+    elif current_conversation['id']:
+        return
+    else:
+        chat_response = None
 
-    regenerations_count = int(str(len(current_conversation['chat_responses']))[-1])
-    prompt, max_response_tokens = get_formatted_prompt(current_conversation=current_conversation,
-                                                       chat_history=chat_history,
-                                                       ai_model_instance=ai_model_instance)
+    conversation_writer.enqueue(chat_session_instance.id, chat_query, chat_response, ai_model_instance.model_id)
 
-    chat_response_data = {
-        'content': str(),
-        'chat_query': current_conversation['id']
-    }
-    for attempt in range(1, 5):
+
+def schedule_summary_refresh(chat_session_instance, left_out_history, encoding, regenerate=None):
+    """
+    Function to fold the conversations left out of the prompt context window into the Chat Session summary,
+    once they are REFRESH_TURNS or more. The oldest of them fitting in MAX_INPUT_TOKENS are folded, at least one,
+    and the later ones are folded by the next refreshes as they stay left out of the context window.
+    :param chat_session_instance: Instance of the Chat Session
+    :param left_out_history: Conversations left out of the context window, latest first
+    :param encoding: Encoding instance of the requested AI Model
+    :param regenerate: Chat Query instance ID for which response is regenerated
+    """
+    summary_config = settings.CHATBOT_CHAT_SUMMARY
+    if not summary_config['ENABLED'] or regenerate or len(left_out_history) < summary_config['REFRESH_TURNS']:
+        return
+
+    compatibility = AIModel_COMPATIBILITY_CHOICES[1][0]
+    history_messages = list()
+    tokens_count = 0
+    summarized_query_id = None
+    for conversation in reversed(left_out_history):
+        if conversation['latest_response']:
+            tokens_count += (get_message_tokens_count(conversation, encoding, compatibility, 'user') +
+                             get_message_tokens_count(conversation['latest_response'], encoding, compatibility,
+                                                      'assistant'))
+            if history_messages and tokens_count > summary_config['MAX_INPUT_TOKENS']:
+                break
+            history_messages.append(get_formatted_message(conversation['content'], 'user', compatibility))
+            history_messages.append(get_formatted_message(conversation['latest_response']['content'], 'assistant',
+                                                          compatibility))
+        summarized_query_id = conversation['id']
+
+    chat_summarizer.schedule(chat_session_instance, history_messages, summarized_query_id)
+
+
+async def stream_completion(ai_model_instance, prompt, max_response_tokens, temperature, upstreams=None):
+    """
+    Function to stream an Open AI completion, retrying failed attempts until the first chunk is delivered.
+    Attempts are routed across the upstreams of the AI Model, failing over to another upstream on retryable errors.
+    :param ai_model_instance: Instance of requested AI Model
+    :param prompt: Formatted prompt
+    :param max_response_tokens: Maximum response tokens
+    :param temperature: Sampling temperature
+    :param upstreams: Upstreams of the AI Model, defaulting to the credentials of the Open AI client
+    :return: Streaming chunks of Open AI model response
+    """
+    upstreams = upstreams or get_completion_upstreams(ai_model_instance, [])
+    metric_labels = {'model': ai_model_instance.model_id, 'endpoint': current_endpoint.get()}
+    attempt = 1
+    failed_upstreams = set()
+    retry_delay = 0
+    chunks_delivered = False
+    while True:
+        upstream = None
         try:
+            upstream = await endpoint_router.aselect(upstreams, ai_model_instance.routing_policy,
+                                                     exclude=failed_upstreams)
+            # Failing over to another upstream is not delayed, retrying a failed one is.
+            if upstream.key in failed_upstreams:
+                await asyncio.sleep(retry_delay)
+            upstream_transport.activate()
+            started_at = time.perf_counter()
+            first_chunk_latency = None
             if ai_model_instance.compatibility == AIModel_COMPATIBILITY_CHOICES[0][0]:
-                for chunk in openai.Completion.create(
+                async for chunk in upstream_transport.iter_stream(openai.Completion.acreate(
                     stream=True,
                     model=ai_model_instance.model_id,
                     prompt=''.join(prompt),
                     max_tokens=int(max_response_tokens),
-                    temperature=round(1.6 - 0.08 * regenerations_count, 2) if regenerations_count else 0.8
-                ):
-                    chunk_content = chunk['choices'][0]['text']
-                    chat_response_data['content'] += chunk_content
-                    yield chunk_content
+                    temperature=temperature,
+                    request_timeout=upstream_transport.stream_timeout,
+                    **upstream.credentials
+                )):
+                    if not chunks_delivered:
+                        first_chunk_latency = time.perf_counter() - started_at
+                        UPSTREAM_TIME_TO_FIRST_CHUNK.labels(**metric_labels).observe(first_chunk_latency)
+                    chunks_delivered = True
+                    yield chunk['choices'][0]['text']
 
             else:
-                for chunk in openai.ChatCompletion.create(
+                async for chunk in upstream_transport.iter_stream(openai.ChatCompletion.acreate(
                     stream=True,
                     model=ai_model_instance.model_id,
                     messages=prompt,
                     max_tokens=int(max_response_tokens),
-                    temperature=round(1.2 - 0.04 * regenerations_count, 2) if regenerations_count else 0.8
-                ):
+                    temperature=temperature,
+                    request_timeout=upstream_transport.stream_timeout,
+                    **upstream.credentials
+                )):
                     chunk_content = chunk['choices'][0]['delta'].get('content')
                     if chunk_content:
-                        chat_response_data['content'] += chunk_content
+                        if not chunks_delivered:
+                            first_chunk_latency = time.perf_counter() - started_at
+                            UPSTREAM_TIME_TO_FIRST_CHUNK.labels(**metric_labels).observe(first_chunk_latency)
+                        chunks_delivered = True
                         yield chunk_content
 
-            break
+            stream_duration = time.perf_counter() - started_at
+            UPSTREAM_STREAM_DURATION.labels(**metric_labels).observe(stream_duration)
+            # Upstreams are compared on their time to first chunk, stream durations following the response lengths.
+            await endpoint_router.aon_success(upstream, first_chunk_latency or stream_duration)
+            return
 
         except openai.error.OpenAIError as exception:
-            if isinstance(exception, (openai.error.Timeout,
-                                      openai.error.APIError,
-                                      openai.error.RateLimitError,
-                                      openai.error.APIConnectionError,
-                                      openai.error.ServiceUnavailableError)) and attempt < 4:
-                time.sleep(attempt * 3)
+            # A stream that already delivered chunks is not retried, as it would repeat them to the client.
+            if upstream and await endpoint_router.aon_failure(upstream, attempt, exception) and not chunks_delivered:
+                failed_upstreams.add(upstream.key)
+                retry_delay = upstream.retry_policy.get_delay(attempt, exception)
+                attempt += 1
                 continue
 
-            if not regenerate:
-                ChatQuery.objects.filter(id=current_conversation['id']).delete()
-
             raise CustomAPIException(
                 status_code=exception.http_status,
                 error_code=exception.code if exception.code else type(exception).__name__,
                 error_detail=exception.user_message
             )
 
-    chat_response_serialized = ChatResponseSerializer(data=chat_response_data)
-    chat_response_serialized.is_valid(raise_exception=True)
-    chat_response_serialized.save()
+        except BaseException:
+            # The client went away or the stream failed outside of Open AI.
+            if upstream:
+                endpoint_router.release(upstream)
+            raise
+
+
+async def cache_completion(chunks, prompt_key, timeout):
+    """
+    Function to cache the response of a completion stream once it is over.
+    :param chunks: Streaming chunks of the completion
+    :param prompt_key: Completion cache key
+    :param timeout: Completion cache timeout in seconds
+    :return: Streaming chunks of the completion
+    """
+    response_chunks = list()
+    try:
+        async for chunk_content in chunks:
+            response_chunks.append(chunk_content)
+            yield chunk_content
+    finally:
+        await chunks.aclose()
+
+    await completion_cache.aset(prompt_key, response_chunks, timeout=timeout)
+
+
+async def release_completion(chunks, release_admission):
+    """
+    Function to release the admission of an upstream completion stream once it is over.
+    :param chunks: Streaming chunks of the completion
+    :param release_admission: Coroutine function releasing the admission
+    :return: Streaming chunks of the completion
+    """
+    try:
+        async for chunk_content in chunks:
+            yield chunk_content
+    finally:
+        await chunks.aclose()
+        await release_admission()
+
+
+async def replay_completion(cached_chunks):
+    """
+    Function to replay the chunks of a cached completion, paced by the configured delay.
+    :param cached_chunks: Cached response chunks
+    :return: Streaming chunks of the cached response
+    """
+    replay_delay = settings.CHATBOT_COMPLETION_CACHE['REPLAY_DELAY']
+    for chunk_content in cached_chunks:
+        yield chunk_content
+        if replay_delay:
+            await asyncio.sleep(replay_delay)
+
+
+async def prepare_completion(model_id, chat_session_instance, query_content, regenerate=None):
+    """
+    Function to prepare an Open AI chat completion before its response starts: the prompt is assembled and,
+    unless the response is replayed from the cache or shared with an identical in-flight stream, the stream
+    is admitted against the tokens and concurrency budgets of the AI Model.
+    :param model_id: Open AI model ID
+    :param chat_session_instance: Instance of the Chat Session
+    :param query_content: Current query string
+    :param regenerate: Chat Query instance ID for which response is to regenerated
+    :return: Completion request streamed by completion()
+    """
+    ai_model_instance = await ai_model_registry.aget(model_id)
+    upstreams = ai_model_registry.get_upstreams(model_id)
+    encoding = get_encoding(ai_model_instance.model_id)
+
+    # Read the writes of this chat session that are still queued.
+    if conversation_writer.has_pending(chat_session_instance.id):
+        await sync_to_async(conversation_writer.flush)()
+
+    # The conversations folded into the summary are left out of the history. A regenerated conversation
+    # that is older than the summary is answered without it, as the summary covers later conversations.
+    summarized_query_id = chat_session_instance.summarized_query_id
+    if summarized_query_id and regenerate and int(regenerate) <= summarized_query_id:
+        summarized_query_id = None
+    chat_summary = chat_session_instance.summary if summarized_query_id else ''
+    history_filters = {'id__gt': summarized_query_id} if summarized_query_id else dict()
+
+    if regenerate:
+        chat_history = await get_chat_history(chat_session_instance, CHAT_HISTORY_LIMIT + 1,
+                                              id__lte=regenerate, **history_filters)
+        current_conversation = chat_history.pop(0)
+        await save_missing_tokens_count([current_conversation], encoding)
+
+    else:
+        chat_history = await get_chat_history(chat_session_instance, CHAT_HISTORY_LIMIT, **history_filters)
+        query_content = query_content_field.run_validation(query_content)
+        current_conversation = {
+            'id': None,
+            'content': query_content,
+            'tokens_count': {encoding.name: count_tokens(query_content, encoding)},
+            'responses_count': 0
+        }
+
+    await save_missing_tokens_count(chat_history, encoding)
+
+    regenerations_count = int(str(current_conversation['responses_count'])[-1])
+    with PROMPT_ASSEMBLY_DURATION.labels(model=ai_model_instance.model_id).time():
+        prompt, max_response_tokens, left_out_history = get_formatted_prompt(
+            current_conversation=current_conversation,
+            chat_history=chat_history,
+            ai_model_instance=ai_model_instance,
+            chat_summary=chat_summary
+        )
+
+    if ai_model_instance.compatibility == AIModel_COMPATIBILITY_CHOICES[0][0]:
+        temperature = round(1.6 - 0.08 * regenerations_count, 2) if regenerations_count else 0.8
+    else:
+        temperature = round(1.2 - 0.04 * regenerations_count, 2) if regenerations_count else 0.8
+
+    # Regenerations always ask the model for a new response.
+    prompt_key = None if regenerate else get_hash_key(ai_model_instance.model_id, prompt, temperature)
+    cache_enabled = bool(prompt_key) and ai_model_instance.response_cache_enabled
+    cached_chunks = await completion_cache.aget(prompt_key) if cache_enabled else None
+    single_flight = bool(prompt_key) and settings.CHATBOT_SINGLE_FLIGHT['ENABLED']
+
+    if cached_chunks is not None:
+        source = 'cache'
+    elif single_flight and completion_flights.is_in_flight(prompt_key):
+        source = 'coalesced'
+    else:
+        source = 'upstream'
+
+    # Open AI rate limits count the prompt tokens plus the requested maximum response tokens,
+    # which add up to the maximum tokens of the AI Model.
+    release_admission = None
+    if source == 'upstream':
+        release_admission = await admission_controller.admit(ai_model_instance, ai_model_instance.max_tokens)
+
+    return {'ai_model_instance': ai_model_instance,
+            'upstreams': upstreams,
+            'encoding': encoding,
+            'chat_session_instance': chat_session_instance,
+            'current_conversation': current_conversation,
+            'left_out_history': left_out_history,
+            'regenerate': regenerate,
+            'prompt': prompt,
+            'max_response_tokens': max_response_tokens,
+            'temperature': temperature,
+            'prompt_key': prompt_key,
+            'cache_enabled': cache_enabled,
+            'cached_chunks': cached_chunks,
+            'single_flight': single_flight,
+            'source': source,
+            'release_admission': release_admission}
+
+
+def close_completion(completion_request):
+    """
+    Function to release the admission of a prepared completion whose stream never started, e.g. as its client
+    went away before the first chunk or its response failed before streaming.
+    :param completion_request: Completion request returned by prepare_completion()
+    """
+    release_admission = completion_request.pop('release_admission', None)
+    if release_admission:
+        async_to_sync(release_admission)()
+
+
+async def completion(completion_request):
+    """
+    Function to stream the Open AI chat completion of a prepared request and save the conversation.
+    :param completion_request: Completion request returned by prepare_completion()
+    :return: Streaming chunks of Open AI model response
+    """
+    ai_model_instance = completion_request['ai_model_instance']
+    encoding = completion_request['encoding']
+    chat_session_instance = completion_request['chat_session_instance']
+    current_conversation = completion_request['current_conversation']
+    prompt_key = completion_request['prompt_key']
+    source = completion_request['source']
+
+    # The admission is released by the stream from now on, see close_completion().
+    release_admission = completion_request.pop('release_admission')
+    upstream_started = False
+
+    def upstream_stream():
+        nonlocal upstream_started
+        upstream_started = True
+        chunks = stream_completion(ai_model_instance=ai_model_instance,
+                                   prompt=completion_request['prompt'],
+                                   max_response_tokens=completion_request['max_response_tokens'],
+                                   temperature=completion_request['temperature'],
+                                   upstreams=completion_request['upstreams'])
+        if completion_request['cache_enabled']:
+            chunks = cache_completion(chunks, prompt_key, ai_model_instance.response_cache_timeout)
+        # The stream is released by its producer, which may outlive the clients of a shared stream.
+        return release_completion(chunks, release_admission) if release_admission else chunks
+
+    chat_response_data = {
+        'content': str()
+    }
+    first_chunk_at = None
+    try:
+        if source == 'cache':
+            chunks = replay_completion(completion_request['cached_chunks'])
+        elif completion_request['single_flight']:
+            # Identical concurrent prompts share a single upstream stream, which is stopped once every client
+            # went away unless its response is cached.
+            chunks = completion_flights.join(prompt_key, upstream_stream,
+                                             keep_alive=completion_request['cache_enabled'])
+            if release_admission and not upstream_started:
+                # An identical stream started in the meantime, the admitted one is not needed.
+                await release_admission()
+        else:
+            chunks = upstream_stream()
+
+        async for chunk_content in chunks:
+            first_chunk_at = first_chunk_at or time.perf_counter()
+            chat_response_data['content'] += chunk_content
+            yield chunk_content
+
+    except (GeneratorExit, asyncio.CancelledError):
+        # The client went away, the query is still saved without a response.
+        await chunks.aclose()
+        save_conversation(chat_session_instance, ai_model_instance, current_conversation, None)
+        raise
+
+    response_tokens_count = count_tokens(chat_response_data['content'], encoding)
+    chat_response_data['tokens_count'] = {encoding.name: response_tokens_count}
+    metric_labels = {'model': ai_model_instance.model_id, 'endpoint': current_endpoint.get(), 'source': source}
+    COMPLETION_TOKENS.labels(**metric_labels).inc(response_tokens_count)
+    if first_chunk_at and time.perf_counter() > first_chunk_at:
+        COMPLETION_TOKENS_PER_SECOND.labels(**metric_labels).observe(
+            response_tokens_count / (time.perf_counter() - first_chunk_at))
+
+    save_conversation(chat_session_instance, ai_model_instance, current_conversation, chat_response_data)
+    schedule_summary_refresh(chat_session_instance, completion_request['left_out_history'], encoding,
+                             completion_request['regenerate'])
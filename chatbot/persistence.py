@@ -0,0 +1,228 @@
+import os
+import json
+import atexit
+import logging
+import threading
+from datetime import datetime
+from collections import Counter
+
+from django.conf import settings
+from django.utils import timezone
+from django.db import (transaction,
+                       close_old_connections)
+from django.db.models import (F,
+                              Case,
+                              When,
+                              Value)
+
+from .models import (ChatQuery,
+                     ChatSession,
+                     ChatResponse)
+
+logger = logging.getLogger('django')
+
+
+class ConversationWriter:
+    """
+    Write-behind persistence of conversations.
+    Queued chat queries and responses are written with bulk inserts by a background thread once
+    the batch size or the flush interval is reached. A batch that cannot be written is written again
+    conversation by conversation: the conversations failing while others are written are moved to a
+    dead-letter file, and the rest is appended to a per-process spool file replayed on the next flush.
+    Pending writes are flushed at exit.
+
+    The queue is per process and the writes are deferred, which is the trade-off of not blocking the streams
+    on the database: a conversation is seen by the other workers only once flushed, up to FLUSH_INTERVAL
+    later, e.g. by a follow-up turn or the conversations list served by another worker, and the created_at
+    of its Chat Query and Chat Response is the time of the flush.
+    """
+
+    def __init__(self):
+        self._pending = list()
+        self._pending_sessions = Counter()
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def config(self):
+        return settings.CHATBOT_WRITE_BEHIND
+
+    @property
+    def spool_path(self):
+        return os.path.join(self.config['SPOOL_DIR'], f'conversation_spool_{os.getpid()}.jsonl')
+
+    @property
+    def dead_letter_path(self):
+        return os.path.join(self.config['SPOOL_DIR'], f'conversation_dead_letters_{os.getpid()}.jsonl')
+
+    def enqueue(self, chat_session_id, chat_query, chat_response, model_id=None):
+        """
+        Method to queue the writes of a conversation without blocking.
+        :param chat_session_id: Chat Session ID
+        :param chat_query: Chat Query data, with an 'id' if it is already saved
+        :param chat_response: Chat Response data, or None
+        :param model_id: ID of the AI Model used, or None
+        """
+        with self._condition:
+            self._pending.append({'chat_session_id': chat_session_id,
+                                  'chat_query': chat_query,
+                                  'chat_response': chat_response,
+                                  'model_id': model_id,
+                                  'created_at': timezone.now().isoformat()})
+            self._pending_sessions[chat_session_id] += 1
+            if len(self._pending) >= self.config['MAX_BATCH_SIZE']:
+                self._condition.notify()
+
+        if self._thread is None and self.config['FLUSH_INTERVAL'] is not None:
+            self.start()
+
+    def has_pending(self, chat_session_id):
+        """
+        Method to check whether a chat session has writes queued or spooled by this process.
+        """
+        return self._pending_sessions[chat_session_id] > 0
+
+    def start(self):
+        with self._condition:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self.run, name='conversation-writer', daemon=True)
+                self._thread.start()
+
+    def run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: len(self._pending) >= self.config['MAX_BATCH_SIZE'],
+                                         timeout=self.config['FLUSH_INTERVAL'])
+            self.flush()
+            close_old_connections()
+
+    def flush(self):
+        """
+        Method to write every queued conversation along with the spooled ones.
+        """
+        with self._flush_lock:
+            with self._condition:
+                pending, self._pending = self._pending, list()
+
+            spooled = self.read_spool()
+            if not pending and not spooled:
+                return
+
+            # Sessions stay pending until their writes reach the database or the dead letters.
+            failed = spooled + pending
+            try:
+                try:
+                    self.write(spooled + pending)
+                    failed = list()
+                except Exception:
+                    logger.exception('Conversation batch write failed, writing its conversations one by one')
+                    failed = self.write_each(spooled + pending)
+
+                if spooled:
+                    os.remove(self.spool_path)
+                if failed:
+                    logger.error('%s conversation writes spooled to %s', len(failed), self.spool_path)
+                    self.spool(failed)
+            finally:
+                with self._condition:
+                    self._pending_sessions.subtract(entry['chat_session_id'] for entry in spooled + pending)
+                    self._pending_sessions.update(entry['chat_session_id'] for entry in failed)
+                    self._pending_sessions += Counter()
+
+    def write_each(self, entries):
+        """
+        Method to write conversations one by one, moving the ones failing while others are written
+        to the dead-letter file.
+        :param entries: Queued conversations
+        :return: Conversations to write again, all of them if none could be written
+        """
+        failed = list()
+        for entry in entries:
+            try:
+                self.write([entry])
+            except Exception:
+                failed.append(entry)
+
+        if failed and len(failed) < len(entries):
+            logger.error('%s conversation writes moved to %s', len(failed), self.dead_letter_path)
+            self.spool(failed, self.dead_letter_path)
+            return list()
+        return failed
+
+    @staticmethod
+    @transaction.atomic
+    def write(entries):
+        """
+        Method to save conversations with bulk inserts and update the latest response pointers
+        along with the aggregates of the chat sessions.
+        :param entries: Queued conversations
+        """
+        new_chat_queries = ChatQuery.objects.bulk_create([
+            ChatQuery(chat_session_id=entry['chat_session_id'], **entry['chat_query'])
+            for entry in entries if entry['chat_query'].get('id') is None])
+
+        new_chat_queries = iter(new_chat_queries)
+        chat_responses = list()
+        for entry in entries:
+            chat_query_id = entry['chat_query'].get('id') or next(new_chat_queries).id
+            if entry['chat_response']:
+                chat_responses.append(ChatResponse(chat_query_id=chat_query_id, **entry['chat_response']))
+        ChatResponse.objects.bulk_create(chat_responses)
+
+        latest_responses = {chat_response.chat_query_id: chat_response.id for chat_response in chat_responses}
+        responses_counts = Counter(chat_response.chat_query_id for chat_response in chat_responses)
+        if latest_responses:
+            ChatQuery.objects.filter(id__in=latest_responses).update(
+                latest_response_id=Case(*[When(id=chat_query_id, then=Value(chat_response_id))
+                                          for chat_query_id, chat_response_id in latest_responses.items()]),
+                responses_count=F('responses_count') + Case(*[When(id=chat_query_id, then=Value(count))
+                                                              for chat_query_id, count in responses_counts.items()])
+            )
+
+        ConversationWriter.update_chat_sessions(entries)
+
+    @staticmethod
+    def update_chat_sessions(entries):
+        """
+        Method to increment the queries count and to set the last activity and model of the chat sessions
+        with a single update, instead of aggregating their conversations on read.
+        :param entries: Written conversations
+        """
+        queries_counts = Counter(entry['chat_session_id'] for entry in entries if entry['chat_query'].get('id') is None)
+        last_activities = dict()
+        last_models = dict()
+        for entry in entries:
+            # Entries spooled by earlier versions carry neither a timestamp nor a model.
+            last_activities[entry['chat_session_id']] = entry.get('created_at') or timezone.now().isoformat()
+            if entry.get('model_id'):
+                last_models[entry['chat_session_id']] = entry['model_id']
+
+        ChatSession.objects.filter(id__in=last_activities).update(
+            queries_count=F('queries_count') + Case(*[When(id=chat_session_id, then=Value(count))
+                                                      for chat_session_id, count in queries_counts.items()],
+                                                    default=Value(0)),
+            last_activity_at=Case(*[When(id=chat_session_id, then=Value(datetime.fromisoformat(last_activity_at)))
+                                    for chat_session_id, last_activity_at in last_activities.items()]),
+            last_model=Case(*[When(id=chat_session_id, then=Value(model_id))
+                              for chat_session_id, model_id in last_models.items()],
+                            default=F('last_model')),
+            updated_at=timezone.now()
+        )
+
+    def spool(self, entries, spool_path=None):
+        os.makedirs(self.config['SPOOL_DIR'], exist_ok=True)
+        with open(spool_path or self.spool_path, 'a') as spool_file:
+            for entry in entries:
+                spool_file.write(json.dumps(entry) + '\n')
+
+    def read_spool(self, spool_path=None):
+        try:
+            with open(spool_path or self.spool_path) as spool_file:
+                return [json.loads(line) for line in spool_file if line.strip()]
+        except FileNotFoundError:
+            return list()
+
+
+conversation_writer = ConversationWriter()
+atexit.register(conversation_writer.flush)
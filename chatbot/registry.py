@@ -0,0 +1,132 @@
+import time
+import threading
+from uuid import uuid4
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db.models import Prefetch
+
+from .constants import (AI_MODEL_REGISTRY_VERSION_KEY,
+                        AI_MODEL_REGISTRY_CHECK_INTERVAL)
+from .models import (AIModel,
+                     AIModelEndpoint)
+from .serializers import AIModelSerializer
+from .tokens import get_encoding
+from .routing import (get_completion_upstreams,
+                      get_moderation_upstreams)
+
+
+class AIModelRegistry:
+    """
+    Process-wide in-memory registry of AI Model instances, their encodings and the upstreams of their requests.
+    Workers reload it whenever the version stamp shared through the Django cache changes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked_at = 0.0
+        self._ai_models = dict()
+        self._serialized_data = list()
+        self._upstreams = dict()
+        self._moderation_upstreams = get_moderation_upstreams([])
+
+    def load(self):
+        """
+        Method to load every AI Model instance along with its encoding and active endpoints.
+        """
+        ai_models = {ai_model.model_id: ai_model for ai_model in AIModel.objects.prefetch_related(
+            Prefetch('r_endpoints', queryset=AIModelEndpoint.objects.filter(is_active=True).order_by('id'))
+        ).order_by('id')}
+        for model_id in ai_models:
+            get_encoding(model_id)
+
+        self._ai_models = ai_models
+        self._serialized_data = AIModelSerializer(list(ai_models.values()), many=True).data
+        self._upstreams = {model_id: get_completion_upstreams(ai_model, ai_model.r_endpoints.all())
+                           for model_id, ai_model in ai_models.items()}
+        self._moderation_upstreams = get_moderation_upstreams(
+            [ai_model_endpoint for ai_model in ai_models.values()
+             for ai_model_endpoint in ai_model.r_endpoints.all() if ai_model_endpoint.serves_moderation])
+
+    def refresh(self):
+        """
+        Method to reload the registry if its version stamp has changed since the last load.
+        """
+        if self.is_fresh():
+            return
+
+        with self._lock:
+            version = cache.get(AI_MODEL_REGISTRY_VERSION_KEY)
+            if version is None:
+                cache.add(AI_MODEL_REGISTRY_VERSION_KEY, uuid4().hex, timeout=None)
+                version = cache.get(AI_MODEL_REGISTRY_VERSION_KEY)
+
+            if version != self._version:
+                self.load()
+                self._version = version
+            self._checked_at = time.monotonic()
+
+    def is_fresh(self):
+        """
+        Method to check whether the version stamp was checked recently enough to skip the cache lookup.
+        """
+        return self._version is not None and \
+            time.monotonic() - self._checked_at < AI_MODEL_REGISTRY_CHECK_INTERVAL
+
+    def get(self, model_id):
+        """
+        Method to get an AI Model instance by its model ID.
+        :param model_id: Open AI model ID
+        :return: AI Model instance
+        """
+        self.refresh()
+        try:
+            return self._ai_models[model_id]
+        except KeyError:
+            raise AIModel.DoesNotExist('AIModel matching query does not exist.')
+
+    async def aget(self, model_id):
+        """
+        Asynchronous version of get(), served without leaving the event loop while the registry is fresh.
+        """
+        if not self.is_fresh():
+            await sync_to_async(self.refresh)()
+        return self.get(model_id)
+
+    def get_upstreams(self, model_id):
+        """
+        Method to get the upstreams of the completion requests of an AI Model.
+        :param model_id: Open AI model ID
+        :return: Upstreams of the AI Model
+        """
+        self.refresh()
+        try:
+            return self._upstreams[model_id]
+        except KeyError:
+            raise AIModel.DoesNotExist('AIModel matching query does not exist.')
+
+    def get_moderation_upstreams(self):
+        """
+        Method to get the upstreams of the moderation requests.
+        """
+        self.refresh()
+        return self._moderation_upstreams
+
+    def get_serialized_data(self):
+        """
+        Method to get the serialized list of all AI Model instances.
+        """
+        self.refresh()
+        return self._serialized_data
+
+    def invalidate(self):
+        """
+        Method to bump the shared version stamp, making every worker reload its registry,
+        this one on its next access.
+        """
+        cache.set(AI_MODEL_REGISTRY_VERSION_KEY, uuid4().hex, timeout=None)
+        self._checked_at = 0.0
+
+
+ai_model_registry = AIModelRegistry()
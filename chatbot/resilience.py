@@ -0,0 +1,215 @@
+import math
+import time
+import random
+import asyncio
+from email.utils import parsedate_to_datetime
+
+import openai
+
+from utilities.messages import ERROR_CODES
+from .metrics import UPSTREAM_RETRIES
+from .constants import (RETRY_MAX_DELAY,
+                        RETRY_BASE_DELAY,
+                        RETRY_MAX_ATTEMPTS,
+                        CIRCUIT_BREAKER_FAILURE_WINDOW,
+                        CIRCUIT_BREAKER_RECOVERY_TIMEOUT,
+                        CIRCUIT_BREAKER_FAILURE_THRESHOLD)
+
+RETRYABLE_EXCEPTIONS = (openai.error.Timeout,
+                        openai.error.APIError,
+                        openai.error.RateLimitError,
+                        openai.error.APIConnectionError,
+                        openai.error.ServiceUnavailableError)
+
+_local_state_cache = None
+
+
+def get_state_cache():
+    """
+    Function to get the cache holding circuit breaker states.
+    The Django cache is shared across worker processes; standalone scripts without
+    configured Django settings fall back to a process-local cache.
+    """
+    global _local_state_cache
+    from django.conf import settings
+
+    if settings.configured:
+        from django.core.cache import cache
+        return cache
+
+    if _local_state_cache is None:
+        from django.core.cache.backends.locmem import LocMemCache
+        _local_state_cache = LocMemCache('chatbot-resilience', {})
+    return _local_state_cache
+
+
+class CircuitOpenError(openai.error.ServiceUnavailableError):
+    """
+    Exception raised instead of calling an upstream that is known to be failing.
+    """
+
+    def __init__(self, retry_after):
+        super().__init__(message=ERROR_CODES['circuit_open'], http_status=503, code='circuit_open',
+                         headers={'Retry-After': str(math.ceil(retry_after))})
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker opened after a number of upstream failures within a time window.
+    While open, calls fail fast; once the recovery timeout elapses a single failure opens it again
+    until a call succeeds.
+    """
+
+    def __init__(self, name,
+                 failure_threshold=CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+                 failure_window=CIRCUIT_BREAKER_FAILURE_WINDOW,
+                 recovery_timeout=CIRCUIT_BREAKER_RECOVERY_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.failure_window = failure_window
+        self.recovery_timeout = recovery_timeout
+        self.failures_key = f'chatbot:circuit_breaker:{name}:failures'
+        self.opened_until_key = f'chatbot:circuit_breaker:{name}:opened_until'
+
+    def get_retry_after(self):
+        """
+        Method to get the seconds left before the circuit closes, or 0 if it is closed.
+        """
+        opened_until = get_state_cache().get(self.opened_until_key)
+        return max(opened_until - time.time(), 0) if opened_until else 0
+
+    def check(self):
+        """
+        Method to raise CircuitOpenError while the circuit is open.
+        """
+        retry_after = self.get_retry_after()
+        if retry_after:
+            raise CircuitOpenError(retry_after)
+
+    def record_success(self):
+        state_cache = get_state_cache()
+        if state_cache.get(self.failures_key):
+            state_cache.delete(self.failures_key)
+
+    def record_failure(self):
+        state_cache = get_state_cache()
+        state_cache.add(self.failures_key, 0, timeout=self.failure_window + self.recovery_timeout)
+        try:
+            failures = state_cache.incr(self.failures_key)
+        except ValueError:
+            failures = 1
+            state_cache.set(self.failures_key, failures, timeout=self.failure_window + self.recovery_timeout)
+
+        if failures >= self.failure_threshold:
+            state_cache.set(self.opened_until_key, time.time() + self.recovery_timeout,
+                            timeout=self.recovery_timeout)
+
+
+def get_retry_after(exception):
+    """
+    Function to get the delay requested by an upstream through the Retry-After header.
+    :param exception: Open AI exception
+    :return: Delay in seconds, or None
+    """
+    retry_after = (getattr(exception, 'headers', None) or dict()).get('Retry-After')
+    if retry_after is None:
+        return None
+
+    try:
+        return max(float(retry_after), 0)
+    except ValueError:
+        try:
+            return max(parsedate_to_datetime(retry_after).timestamp() - time.time(), 0)
+        except (TypeError, ValueError):
+            return None
+
+
+class RetryPolicy:
+    """
+    Retry policy with capped exponential backoff and full jitter, honoring Retry-After headers
+    and guarded by an optional circuit breaker.
+    """
+
+    def __init__(self, circuit_breaker=None,
+                 max_attempts=RETRY_MAX_ATTEMPTS,
+                 base_delay=RETRY_BASE_DELAY,
+                 max_delay=RETRY_MAX_DELAY):
+        self.circuit_breaker = circuit_breaker
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def get_delay(self, attempt, exception):
+        """
+        Method to get the delay before the next attempt.
+        :param attempt: Number of the failed attempt, starting at 1
+        :param exception: Exception of the failed attempt
+        :return: Delay in seconds
+        """
+        retry_after = get_retry_after(exception)
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def before_attempt(self):
+        if self.circuit_breaker:
+            self.circuit_breaker.check()
+
+    def on_success(self):
+        if self.circuit_breaker:
+            self.circuit_breaker.record_success()
+
+    def on_failure(self, attempt, exception):
+        """
+        Method to record a failed attempt.
+        :param attempt: Number of the failed attempt, starting at 1
+        :param exception: Exception of the failed attempt
+        :return: Whether the call should be attempted again
+        """
+        if isinstance(exception, CircuitOpenError) or not isinstance(exception, RETRYABLE_EXCEPTIONS):
+            return False
+
+        if self.circuit_breaker:
+            self.circuit_breaker.record_failure()
+
+        if attempt < self.max_attempts:
+            UPSTREAM_RETRIES.labels(upstream=self.circuit_breaker.name if self.circuit_breaker else 'default',
+                                    exception=type(exception).__name__).inc()
+            return True
+        return False
+
+    def call(self, func, *args, **kwargs):
+        """
+        Method to call a function, retrying it on retryable Open AI exceptions.
+        """
+        attempt = 1
+        while True:
+            try:
+                self.before_attempt()
+                result = func(*args, **kwargs)
+                self.on_success()
+                return result
+
+            except openai.error.OpenAIError as exception:
+                if not self.on_failure(attempt, exception):
+                    raise
+                time.sleep(self.get_delay(attempt, exception))
+                attempt += 1
+
+    async def acall(self, func, *args, **kwargs):
+        """
+        Asynchronous version of call() for coroutine functions.
+        """
+        attempt = 1
+        while True:
+            try:
+                self.before_attempt()
+                result = await func(*args, **kwargs)
+                self.on_success()
+                return result
+
+            except openai.error.OpenAIError as exception:
+                if not self.on_failure(attempt, exception):
+                    raise
+                await asyncio.sleep(self.get_delay(attempt, exception))
+                attempt += 1
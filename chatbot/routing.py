@@ -0,0 +1,216 @@
+import math
+import time
+import random
+import threading
+from collections import defaultdict
+
+import openai
+from asgiref.sync import sync_to_async
+
+from .metrics import UPSTREAM_REQUESTS
+from .constants import (ROUTING_EWMA_ALPHA,
+                        ROUTING_THROTTLE_COOLDOWN,
+                        AIModel_ROUTING_POLICY_CHOICES)
+from .resilience import (RetryPolicy,
+                         CircuitBreaker,
+                         CircuitOpenError,
+                         get_state_cache,
+                         get_retry_after)
+
+
+class Upstream:
+    """
+    Upstream of Open AI requests: the credentials and API base of an AI Model Endpoint, or the default ones
+    of the Open AI client, along with the retry policy and circuit breaker guarding it.
+    """
+
+    def __init__(self, key, name, weight=1, credentials=None):
+        self.key = key
+        self.name = name
+        self.weight = weight
+        self.credentials = credentials or dict()
+        self.circuit_breaker = CircuitBreaker(key)
+        self.retry_policy = RetryPolicy(circuit_breaker=self.circuit_breaker)
+        self.throttled_until_key = f'chatbot:upstream:{key}:throttled_until'
+
+    @classmethod
+    def from_endpoint(cls, scope, ai_model_endpoint):
+        """
+        Method to build the upstream of an AI Model Endpoint, leaving its blank credentials to the Open AI client.
+        :param scope: Prefix of the upstream key, e.g. completion:<model ID>
+        :param ai_model_endpoint: Instance of the AI Model Endpoint
+        """
+        credentials = {'api_key': ai_model_endpoint.api_key,
+                       'organization': ai_model_endpoint.organization,
+                       'api_base': ai_model_endpoint.api_base}
+        return cls(key=f'{scope}:{ai_model_endpoint.name}',
+                   name=ai_model_endpoint.name,
+                   weight=ai_model_endpoint.weight,
+                   credentials={name: value for name, value in credentials.items() if value})
+
+
+def get_completion_upstreams(ai_model_instance, ai_model_endpoints):
+    """
+    Function to get the upstreams of the completion requests of an AI Model.
+    :param ai_model_instance: Instance of the AI Model
+    :param ai_model_endpoints: Active AI Model Endpoint instances of the AI Model
+    :return: Upstream of each endpoint, or the default upstream if the AI Model has none
+    """
+    scope = f'completion:{ai_model_instance.model_id}'
+    if not ai_model_endpoints:
+        return [Upstream(key=scope, name='default')]
+    return [Upstream.from_endpoint(scope, ai_model_endpoint) for ai_model_endpoint in ai_model_endpoints]
+
+
+def get_moderation_upstreams(ai_model_endpoints):
+    """
+    Function to get the upstreams of the moderation requests, one per distinct credentials.
+    :param ai_model_endpoints: Active AI Model Endpoint instances serving the moderation requests
+    :return: Upstream of each endpoint, or the default upstream if none serves the moderation requests
+    """
+    upstreams = dict()
+    for ai_model_endpoint in ai_model_endpoints:
+        upstream = Upstream.from_endpoint(f'moderation:{ai_model_endpoint.ai_model_id}', ai_model_endpoint)
+        upstreams.setdefault(tuple(sorted(upstream.credentials.items())), upstream)
+
+    return list(upstreams.values()) or [Upstream(key='moderation', name='default')]
+
+
+class EndpointRouter:
+    """
+    Router spreading the Open AI requests across the upstreams of an AI Model, by weighted least outstanding
+    requests or weighted EWMA latency. Outstanding requests and latencies are tracked per worker process,
+    while the health of the upstreams, i.e. open circuits and rate limits, is shared through the Django cache.
+    """
+
+    def __init__(self, ewma_alpha=ROUTING_EWMA_ALPHA):
+        self.ewma_alpha = ewma_alpha
+        self._lock = threading.Lock()
+        self._outstanding = defaultdict(int)
+        self._latencies = dict()
+
+    def get_scores(self, upstreams, routing_policy):
+        """
+        Method to score the upstreams, the lowest score being selected.
+        Upstreams without a latency yet are scored with the lowest known one, so they are tried early.
+        """
+        scores = {upstream.key: (self._outstanding[upstream.key] + 1) / upstream.weight for upstream in upstreams}
+        if routing_policy == AIModel_ROUTING_POLICY_CHOICES[1][0]:
+            latencies = [self._latencies[upstream.key] for upstream in upstreams if upstream.key in self._latencies]
+            default_latency = min(latencies, default=1.0)
+            for upstream in upstreams:
+                scores[upstream.key] *= self._latencies.get(upstream.key, default_latency)
+        return scores
+
+    def select(self, upstreams, routing_policy, exclude=()):
+        """
+        Method to select the upstream of the next attempt of a request and count it as outstanding.
+        Upstreams with an open circuit are left out, the rate limited and excluded ones are only selected
+        when no other is left.
+        :param upstreams: Upstreams of the request
+        :param routing_policy: AI Model routing policy
+        :param exclude: Keys of the upstreams that already failed the request
+        :return: Selected upstream
+        """
+        health = get_state_cache().get_many([key for upstream in upstreams
+                                             for key in (upstream.circuit_breaker.opened_until_key,
+                                                         upstream.throttled_until_key)])
+        now = time.time()
+        available = [upstream for upstream in upstreams
+                     if health.get(upstream.circuit_breaker.opened_until_key, 0) <= now]
+        if not available:
+            raise CircuitOpenError(min(health[upstream.circuit_breaker.opened_until_key]
+                                       for upstream in upstreams) - now)
+
+        candidates = [upstream for upstream in available if upstream.key not in exclude and
+                      health.get(upstream.throttled_until_key, 0) <= now] or available
+        with self._lock:
+            scores = self.get_scores(candidates, routing_policy)
+            upstream = min(candidates, key=lambda candidate: (scores[candidate.key], random.random()))
+            self._outstanding[upstream.key] += 1
+        return upstream
+
+    async def aselect(self, upstreams, routing_policy, exclude=()):
+        """
+        Asynchronous version of select(), making the cache requests outside of the event loop.
+        """
+        return await sync_to_async(self.select, thread_sensitive=False)(upstreams, routing_policy, exclude=exclude)
+
+    def release(self, upstream, latency=None):
+        """
+        Method to stop counting a request attempt as outstanding, updating the EWMA latency of its upstream.
+        :param upstream: Upstream of the attempt
+        :param latency: Latency of a successful attempt in seconds
+        """
+        with self._lock:
+            self._outstanding[upstream.key] -= 1
+            if latency is not None:
+                previous_latency = self._latencies.get(upstream.key, latency)
+                self._latencies[upstream.key] = previous_latency + self.ewma_alpha * (latency - previous_latency)
+
+    def on_success(self, upstream, latency):
+        self.release(upstream, latency)
+        upstream.retry_policy.on_success()
+        UPSTREAM_REQUESTS.labels(upstream=upstream.key, result='success').inc()
+
+    async def aon_success(self, upstream, latency):
+        """
+        Asynchronous version of on_success(), making the cache requests outside of the event loop.
+        """
+        await sync_to_async(self.on_success, thread_sensitive=False)(upstream, latency)
+
+    def on_failure(self, upstream, attempt, exception):
+        """
+        Method to record a failed attempt, a rate limited upstream being avoided by the next requests
+        for its Retry-After delay.
+        :param upstream: Upstream of the attempt
+        :param attempt: Number of the failed attempt, starting at 1
+        :param exception: Exception of the failed attempt
+        :return: Whether the request should be attempted again
+        """
+        self.release(upstream)
+        UPSTREAM_REQUESTS.labels(upstream=upstream.key, result='failed').inc()
+        if isinstance(exception, openai.error.RateLimitError):
+            cooldown = get_retry_after(exception) or ROUTING_THROTTLE_COOLDOWN
+            get_state_cache().set(upstream.throttled_until_key, time.time() + cooldown, timeout=math.ceil(cooldown))
+        return upstream.retry_policy.on_failure(attempt, exception)
+
+    async def aon_failure(self, upstream, attempt, exception):
+        """
+        Asynchronous version of on_failure(), making the cache requests outside of the event loop.
+        """
+        return await sync_to_async(self.on_failure, thread_sensitive=False)(upstream, attempt, exception)
+
+    def call(self, upstreams, routing_policy, func, **kwargs):
+        """
+        Method to call an Open AI function with the credentials of the selected upstream, failing over to
+        another upstream on retryable exceptions. Retries of an upstream that already failed are delayed.
+        """
+        attempt = 1
+        failed_upstreams = set()
+        retry_delay = 0
+        while True:
+            upstream = self.select(upstreams, routing_policy, exclude=failed_upstreams)
+            try:
+                if upstream.key in failed_upstreams:
+                    time.sleep(retry_delay)
+                started_at = time.perf_counter()
+                result = func(**upstream.credentials, **kwargs)
+
+            except openai.error.OpenAIError as exception:
+                if not self.on_failure(upstream, attempt, exception):
+                    raise
+                failed_upstreams.add(upstream.key)
+                retry_delay = upstream.retry_policy.get_delay(attempt, exception)
+                attempt += 1
+                continue
+
+            except BaseException:
+                self.release(upstream)
+                raise
+
+            self.on_success(upstream, time.perf_counter() - started_at)
+            return result
+
+
+endpoint_router = EndpointRouter()
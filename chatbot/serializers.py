@@ -1,4 +1,9 @@
-from rest_framework.serializers import ModelSerializer
+from rest_framework.serializers import (CharField,
+                                        ListField,
+                                        Serializer,
+                                        ModelSerializer)
+
+from .constants import MODERATION_BATCH_MAX_CONTENTS
 
 from .models import (AIModel,
                      ChatQuery,
@@ -6,16 +11,31 @@ from .models import (AIModel,
                      ChatResponse)
 
 
+class ExpandableFieldsMixin:
+    """
+    Serializer mixin dropping the Meta.expandable_fields that are not requested through the 'expand' context.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        # Expandable fields are only serialized on request, e.g. ?expand=chat_responses
+        for field_name in set(self.Meta.expandable_fields) - set(self.context.get('expand', list())):
+            self.fields.pop(field_name)
+
+
 class AIModelSerializer(ModelSerializer):
     class Meta:
         model = AIModel
         fields = '__all__'
 
 
-class ChatSessionSerializer(ModelSerializer):
+class ChatSessionSerializer(ExpandableFieldsMixin, ModelSerializer):
     class Meta:
         model = ChatSession
         fields = '__all__'
+        read_only_fields = ['queries_count', 'last_activity_at', 'last_model', 'summary', 'summarized_query']
+        expandable_fields = ['queries_count', 'last_activity_at', 'last_model', 'summary', 'summarized_query']
 
 
 class ChatResponseSerializer(ModelSerializer):
@@ -24,9 +44,17 @@ class ChatResponseSerializer(ModelSerializer):
         fields = '__all__'
 
 
-class ConversationSerializer(ModelSerializer):
+class ConversationSerializer(ExpandableFieldsMixin, ModelSerializer):
+    latest_response = ChatResponseSerializer(read_only=True)
     chat_responses = ChatResponseSerializer(source='r_chat_responses', many=True, read_only=True)
 
     class Meta:
         model = ChatQuery
         fields = '__all__'
+        read_only_fields = ['responses_count']
+        expandable_fields = ['chat_responses']
+
+
+class ContentModerationBatchSerializer(Serializer):
+    contents = ListField(child=CharField(trim_whitespace=False), allow_empty=False,
+                         max_length=MODERATION_BATCH_MAX_CONTENTS)
@@ -0,0 +1,29 @@
+from django.db import transaction
+from django.dispatch import receiver
+from django.db.backends.signals import connection_created
+from django.db.models.signals import (post_save,
+                                      post_delete)
+
+from utilities.metrics import record_query_duration
+from .models import (AIModel,
+                     AIModelEndpoint)
+from .registry import ai_model_registry
+
+
+@receiver([post_save, post_delete], sender=AIModel)
+@receiver([post_save, post_delete], sender=AIModelEndpoint)
+def invalidate_ai_model_registry(sender, **kwargs):
+    """
+    Signal receiver to invalidate the AI Model registry of every worker on an AI Model or AI Model Endpoint change.
+    The version stamp is bumped once the change is committed, as a worker reloading before would keep the
+    previous rows under the new version.
+    """
+    transaction.on_commit(ai_model_registry.invalidate)
+
+
+@receiver(connection_created)
+def time_database_queries(sender, connection, **kwargs):
+    """
+    Signal receiver to record the query durations of every new database connection.
+    """
+    connection.execute_wrappers.append(record_query_duration)
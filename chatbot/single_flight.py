@@ -0,0 +1,114 @@
+import asyncio
+import weakref
+
+
+class Flight:
+    """
+    Buffer of the chunks streamed by an in-flight upstream request, shared by all of its subscribers.
+    """
+
+    def __init__(self, keep_alive=False):
+        self.chunks = list()
+        self.done = False
+        self.exception = None
+        self.changed = asyncio.Event()
+        self.task = None
+        self.keep_alive = keep_alive
+        self.subscribers_count = 0
+
+    def notify(self):
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    async def subscribe(self, on_abandoned):
+        """
+        Method to stream every chunk of the flight, including the ones buffered before subscribing.
+        :param on_abandoned: Callable called when the last subscriber leaves before the flight is done
+        """
+        self.subscribers_count += 1
+        try:
+            index = 0
+            while True:
+                changed = self.changed
+                while index < len(self.chunks):
+                    yield self.chunks[index]
+                    index += 1
+
+                if self.done:
+                    if self.exception:
+                        raise self.exception
+                    return
+                await changed.wait()
+
+        finally:
+            self.subscribers_count -= 1
+            if not self.subscribers_count and not self.done:
+                on_abandoned()
+
+
+class SingleFlight:
+    """
+    Coalescing of identical concurrent streams: the first request of a key starts the upstream stream
+    in a background task and every request of that key, the first included, subscribes to its buffer.
+    Flights are kept per event loop, as their tasks and events are bound to the loop that started them,
+    so requests are only coalesced under ASGI; under WSGI each request thread streams on a loop of its own.
+    """
+
+    def __init__(self):
+        self._flights = weakref.WeakKeyDictionary()
+
+    def get_flights(self):
+        """
+        Method to get the in-flight streams of the running event loop, by key.
+        """
+        return self._flights.setdefault(asyncio.get_running_loop(), dict())
+
+    def join(self, key, stream_factory, keep_alive=False):
+        """
+        Method to subscribe to the in-flight stream of a key, starting it if there is none.
+        :param key: Hash of the request
+        :param stream_factory: Callable returning the upstream asynchronous stream
+        :param keep_alive: Whether a stream started by this call is consumed to its end even when
+                           every subscriber left, e.g. to cache its response
+        :return: Streaming chunks of the shared upstream stream
+        """
+        flights = self.get_flights()
+        flight = flights.get(key)
+        if flight is None:
+            flight = Flight(keep_alive=keep_alive)
+            flights[key] = flight
+            flight.task = asyncio.create_task(self.produce(key, flight, stream_factory()))
+
+        return flight.subscribe(on_abandoned=lambda: self.abandon(key, flight))
+
+    def is_in_flight(self, key):
+        return key in self.get_flights()
+
+    def abandon(self, key, flight):
+        """
+        Method to stop the upstream stream of a flight every subscriber left, unless it is kept alive.
+        """
+        if flight.keep_alive:
+            return
+
+        flights = self.get_flights()
+        if flights.get(key) is flight:
+            del flights[key]
+        flight.task.cancel()
+
+    async def produce(self, key, flight, stream):
+        try:
+            async for chunk in stream:
+                flight.chunks.append(chunk)
+                flight.notify()
+        except Exception as exception:
+            flight.exception = exception
+        except asyncio.CancelledError as exception:
+            flight.exception = exception
+            raise
+        finally:
+            flight.done = True
+            flight.notify()
+            flights = self.get_flights()
+            if flights.get(key) is flight:
+                del flights[key]
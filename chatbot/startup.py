@@ -0,0 +1,94 @@
+import time
+import logging
+from importlib import import_module
+
+from django.conf import settings
+from django.db import connections
+from django.urls import reverse
+
+from .registry import ai_model_registry
+from .tokens import (count_tokens,
+                     get_encoding,
+                     get_message_overhead,
+                     get_system_instruction_tokens_count)
+
+logger = logging.getLogger('django')
+
+# Duration in seconds of each warm-up step run by this process.
+warm_up_report = dict()
+
+
+def load_urls():
+    """
+    Function to import the URL configuration along with the views it routes to, and to populate the URL resolvers.
+    """
+    import_module(settings.ROOT_URLCONF)
+    reverse('get-ai-models')
+
+
+def load_ai_models():
+    """
+    Function to load the AI Model registry, the encoding of every AI Model and the tokens counts of its prompt format.
+    """
+    ai_model_registry.refresh()
+    for ai_model in ai_model_registry.get_serialized_data():
+        encoding = get_encoding(ai_model['model_id'])
+        get_system_instruction_tokens_count(encoding, ai_model['compatibility'])
+        for role in ('system', 'user', 'assistant'):
+            get_message_overhead(encoding, ai_model['compatibility'], role)
+
+
+WARM_UP_STEPS = (('urls', load_urls),
+                 ('ai_models', load_ai_models))
+
+
+def warm_up():
+    """
+    Function to get a worker process at full speed before its first request. It is called by the WSGI and ASGI
+    entry points, so that servers preloading the application warm it up once, before forking their workers.
+    A failed step is logged and left to the first request.
+    :return: Duration of each step in seconds
+    """
+    if not settings.CHATBOT_WARM_UP['ENABLED']:
+        return warm_up_report
+
+    for step, function in WARM_UP_STEPS:
+        started_at = time.perf_counter()
+        try:
+            function()
+        except Exception:
+            logger.exception('Warm-up step %s failed', step)
+        else:
+            warm_up_report[step] = time.perf_counter() - started_at
+
+    # The forked workers must not share the database connections opened by the warm-up.
+    connections.close_all()
+    return warm_up_report
+
+
+def measure_first_requests(paths):
+    """
+    Function to measure the latency of the first and second requests of some paths, and of the first and second
+    tokenization with the encoding of every AI Model.
+    :param paths: URL paths requested with GET
+    :return: First and second latencies in seconds, by path and encoding
+    """
+    from django.test import Client
+
+    client = Client()
+    latencies = dict()
+    for path in paths:
+        latencies[path] = list()
+        for _ in range(2):
+            started_at = time.perf_counter()
+            client.get(path)
+            latencies[path].append(time.perf_counter() - started_at)
+
+    for ai_model in ai_model_registry.get_serialized_data():
+        latencies[f"encoding:{ai_model['model_id']}"] = list()
+        for _ in range(2):
+            started_at = time.perf_counter()
+            count_tokens('Warm-up', get_encoding(ai_model['model_id']))
+            latencies[f"encoding:{ai_model['model_id']}"].append(time.perf_counter() - started_at)
+
+    return latencies
@@ -0,0 +1,114 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import openai
+from django.conf import settings
+from django.db import close_old_connections
+
+from .models import (AIModel,
+                     ChatSession)
+from .metrics import CHAT_SUMMARY_REFRESHES
+from .registry import ai_model_registry
+from .routing import (Upstream,
+                      endpoint_router)
+from .constants import (AI_CHAT_SUMMARY_INSTRUCTION,
+                        AIModel_ROUTING_POLICY_CHOICES)
+
+logger = logging.getLogger('django')
+
+
+class ChatSummarizer:
+    """
+    Rolling summaries of the chat sessions.
+    The conversations left out of a prompt context window are folded into the summary of their chat session
+    by background threads, so that prompts carry the summary and the latest conversations only. A refresh
+    only applies if the summary was not refreshed meanwhile, by this or another worker process.
+    Summaries are requested from the endpoints of the summary AI Model, or from the default upstream
+    if the model is not registered.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight = set()
+        self._executor = None
+        self.default_upstreams = [Upstream(key='chat_summary', name='default')]
+
+    @property
+    def config(self):
+        return settings.CHATBOT_CHAT_SUMMARY
+
+    def get_upstreams(self):
+        """
+        Method to get the upstreams of the summary AI Model along with its routing policy.
+        """
+        try:
+            ai_model_instance = ai_model_registry.get(self.config['MODEL'])
+        except AIModel.DoesNotExist:
+            return self.default_upstreams, AIModel_ROUTING_POLICY_CHOICES[0][0]
+        return ai_model_registry.get_upstreams(self.config['MODEL']), ai_model_instance.routing_policy
+
+    def schedule(self, chat_session_instance, history_messages, summarized_query_id):
+        """
+        Method to refresh the summary of a chat session in the background, unless a refresh is in flight.
+        :param chat_session_instance: Instance of the Chat Session, with the summary the prompt was built with
+        :param history_messages: Chat formatted messages of the conversations to fold, oldest first
+        :param summarized_query_id: ID of the latest Chat Query folded
+        :return: Future of the refresh, or None
+        """
+        with self._lock:
+            if chat_session_instance.id in self._in_flight:
+                return None
+            self._in_flight.add(chat_session_instance.id)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.config['CONCURRENCY'],
+                                                    thread_name_prefix='chat-summarizer')
+
+        return self._executor.submit(self.run, chat_session_instance.id, chat_session_instance.summary,
+                                     chat_session_instance.summarized_query_id, history_messages, summarized_query_id)
+
+    def run(self, chat_session_id, summary, previous_summarized_query_id, history_messages, summarized_query_id):
+        try:
+            return self.refresh(chat_session_id, summary, previous_summarized_query_id, history_messages,
+                                summarized_query_id)
+        except Exception:
+            CHAT_SUMMARY_REFRESHES.labels(result='failed').inc()
+            logger.exception('Summary of chat session %s could not be refreshed', chat_session_id)
+        finally:
+            with self._lock:
+                self._in_flight.discard(chat_session_id)
+            close_old_connections()
+
+    def refresh(self, chat_session_id, summary, previous_summarized_query_id, history_messages, summarized_query_id):
+        """
+        Method to fold conversations into the summary of a chat session.
+        :param chat_session_id: Chat Session ID
+        :param summary: Current summary
+        :param previous_summarized_query_id: ID of the latest Chat Query folded into the current summary
+        :param history_messages: Chat formatted messages of the conversations to fold, oldest first
+        :param summarized_query_id: ID of the latest Chat Query folded
+        :return: Whether the summary was updated
+        """
+        turns = '\n'.join(f"{message['role']}: {message['content']}" for message in history_messages)
+        upstreams, routing_policy = self.get_upstreams()
+        completion_response = endpoint_router.call(
+            upstreams,
+            routing_policy,
+            openai.ChatCompletion.create,
+            model=self.config['MODEL'],
+            messages=[{'role': 'system', 'content': AI_CHAT_SUMMARY_INSTRUCTION},
+                      {'role': 'user', 'content': f'Summary:\n{summary}\n\nNew turns:\n{turns}'}],
+            max_tokens=self.config['MAX_TOKENS'],
+            temperature=0
+        )
+
+        updated = ChatSession.objects.filter(id=chat_session_id,
+                                             summarized_query_id=previous_summarized_query_id).update(
+            summary=completion_response['choices'][0]['message']['content'].strip(),
+            summarized_query_id=summarized_query_id
+        )
+        CHAT_SUMMARY_REFRESHES.labels(result='updated' if updated else 'superseded').inc()
+        return bool(updated)
+
+
+chat_summarizer = ChatSummarizer()
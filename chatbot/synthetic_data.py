@@ -0,0 +1,190 @@
+import csv
+import json
+import time
+import asyncio
+import logging
+from itertools import product
+
+import openai
+import aiohttp
+import tiktoken
+
+from .resilience import (RetryPolicy,
+                         CircuitBreaker)
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at a per minute rate and holding at most one minute of budget.
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.tokens = per_minute
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self, amount):
+        """
+        Method to wait until the bucket holds the amount, then take it. Waiters are served in order.
+        """
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            self.refill()
+            while self.tokens < amount:
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+                self.refill()
+            self.tokens -= amount
+
+    def release(self, amount):
+        """
+        Method to give back the budget taken in excess, e.g. the unused part of max_tokens.
+        """
+        self.refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class SyntheticDataGenerator:
+    """
+    Generator of synthetic training data out of a prompt template and a grid of its parameters.
+    Completions are requested concurrently within requests and tokens per minute budgets, and each result
+    is appended to a JSONL file as it arrives. The file doubles as the checkpoint: a rerun only requests
+    the combinations it does not hold yet.
+    :param prompt_format: Prompt template formatted with the grid parameters
+    :param sub_prompt_format: Template of the short prompt used for fine-tuning
+    :param parameter_grid: Dictionary of the values of each parameter, e.g. {'age': [6, 18], 'gender': [...]}
+    :param samples_count: Completions of each combination of parameters
+    :param output_path: Path of the JSONL results
+    """
+
+    def __init__(self, prompt_format, sub_prompt_format, parameter_grid, samples_count, output_path,
+                 model='gpt-3.5-turbo', max_tokens=300, requests_per_minute=3500, tokens_per_minute=90000,
+                 concurrency=50):
+        self.prompt_format = prompt_format
+        self.sub_prompt_format = sub_prompt_format
+        self.parameter_grid = parameter_grid
+        self.samples_count = samples_count
+        self.output_path = output_path
+        self.model = model
+        self.max_tokens = max_tokens
+        self.concurrency = concurrency
+        self.requests_bucket = TokenBucket(requests_per_minute)
+        self.tokens_bucket = TokenBucket(tokens_per_minute)
+        self.retry_policy = RetryPolicy(circuit_breaker=CircuitBreaker('synthetic_training_data'), max_attempts=5)
+        self.encoding = tiktoken.encoding_for_model(model)
+        self._write_lock = asyncio.Lock()
+
+    @staticmethod
+    def get_key(parameters, sample):
+        return json.dumps({**parameters, 'sample': sample}, sort_keys=True)
+
+    def get_combinations(self):
+        """
+        Method to get every combination of the parameter grid, once per sample.
+        """
+        for values in product(*self.parameter_grid.values()):
+            parameters = dict(zip(self.parameter_grid, values))
+            for sample in range(self.samples_count):
+                yield parameters, sample
+
+    def read_completed_keys(self):
+        """
+        Method to get the keys of the combinations already written, ignoring a line cut short by a crash.
+        The cut line is ended so that the records appended next start on a line of their own.
+        """
+        completed_keys = set()
+        line = '\n'
+        try:
+            with open(self.output_path) as output_file:
+                for line in output_file:
+                    try:
+                        completed_keys.add(json.loads(line)['key'])
+                    except (ValueError, KeyError):
+                        continue
+        except FileNotFoundError:
+            return completed_keys
+
+        if not line.endswith('\n'):
+            with open(self.output_path, 'a') as output_file:
+                output_file.write('\n')
+        return completed_keys
+
+    async def write(self, record):
+        async with self._write_lock:
+            with open(self.output_path, 'a') as output_file:
+                output_file.write(json.dumps(record) + '\n')
+
+    async def generate(self, parameters, sample):
+        """
+        Method to request the completion of a combination within the budgets and append it to the results.
+        """
+        prompt = self.prompt_format.format(**parameters)
+        tokens_estimate = len(self.encoding.encode(prompt)) + self.max_tokens
+        await self.requests_bucket.acquire(1)
+        await self.tokens_bucket.acquire(tokens_estimate)
+
+        completion_response = await self.retry_policy.acall(openai.ChatCompletion.acreate,
+                                                            model=self.model,
+                                                            messages=[{'role': 'user', 'content': prompt}],
+                                                            max_tokens=self.max_tokens)
+        self.tokens_bucket.release(tokens_estimate - completion_response['usage']['total_tokens'])
+
+        await self.write({'key': self.get_key(parameters, sample),
+                          **parameters,
+                          'prompt': prompt,
+                          'sub_prompt': self.sub_prompt_format.format(**parameters),
+                          'response_text': completion_response['choices'][0]['message']['content'],
+                          'finish_reason': completion_response['choices'][0]['finish_reason']})
+
+    async def run(self):
+        """
+        Method to generate the combinations missing from the results.
+        :return: Counts of the completed, generated and failed combinations
+        """
+        completed_keys = self.read_completed_keys()
+        pending = [(parameters, sample) for parameters, sample in self.get_combinations()
+                   if self.get_key(parameters, sample) not in completed_keys]
+        logger.info('%s combinations already generated, %s to go', len(completed_keys), len(pending))
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def limited_generate(parameters, sample):
+            async with semaphore:
+                try:
+                    await self.generate(parameters, sample)
+                except openai.error.OpenAIError:
+                    # Left out of the results, so that the next run requests it again.
+                    logger.exception('Generation of %s failed', self.get_key(parameters, sample))
+                    return False
+                return True
+
+        async with aiohttp.ClientSession() as session:
+            openai.aiosession.set(session)
+            results = await asyncio.gather(*[limited_generate(parameters, sample) for parameters, sample in pending])
+
+        return {'completed': len(completed_keys), 'generated': sum(results), 'failed': results.count(False)}
+
+    def export_csv(self, csv_path):
+        """
+        Method to export the results to the CSV file read by the fine-tuning scripts, one line at a time.
+        """
+        field_names = [*self.parameter_grid, 'prompt', 'sub_prompt', 'response_text', 'finish_reason']
+        with open(self.output_path) as output_file, open(csv_path, 'w', newline='') as csv_file:
+            csv_writer = csv.writer(csv_file)
+            csv_writer.writerow(['', *field_names])
+            index = 0
+            for line in output_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                csv_writer.writerow([index, *[record[field_name] for field_name in field_names]])
+                index += 1
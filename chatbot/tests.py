@@ -1,3 +1,1151 @@
-from django.test import TestCase
+import io
+import os
+import csv
+import json
+import time
+import asyncio
+import tempfile
+from decimal import Decimal
+from unittest import (mock,
+                      skipUnless)
 
-# Create your tests here.
+import openai
+from prometheus_client import REGISTRY
+
+from asgiref.sync import async_to_sync
+from django.test import (TestCase,
+                         SimpleTestCase,
+                         RequestFactory,
+                         tag,
+                         override_settings)
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.conf import settings
+from django.urls import reverse
+from django.http import HttpResponse
+
+from utilities.cache import TieredCache
+from utilities.profiling import ProfilingMiddleware
+from utilities.exception import CustomAPIException
+from utilities.utilities import (iterate_async,
+                                 CustomResponseRenderer,
+                                 CustomCursorPagination)
+
+from .models import (AIModel,
+                     AIModelEndpoint,
+                     ChatQuery,
+                     ChatSession,
+                     ChatResponse)
+from .open_ai import (moderation,
+                      stream_completion,
+                      get_chat_history_queryset,
+                      completion_cache,
+                      moderation_batch,
+                      moderation_cache,
+                      get_moderation_cache_key)
+from .registry import ai_model_registry
+from .admin import AIModelEndpointForm
+from .persistence import conversation_writer
+from .single_flight import SingleFlight
+from .summaries import chat_summarizer
+from .startup import warm_up
+from .admission import admission_controller
+from .routing import (Upstream,
+                      EndpointRouter)
+from .transport import upstream_transport
+from .synthetic_data import SyntheticDataGenerator
+from .benchmarks.fake_openai import FakeOpenAIServer
+from .resilience import (RetryPolicy,
+                         CircuitBreaker,
+                         CircuitOpenError)
+from .tokens import get_encoding
+from .constants import (CHAT_HISTORY_LIMIT,
+                        AI_MODEL_REGISTRY_VERSION_KEY)
+
+
+# Write-behind persistence of the tests, spooling outside of the project
+TEST_WRITE_BEHIND = {'MAX_BATCH_SIZE': 100, 'FLUSH_INTERVAL': None,
+                     'SPOOL_DIR': os.path.join(tempfile.gettempdir(), 'chatbot_test_spool')}
+
+
+class WriteBehindTestMixin:
+    """
+    Test case mixin flushing the conversations queued by a test before its database changes are rolled back,
+    instead of leaving them to the flush at exit.
+    """
+
+    def tearDown(self):
+        conversation_writer.flush()
+        super().tearDown()
+
+
+class FakeEncoding:
+    """
+    Whitespace tokenizer standing in for tiktoken encodings, which are downloaded on first use.
+    """
+    name = 'fake_base'
+
+    def encode(self, text, **kwargs):
+        return text.split()
+
+    def encode_batch(self, texts, **kwargs):
+        return [self.encode(text) for text in texts]
+
+
+async def fake_chat_completion_stream(**kwargs):
+    async def stream():
+        for content in ('Hello', ' there'):
+            yield {'choices': [{'delta': {'content': content}}]}
+    return stream()
+
+
+def read_streaming_content(response):
+    if response.is_async:
+        async def read_async_content():
+            return b''.join([chunk async for chunk in response.streaming_content])
+        return async_to_sync(read_async_content)().decode()
+    return b''.join(response.streaming_content).decode()
+
+
+@override_settings(CHATBOT_WRITE_BEHIND=TEST_WRITE_BEHIND)
+class QueryCountTestCase(WriteBehindTestMixin, TestCase):
+    """
+    Test cases asserting the number of database queries made by each endpoint.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        encoding_patcher = mock.patch('tiktoken.encoding_for_model', new=lambda model_id: FakeEncoding())
+        encoding_patcher.start()
+        cls.addClassCleanup(encoding_patcher.stop)
+        cls.addClassCleanup(get_encoding.cache_clear)
+        get_encoding.cache_clear()
+        super().setUpClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.ai_model = AIModel.objects.create(model_id='gpt-3.5-turbo', max_tokens=4096,
+                                              compatibility='CHAT_COMPLETION')
+        cls.chat_session = ChatSession.objects.create(title='Query count')
+        for index in range(10):
+            chat_query = ChatQuery.objects.create(content=f'Query {index}', chat_session=cls.chat_session,
+                                                  tokens_count={FakeEncoding.name: 2})
+            for regeneration in range(3):
+                ChatResponse.objects.create(content=f'Response {index}.{regeneration}', chat_query=chat_query,
+                                            tokens_count={FakeEncoding.name: 2})
+
+    def setUp(self):
+        ai_model_registry.invalidate()
+        ai_model_registry.refresh()
+
+    def test_get_ai_models(self):
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('get-ai-models'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_registry_is_invalidated_on_commit(self):
+        version = cache.get(AI_MODEL_REGISTRY_VERSION_KEY)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ai_model.save()
+            self.assertEqual(cache.get(AI_MODEL_REGISTRY_VERSION_KEY), version)
+        self.assertNotEqual(cache.get(AI_MODEL_REGISTRY_VERSION_KEY), version)
+
+    def test_get_chat_sessions(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('get-chat-sessions'))
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(RESPONSE_RENDERER={'STREAM_LISTS': True, 'STREAM_CHUNK_SIZE': 2})
+    def test_get_chat_sessions_streamed(self):
+        ChatSession.objects.bulk_create([ChatSession(title=f'Streamed {index}') for index in range(24)])
+        streamed_pages = list()
+        url = reverse('get-chat-sessions')
+        while url:
+            response = self.client.get(url)
+            streamed_pages.append(json.loads(b''.join(response.streaming_content))['data'])
+            url = streamed_pages[-1]['links']['next']
+
+        with override_settings(RESPONSE_RENDERER={'STREAM_LISTS': False, 'STREAM_CHUNK_SIZE': 2}):
+            paginated = self.client.get(reverse('get-chat-sessions')).json()
+        self.assertEqual(streamed_pages[0], paginated['data'])
+        self.assertEqual([len(page['chat_sessions']) for page in streamed_pages], [20, 5])
+
+    def test_get_chat_sessions_pages(self):
+        ChatSession.objects.bulk_create([ChatSession(title=f'Paginated {index}') for index in range(44)])
+        expected_ids = list(ChatSession.objects.order_by('-updated_at', '-id').values_list('id', flat=True))
+
+        pages = list()
+        url = reverse('get-chat-sessions')
+        while url:
+            with self.assertNumQueries(1):
+                data = self.client.get(url).json()['data']
+            pages.append([chat_session['id'] for chat_session in data['chat_sessions']])
+            url = data['links']['next']
+
+        self.assertEqual([len(page) for page in pages], [20, 20, 5])
+        self.assertEqual(sum(pages, []), expected_ids)
+        self.assertNotIn('queries_count', self.client.get(reverse('get-chat-sessions')).json()['data']['chat_sessions'][0])
+
+        previous_page = self.client.get(data['links']['previous']).json()['data']
+        self.assertEqual([chat_session['id'] for chat_session in previous_page['chat_sessions']], pages[1])
+
+    def test_get_conversations(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('get-conversations', args=[self.chat_session.id]))
+        self.assertEqual(response.status_code, 200)
+
+        results = response.json()['data']['results']
+        self.assertEqual(len(results), 10)
+        self.assertEqual(results[0]['latest_response']['content'], 'Response 9.2')
+        self.assertEqual(results[0]['responses_count'], 3)
+        self.assertNotIn('chat_responses', results[0])
+
+    def test_get_conversations_expanded(self):
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('get-conversations', args=[self.chat_session.id]),
+                                       {'expand': 'chat_responses'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['data']['results'][0]['chat_responses']), 3)
+
+    @mock.patch('openai.ChatCompletion.acreate', new=fake_chat_completion_stream)
+    def test_create_conversation(self):
+        with self.assertNumQueries(4):
+            response = self.client.post(reverse('create-conversation', args=[self.chat_session.id]),
+                                        {'model_id': self.ai_model.model_id, 'query_content': 'Query 10'},
+                                        content_type='application/json')
+            self.assertEqual(read_streaming_content(response), 'Hello there')
+
+        self.assertTrue(conversation_writer.has_pending(self.chat_session.id))
+        with self.assertNumQueries(6):
+            conversation_writer.flush()
+        self.assertFalse(conversation_writer.has_pending(self.chat_session.id))
+
+        chat_query = ChatQuery.objects.select_related('latest_response').latest('id')
+        self.assertEqual(chat_query.latest_response.content, 'Hello there')
+        self.assertEqual(chat_query.responses_count, 1)
+
+        chat_session = self.client.get(reverse('get-chat-sessions'),
+                                        {'expand': 'queries_count,last_activity_at,last_model'}
+                                        ).json()['data']['chat_sessions'][0]
+        self.assertEqual(chat_session['id'], self.chat_session.id)
+        self.assertEqual(chat_session['queries_count'], 1)
+        self.assertEqual(chat_session['last_model'], self.ai_model.model_id)
+        self.assertIsNotNone(chat_session['last_activity_at'])
+
+    @mock.patch('openai.ChatCompletion.acreate', new=fake_chat_completion_stream)
+    def test_metrics(self):
+        labels = {'model': self.ai_model.model_id, 'endpoint': 'create-conversation', 'source': 'upstream'}
+        tokens_before = REGISTRY.get_sample_value('chatbot_completion_tokens_total', labels) or 0
+        queries_before = REGISTRY.get_sample_value('db_query_duration_seconds_count',
+                                                   {'endpoint': 'create-conversation'}) or 0
+
+        response = self.client.post(reverse('create-conversation', args=[self.chat_session.id]),
+                                    {'model_id': self.ai_model.model_id, 'query_content': 'Query 10'},
+                                    content_type='application/json')
+        read_streaming_content(response)
+
+        self.assertEqual(REGISTRY.get_sample_value('chatbot_completion_tokens_total', labels) - tokens_before, 2)
+        self.assertEqual(REGISTRY.get_sample_value('db_query_duration_seconds_count',
+                                                   {'endpoint': 'create-conversation'}) - queries_before, 4)
+
+        metrics = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('chatbot_upstream_time_to_first_chunk_seconds_bucket', metrics)
+        self.assertIn('chatbot_prompt_assembly_seconds_count{model="gpt-3.5-turbo"}', metrics)
+
+    @mock.patch('openai.ChatCompletion.acreate', new=fake_chat_completion_stream)
+    def test_profiled_streaming_request(self):
+        with tempfile.TemporaryDirectory() as output_dir, override_settings(REQUEST_PROFILING={
+                'HEADER': 'X-Profile-Request', 'HEADER_TOKEN': 'secret', 'SAMPLE_RATE': 0,
+                'INTERVAL': 0.001, 'OUTPUT_DIR': output_dir}):
+            for header_token in ('wrong', 'secret'):
+                response = self.client.post(reverse('create-conversation', args=[self.chat_session.id]),
+                                            {'model_id': self.ai_model.model_id, 'query_content': 'Query 10'},
+                                            content_type='application/json', headers={'X-Profile-Request': header_token})
+                self.assertEqual(read_streaming_content(response), 'Hello there')
+
+            file_names = sorted(os.listdir(output_dir))
+            self.assertEqual([os.path.splitext(file_name)[1] for file_name in file_names], ['.collapsed', '.json'])
+            with open(os.path.join(output_dir, file_names[1])) as metadata_file:
+                metadata = json.load(metadata_file)
+
+        self.assertEqual((metadata['endpoint'], metadata['trigger'], metadata['streaming']),
+                         ('create-conversation', 'header', True))
+        self.assertEqual(metadata['concurrent_requests'], 0)
+
+    def test_single_request_profiled_at_a_time(self):
+        with tempfile.TemporaryDirectory() as output_dir, override_settings(REQUEST_PROFILING={
+                'HEADER': 'X-Profile-Request', 'HEADER_TOKEN': '', 'SAMPLE_RATE': 1,
+                'INTERVAL': 0.001, 'OUTPUT_DIR': output_dir}):
+            profiling_middleware = ProfilingMiddleware(lambda request: HttpResponse())
+            requests = [RequestFactory().get(reverse('get-chat-sessions')) for _ in range(3)]
+
+            profiles = [profiling_middleware.enter(request) for request in requests]
+            for profile in reversed(profiles):
+                profiling_middleware.leave(profile, HttpResponse())
+
+            self.assertEqual([profile is not None for profile in profiles], [True, False, False])
+            with open(os.path.join(output_dir, next(file_name for file_name in os.listdir(output_dir)
+                                                    if file_name.endswith('.json')))) as metadata_file:
+                self.assertEqual(json.load(metadata_file)['concurrent_requests'], 2)
+            profile = profiling_middleware.enter(requests[0])
+            profiling_middleware.leave(profile, HttpResponse())
+            self.assertIsNotNone(profile)
+
+    @mock.patch('openai.Moderation.create', new=lambda **kwargs: {'results': [{'flagged': False}]})
+    def test_content_moderation(self):
+        with self.assertNumQueries(0):
+            response = self.client.post(reverse('content-moderation'), {'content': 'Hello there'},
+                                        content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+
+class ConversationWriterTestCase(TestCase):
+    """
+    Test cases for the write-behind persistence of conversations.
+    """
+
+    def test_failing_conversation_is_moved_to_the_dead_letters(self):
+        spool_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(spool_dir.cleanup)
+        chat_session = ChatSession.objects.create(title='Dead letters')
+
+        with override_settings(CHATBOT_WRITE_BEHIND={**TEST_WRITE_BEHIND, 'SPOOL_DIR': spool_dir.name}):
+            conversation_writer.enqueue(chat_session.id, {'content': 'Broken', 'unknown_field': None}, None)
+            conversation_writer.enqueue(chat_session.id, {'content': 'Query', 'tokens_count': {}}, None)
+            conversation_writer.flush()
+
+            chat_queries = ChatQuery.objects.filter(chat_session=chat_session)
+            self.assertEqual(list(chat_queries.values_list('content', flat=True)), ['Query'])
+            self.assertEqual(conversation_writer.read_spool(), [])
+            self.assertEqual([entry['chat_query']['content']
+                              for entry in conversation_writer.read_spool(conversation_writer.dead_letter_path)],
+                             ['Broken'])
+            self.assertFalse(conversation_writer.has_pending(chat_session.id))
+
+    def test_spooled_conversations_stay_pending(self):
+        spool_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(spool_dir.cleanup)
+        chat_session = ChatSession.objects.create(title='Spooled')
+
+        with override_settings(CHATBOT_WRITE_BEHIND={**TEST_WRITE_BEHIND, 'SPOOL_DIR': spool_dir.name}):
+            conversation_writer.enqueue(chat_session.id, {'content': 'Query', 'tokens_count': {}}, None)
+            with mock.patch.object(conversation_writer, 'write', side_effect=Exception('Database unavailable')):
+                conversation_writer.flush()
+            self.assertEqual(len(conversation_writer.read_spool()), 1)
+            self.assertTrue(conversation_writer.has_pending(chat_session.id))
+
+            conversation_writer.flush()
+            self.assertEqual(ChatQuery.objects.filter(chat_session=chat_session).count(), 1)
+            self.assertFalse(conversation_writer.has_pending(chat_session.id))
+
+
+class ModerationCacheTestCase(TestCase):
+    """
+    Test cases for the moderation results cache.
+    """
+
+    def setUp(self):
+        moderation_cache.clear_local()
+        moderation_cache.stats = dict.fromkeys(moderation_cache.stats, 0)
+        cache.clear()
+
+    def test_resubmitted_content_is_served_from_cache(self):
+        with mock.patch('openai.Moderation.create',
+                        return_value={'results': [{'flagged': False}]}) as moderation_create:
+            first_result = moderation('Hello   there')
+            second_result = moderation(' Hello there ')
+
+        moderation_create.assert_called_once()
+        self.assertEqual(first_result, second_result)
+        self.assertEqual(moderation_cache.stats['local_hits'], 1)
+
+        moderation_cache.clear_local()
+        self.assertEqual(moderation('Hello there'), first_result)
+        self.assertEqual(moderation_cache.stats['shared_hits'], 1)
+
+    def test_shared_hits_do_not_outlive_the_shared_entry(self):
+        tiered_cache = TieredCache(prefix='chatbot:test', max_entries=10, timeout=3600, refill_timeout=0)
+        cache.set('chatbot:test:key', 'value', timeout=3600)
+        self.assertEqual(tiered_cache.get('key'), 'value')
+
+        cache.delete('chatbot:test:key')
+        self.assertIsNone(tiered_cache.get('key'))
+
+    def test_async_lookups(self):
+        tiered_cache = TieredCache(prefix='chatbot:test', max_entries=10, timeout=3600)
+        async_to_sync(tiered_cache.aset)('key', 'value')
+        tiered_cache.clear_local()
+
+        self.assertEqual(async_to_sync(tiered_cache.aget)('key'), 'value')
+        self.assertEqual(async_to_sync(tiered_cache.aget)('key'), 'value')
+        self.assertEqual(async_to_sync(tiered_cache.aget)('missing', 'default'), 'default')
+        self.assertEqual(tiered_cache.stats, {'local_hits': 1, 'shared_hits': 1, 'misses': 1})
+
+    def test_batch_is_deduplicated_packed_and_ordered(self):
+        moderation_cache.set(get_moderation_cache_key('cached'), {'results': [{'flagged': True}]})
+
+        def moderation_create(input, **kwargs):
+            return {'model': kwargs['model'], 'results': [{'flagged': False, 'input': content} for content in input]}
+
+        contents = ['cached'] + [f'content {index % 40}' for index in range(80)]
+        with mock.patch('openai.Moderation.create', side_effect=moderation_create) as mocked_moderation_create:
+            response = self.client.post(reverse('content-moderation-batch'), {'contents': contents},
+                                        content_type='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(mocked_moderation_create.call_count, 2)
+        results = response.json()['data']
+        self.assertEqual(len(results), len(contents))
+        self.assertTrue(results[0]['data']['results'][0]['flagged'])
+        for content, result in zip(contents[1:], results[1:]):
+            self.assertEqual(result['data']['results'][0]['input'], content)
+
+    def test_batch_reports_per_item_errors(self):
+        with mock.patch('openai.Moderation.create',
+                        side_effect=openai.error.InvalidRequestError('Invalid input', param=None)):
+            results = moderation_batch(['first', 'second'])
+
+        self.assertEqual([result['error'] for result in results], ['InvalidRequestError'] * 2)
+
+
+class ResilienceTestCase(TestCase):
+    """
+    Test cases for the retry policy and circuit breaker of Open AI requests.
+    """
+
+    def setUp(self):
+        cache.clear()
+
+    def test_retry_after_header_is_honored(self):
+        exception = openai.error.RateLimitError('Rate limited', headers={'Retry-After': '2'})
+        self.assertEqual(RetryPolicy(max_delay=8).get_delay(1, exception), 2)
+        self.assertLessEqual(RetryPolicy(max_delay=8).get_delay(3, openai.error.Timeout('Timed out')), 4)
+
+    @mock.patch('chatbot.resilience.time.sleep')
+    def test_circuit_opens_after_repeated_failures(self, mocked_sleep):
+        retry_policy = RetryPolicy(circuit_breaker=CircuitBreaker('test', failure_threshold=3), max_attempts=3)
+        failing_call = mock.Mock(side_effect=openai.error.ServiceUnavailableError('Unavailable'))
+
+        with self.assertRaises(openai.error.ServiceUnavailableError):
+            retry_policy.call(failing_call)
+        self.assertEqual(failing_call.call_count, 3)
+
+        with self.assertRaises(CircuitOpenError):
+            retry_policy.call(failing_call)
+        self.assertEqual(failing_call.call_count, 3)
+        self.assertEqual(mocked_sleep.call_count, 2)
+
+    def test_non_retryable_errors_are_raised_immediately(self):
+        retry_policy = RetryPolicy(circuit_breaker=CircuitBreaker('test'))
+        failing_call = mock.Mock(side_effect=openai.error.InvalidRequestError('Invalid', param=None))
+
+        with self.assertRaises(openai.error.InvalidRequestError):
+            retry_policy.call(failing_call)
+        self.assertEqual(failing_call.call_count, 1)
+
+
+@override_settings(CHATBOT_WRITE_BEHIND=TEST_WRITE_BEHIND)
+class CompletionCacheTestCase(WriteBehindTestMixin, TestCase):
+    """
+    Test cases for the completion responses cache.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        encoding_patcher = mock.patch('tiktoken.encoding_for_model', new=lambda model_id: FakeEncoding())
+        encoding_patcher.start()
+        cls.addClassCleanup(encoding_patcher.stop)
+        cls.addClassCleanup(get_encoding.cache_clear)
+        get_encoding.cache_clear()
+        super().setUpClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.ai_model = AIModel.objects.create(model_id='gpt-3.5-turbo', max_tokens=4096,
+                                              compatibility='CHAT_COMPLETION', response_cache_enabled=True)
+
+    def setUp(self):
+        cache.clear()
+        completion_cache.clear_local()
+        ai_model_registry.invalidate()
+
+    def create_conversation(self, title):
+        chat_session = ChatSession.objects.create(title=title)
+        response = self.client.post(reverse('create-conversation', args=[chat_session.id]),
+                                    {'model_id': self.ai_model.model_id, 'query_content': 'Canned question'},
+                                    content_type='application/json')
+        content = read_streaming_content(response)
+        conversation_writer.flush()
+        return chat_session, content
+
+    def test_identical_prompt_is_replayed_from_cache(self):
+        chat_completion_create = mock.Mock(wraps=fake_chat_completion_stream)
+        with mock.patch('openai.ChatCompletion.acreate', new=chat_completion_create):
+            _, first_content = self.create_conversation('First')
+            chat_session, second_content = self.create_conversation('Second')
+
+        chat_completion_create.assert_called_once()
+        self.assertEqual(first_content, second_content)
+        self.assertEqual(ChatQuery.objects.get(chat_session=chat_session).latest_response.content, second_content)
+
+
+@override_settings(CHATBOT_WRITE_BEHIND=TEST_WRITE_BEHIND)
+class ChatSummaryTestCase(WriteBehindTestMixin, TestCase):
+    """
+    Test cases for the rolling summaries of the chat sessions.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        encoding_patcher = mock.patch('tiktoken.encoding_for_model', new=lambda model_id: FakeEncoding())
+        encoding_patcher.start()
+        cls.addClassCleanup(encoding_patcher.stop)
+        cls.addClassCleanup(get_encoding.cache_clear)
+        get_encoding.cache_clear()
+        super().setUpClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        # Room for the latest 3 conversations of 8 tokens each in the prompt.
+        cls.ai_model = AIModel.objects.create(model_id='gpt-3.5-turbo', max_tokens=60,
+                                              compatibility='CHAT_COMPLETION')
+        cls.chat_session = ChatSession.objects.create(title='Summary')
+        cls.chat_queries = list()
+        for index in range(10):
+            chat_query = ChatQuery.objects.create(content=f'Query {index}', chat_session=cls.chat_session,
+                                                  tokens_count={FakeEncoding.name: 2})
+            ChatResponse.objects.create(content=f'Response {index}', chat_query=chat_query,
+                                        tokens_count={FakeEncoding.name: 2})
+            cls.chat_queries.append(chat_query)
+
+    def setUp(self):
+        ai_model_registry.invalidate()
+
+    def create_conversation(self):
+        with mock.patch('openai.ChatCompletion.acreate', side_effect=fake_chat_completion_stream) as acreate, \
+                mock.patch.object(chat_summarizer, 'schedule') as schedule:
+            response = self.client.post(reverse('create-conversation', args=[self.chat_session.id]),
+                                        {'model_id': self.ai_model.model_id, 'query_content': 'Query 10'},
+                                        content_type='application/json')
+            read_streaming_content(response)
+        conversation_writer.flush()
+        return acreate.call_args.kwargs['messages'], schedule
+
+    def test_left_out_conversations_over_the_input_budget_are_folded_oldest_first(self):
+        # The later ones are folded by the next refreshes.
+        with override_settings(CHATBOT_CHAT_SUMMARY={**settings.CHATBOT_CHAT_SUMMARY, 'MAX_INPUT_TOKENS': 24}):
+            _, schedule = self.create_conversation()
+        _, history_messages, summarized_query_id = schedule.call_args.args
+        self.assertEqual([message['content'] for message in history_messages[::2]], ['Query 0', 'Query 1', 'Query 2'])
+        self.assertEqual(summarized_query_id, self.chat_queries[2].id)
+
+    def test_left_out_conversations_are_folded_into_the_summary(self):
+        messages, schedule = self.create_conversation()
+        self.assertEqual([message['content'] for message in messages[1:-1:2]], ['Query 7', 'Query 8', 'Query 9'])
+
+        chat_session, history_messages, summarized_query_id = schedule.call_args.args
+        self.assertEqual(len(history_messages), 14)
+        self.assertEqual(history_messages[0], {'role': 'user', 'content': 'Query 0'})
+        self.assertEqual(summarized_query_id, self.chat_queries[6].id)
+
+        summary_response = {'choices': [{'message': {'content': 'The user asked queries 0 to 6.'}}]}
+        with mock.patch('openai.ChatCompletion.create', return_value=summary_response) as create:
+            self.assertTrue(chat_summarizer.refresh(chat_session.id, chat_session.summary, None,
+                                                    history_messages, summarized_query_id))
+            # A refresh built on a summary that changed meanwhile is dropped.
+            self.assertFalse(chat_summarizer.refresh(chat_session.id, chat_session.summary, None,
+                                                     history_messages, summarized_query_id))
+        self.assertIn('assistant: Response 6', create.call_args.kwargs['messages'][1]['content'])
+
+        messages, schedule = self.create_conversation()
+        self.assertEqual(messages[1], {'role': 'system',
+                                       'content': 'Summary of the earlier conversation: The user asked queries 0 to 6.'})
+        # The summary takes the room of 2 conversations, the left out ones are too few for a refresh.
+        self.assertEqual([message['content'] for message in messages[2:]], ['Query 10', 'Hello there', 'Query 10'])
+        schedule.assert_not_called()
+
+
+class StartupTestCase(TestCase):
+    """
+    Test cases for the worker warm-up.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        AIModel.objects.create(model_id='gpt-3.5-turbo', max_tokens=4096, compatibility='CHAT_COMPLETION')
+
+    @mock.patch('chatbot.startup.connections')
+    @mock.patch('tiktoken.encoding_for_model', new=lambda model_id: FakeEncoding())
+    def test_warm_up_loads_the_encodings(self, connections):
+        self.addCleanup(get_encoding.cache_clear)
+        get_encoding.cache_clear()
+        ai_model_registry.invalidate()
+
+        report = warm_up()
+        self.assertEqual(set(report), {'urls', 'ai_models'})
+        self.assertEqual(get_encoding.cache_info().currsize, 1)
+        connections.close_all.assert_called_once()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(reverse('get-ai-models')).status_code, 200)
+
+
+@override_settings(CHATBOT_ADMISSION={'MAX_WAIT': 0.1, 'MAX_QUEUE': 10, 'POLL_INTERVAL': 0.01},
+                   CHATBOT_WRITE_BEHIND=TEST_WRITE_BEHIND)
+class AdmissionTestCase(WriteBehindTestMixin, TestCase):
+    """
+    Test cases for the admission control of the completion streams.
+    """
+
+    def setUp(self):
+        cache.clear()
+
+    def test_concurrent_streams_budget(self):
+        ai_model = AIModel(model_id='gpt-4', max_tokens=8192, max_concurrent_streams=1)
+        release = async_to_sync(admission_controller.admit)(ai_model, 100)
+
+        with self.assertRaises(CustomAPIException) as context:
+            async_to_sync(admission_controller.admit)(ai_model, 100)
+        self.assertEqual((context.exception.status_code, context.exception.wait), (429, 1))
+
+        async_to_sync(release)()
+        self.assertIsNotNone(async_to_sync(admission_controller.admit)(ai_model, 100))
+
+    def test_expired_stream_lease_does_not_release_another_stream(self):
+        ai_model = AIModel(model_id='gpt-4', max_tokens=8192, max_concurrent_streams=1)
+        expired_release = async_to_sync(admission_controller.admit)(ai_model, 100)
+        cache.delete_many(admission_controller.get_stream_keys(ai_model))
+
+        async_to_sync(admission_controller.admit)(ai_model, 100)
+        async_to_sync(expired_release)()
+        with self.assertRaises(CustomAPIException):
+            async_to_sync(admission_controller.admit)(ai_model, 100)
+
+    def test_tokens_per_minute_budget(self):
+        ai_model = AIModel(model_id='gpt-4', max_tokens=8192, tokens_per_minute=100)
+        with mock.patch('time.time', return_value=60 * 1000 + 15):
+            # A request larger than the budget is let through alone in its minute.
+            self.assertIsNone(async_to_sync(admission_controller.admit)(ai_model, 150))
+            with self.assertRaises(CustomAPIException) as context:
+                async_to_sync(admission_controller.admit)(ai_model, 10)
+        self.assertEqual(context.exception.wait, 45)
+
+        with mock.patch('time.time', return_value=60 * 1001 + 15):
+            async_to_sync(admission_controller.admit)(ai_model, 60)
+            with self.assertRaises(CustomAPIException):
+                async_to_sync(admission_controller.admit)(ai_model, 60)
+
+    @mock.patch('tiktoken.encoding_for_model', new=lambda model_id: FakeEncoding())
+    @mock.patch('openai.ChatCompletion.acreate', new=fake_chat_completion_stream)
+    def test_create_conversation_over_budget(self):
+        self.addCleanup(get_encoding.cache_clear)
+        get_encoding.cache_clear()
+        ai_model = AIModel.objects.create(model_id='gpt-3.5-turbo', max_tokens=4096,
+                                          compatibility='CHAT_COMPLETION', max_concurrent_streams=1)
+        chat_session = ChatSession.objects.create(title='Admission')
+        ai_model_registry.invalidate()
+
+        def create_conversation():
+            return self.client.post(reverse('create-conversation', args=[chat_session.id]),
+                                    {'model_id': ai_model.model_id, 'query_content': 'Query'},
+                                    content_type='application/json')
+
+        streaming_response = create_conversation()
+        rejected_response = create_conversation()
+        self.assertEqual(rejected_response.status_code, 429)
+        self.assertEqual(rejected_response['Retry-After'], '1')
+        self.assertEqual(rejected_response.json()['error'], ['admission_rejected'])
+
+        # The stream is released once it is over.
+        self.assertEqual(read_streaming_content(streaming_response), 'Hello there')
+        streaming_response = create_conversation()
+        self.assertEqual(streaming_response.status_code, 200)
+
+        # A stream closed before its first chunk is released as well.
+        streaming_response.close()
+        self.assertEqual(create_conversation().status_code, 200)
+
+
+@override_settings(CHATBOT_WRITE_BEHIND=TEST_WRITE_BEHIND)
+class EndpointRoutingTestCase(WriteBehindTestMixin, TestCase):
+    """
+    Test cases for the routing of the Open AI requests across the endpoints of an AI Model.
+    """
+
+    def setUp(self):
+        cache.clear()
+
+    def test_upstream_selection(self):
+        endpoint_router = EndpointRouter()
+        fast, slow = Upstream(key='test:fast', name='fast'), Upstream(key='test:slow', name='slow', weight=3)
+        endpoint_router.release(endpoint_router.select([fast], 'EWMA_LATENCY'), latency=0.1)
+        endpoint_router.release(endpoint_router.select([slow], 'EWMA_LATENCY'), latency=1)
+
+        # Weighted least outstanding requests: the slow upstream serves three requests for one.
+        selected = [endpoint_router.select([fast, slow], 'LEAST_OUTSTANDING') for _ in range(4)]
+        self.assertEqual(sorted(upstream.name for upstream in selected), ['fast', 'slow', 'slow', 'slow'])
+        for upstream in selected:
+            endpoint_router.release(upstream)
+
+        self.assertEqual(endpoint_router.select([fast, slow], 'EWMA_LATENCY').name, 'fast')
+        self.assertEqual(endpoint_router.select([fast, slow], 'EWMA_LATENCY', exclude={fast.key}).name, 'slow')
+        self.assertEqual(endpoint_router.select([fast], 'EWMA_LATENCY', exclude={fast.key}).name, 'fast')
+
+        # Rate limited upstreams are avoided while another one is left, those with an open circuit always are.
+        cache.set(fast.throttled_until_key, time.time() + 30)
+        self.assertEqual(endpoint_router.select([fast, slow], 'EWMA_LATENCY').name, 'slow')
+        cache.set(fast.circuit_breaker.opened_until_key, time.time() + 30)
+        with self.assertRaises(CircuitOpenError):
+            endpoint_router.select([fast], 'EWMA_LATENCY')
+
+    @mock.patch('tiktoken.encoding_for_model', new=lambda model_id: FakeEncoding())
+    @mock.patch('asyncio.sleep')
+    def test_completion_fails_over_to_another_endpoint(self, mocked_sleep):
+        self.addCleanup(get_encoding.cache_clear)
+        get_encoding.cache_clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            ai_model = AIModel.objects.create(model_id='gpt-3.5-turbo', max_tokens=4096,
+                                              compatibility='CHAT_COMPLETION')
+            AIModelEndpoint.objects.create(ai_model=ai_model, name='throttled', api_key='throttled-key', weight=10)
+            AIModelEndpoint.objects.create(ai_model=ai_model, name='spare', api_key='spare-key')
+        chat_session = ChatSession.objects.create(title='Failover')
+        api_keys = list()
+
+        async def chat_completion_stream(**kwargs):
+            api_keys.append(kwargs['api_key'])
+            if kwargs['api_key'] == 'throttled-key':
+                raise openai.error.RateLimitError('Rate limited', headers={'Retry-After': '20'})
+            return await fake_chat_completion_stream(**kwargs)
+
+        with mock.patch('openai.ChatCompletion.acreate', new=chat_completion_stream):
+            for _ in range(2):
+                response = self.client.post(reverse('create-conversation', args=[chat_session.id]),
+                                            {'model_id': ai_model.model_id, 'query_content': 'Query'},
+                                            content_type='application/json')
+                self.assertEqual(read_streaming_content(response), 'Hello there')
+
+        # The throttled endpoint is avoided by the next request, and failing over is not delayed.
+        self.assertEqual(api_keys, ['throttled-key', 'spare-key', 'spare-key'])
+        mocked_sleep.assert_not_called()
+
+    @mock.patch('tiktoken.encoding_for_model', new=lambda model_id: FakeEncoding())
+    def test_moderation_is_served_by_the_moderation_endpoints(self):
+        self.addCleanup(get_encoding.cache_clear)
+        get_encoding.cache_clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            ai_model = AIModel.objects.create(model_id='gpt-4', max_tokens=8192, compatibility='CHAT_COMPLETION')
+            AIModelEndpoint.objects.create(ai_model=ai_model, name='primary', api_key='moderation-key',
+                                           serves_moderation=True)
+            AIModelEndpoint.objects.create(ai_model=ai_model, name='secondary', api_key='completion-key')
+
+        with mock.patch('openai.Moderation.create',
+                        return_value={'results': [{'flagged': False}]}) as moderation_create:
+            moderation('Hello there')
+        self.assertEqual(moderation_create.call_args.kwargs['api_key'], 'moderation-key')
+
+    @mock.patch('tiktoken.encoding_for_model', new=lambda model_id: FakeEncoding())
+    def test_summaries_are_served_by_the_summary_model_endpoints(self):
+        self.addCleanup(get_encoding.cache_clear)
+        get_encoding.cache_clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            ai_model = AIModel.objects.create(model_id='gpt-3.5-turbo', max_tokens=4096,
+                                              compatibility='CHAT_COMPLETION')
+            AIModelEndpoint.objects.create(ai_model=ai_model, name='primary', api_key='summary-key')
+        chat_session = ChatSession.objects.create(title='Summary')
+
+        summary_response = {'choices': [{'message': {'content': 'Summary'}}]}
+        with mock.patch('openai.ChatCompletion.create', return_value=summary_response) as create:
+            chat_summarizer.refresh(chat_session.id, chat_session.summary, None,
+                                    [{'role': 'user', 'content': 'Query 0'}], None)
+        self.assertEqual(create.call_args.kwargs['api_key'], 'summary-key')
+
+    def test_admin_keeps_the_api_key_off_the_page(self):
+        ai_model = AIModel.objects.create(model_id='gpt-4', max_tokens=8192, compatibility='CHAT_COMPLETION')
+        ai_model_endpoint = AIModelEndpoint.objects.create(ai_model=ai_model, name='primary', api_key='secret-key')
+        data = {'ai_model': ai_model.id, 'name': 'primary', 'api_key': '', 'organization': '', 'api_base': '',
+                'weight': 2, 'is_active': True, 'serves_moderation': False}
+
+        form = AIModelEndpointForm(data, instance=ai_model_endpoint)
+        self.assertNotIn('secret-key', str(form['api_key']))
+        form.save()
+        ai_model_endpoint.refresh_from_db()
+        self.assertEqual((ai_model_endpoint.api_key, ai_model_endpoint.weight), ('secret-key', 2))
+
+
+class SingleFlightTestCase(SimpleTestCase):
+    """
+    Test cases for the coalescing of identical in-flight streams.
+    """
+
+    def test_late_subscriber_receives_buffered_chunks(self):
+        async def scenario():
+            upstream_calls = list()
+            release = asyncio.Event()
+
+            async def upstream():
+                upstream_calls.append(True)
+                yield 'Hello'
+                await release.wait()
+                yield ' there'
+
+            single_flight = SingleFlight()
+            first_stream = single_flight.join('key', upstream)
+            first_chunks = [await first_stream.__anext__()]
+
+            second_stream = single_flight.join('key', upstream)
+            release.set()
+            first_chunks += [chunk async for chunk in first_stream]
+            second_chunks = [chunk async for chunk in second_stream]
+            return len(upstream_calls), first_chunks, second_chunks, single_flight.is_in_flight('key')
+
+        self.assertEqual(asyncio.run(scenario()), (1, ['Hello', ' there'], ['Hello', ' there'], False))
+
+    def test_upstream_error_reaches_every_subscriber(self):
+        async def scenario():
+            async def upstream():
+                yield 'Hello'
+                raise openai.error.APIError('Stream broken')
+
+            single_flight = SingleFlight()
+            streams = [single_flight.join('key', upstream) for _ in range(2)]
+            results = list()
+            for stream in streams:
+                try:
+                    results.append([chunk async for chunk in stream])
+                except openai.error.APIError as exception:
+                    results.append(type(exception).__name__)
+            return results
+
+        self.assertEqual(asyncio.run(scenario()), ['APIError', 'APIError'])
+
+    def test_abandoned_flight_is_stopped_unless_kept_alive(self):
+        async def scenario(keep_alive):
+            release = asyncio.Event()
+            upstream_chunks = list()
+
+            async def upstream():
+                for chunk in ('Hello', ' there'):
+                    upstream_chunks.append(chunk)
+                    yield chunk
+                    await release.wait()
+
+            single_flight = SingleFlight()
+            stream = single_flight.join('key', upstream, keep_alive=keep_alive)
+            await stream.__anext__()
+            await stream.aclose()
+            in_flight = single_flight.is_in_flight('key')
+            release.set()
+            await asyncio.sleep(0.01)
+            return in_flight, upstream_chunks
+
+        self.assertEqual(asyncio.run(scenario(keep_alive=False)), (False, ['Hello']))
+        self.assertEqual(asyncio.run(scenario(keep_alive=True)), (True, ['Hello', ' there']))
+
+    def test_flights_are_kept_per_event_loop(self):
+        single_flight = SingleFlight()
+
+        async def start_flight():
+            async def upstream():
+                yield 'Hello'
+            single_flight.join('key', upstream)
+            return single_flight.is_in_flight('key')
+
+        async def check_flight():
+            return single_flight.is_in_flight('key')
+
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        self.assertTrue(loop.run_until_complete(start_flight()))
+        self.assertFalse(asyncio.run(check_flight()))
+        loop.run_until_complete(asyncio.sleep(0.01))
+
+
+@override_settings(CHATBOT_UPSTREAM_TRANSPORT={'POOL_SIZE': 10, 'KEEPALIVE_TIMEOUT': 30, 'CONNECT_TIMEOUT': 1,
+                                               'FIRST_BYTE_TIMEOUT': 1, 'CHUNK_TIMEOUT': 0.01})
+class UpstreamTransportTestCase(SimpleTestCase):
+    """
+    Test cases for the timeouts of the pooled upstream transport.
+    """
+
+    def test_stalled_stream_times_out(self):
+        async def scenario():
+            async def stalled_stream():
+                yield 'Hello'
+                await asyncio.sleep(1)
+                yield ' there'
+
+            async def stream_request():
+                return stalled_stream()
+
+            chunks = list()
+            try:
+                async for chunk in upstream_transport.iter_stream(stream_request()):
+                    chunks.append(chunk)
+            except openai.error.Timeout:
+                return chunks
+
+        self.assertEqual(asyncio.run(scenario()), ['Hello'])
+
+    @mock.patch('openai.api_key', new='fake-key')
+    def test_completion_streams_from_fake_openai_server(self):
+        async def scenario(fake_openai_server):
+            with mock.patch('openai.api_base', new=await fake_openai_server.start()):
+                try:
+                    ai_model = AIModel(model_id='gpt-3.5-turbo', max_tokens=4096, compatibility='CHAT_COMPLETION')
+                    return [chunk async for chunk in stream_completion(ai_model, [], 3, 0)]
+                finally:
+                    await upstream_transport.get_aiohttp_session().close()
+                    await fake_openai_server.stop()
+
+        requests_before = REGISTRY.get_sample_value('chatbot_upstream_pool_requests_total') or 0
+        fake_openai_server = FakeOpenAIServer(chunks_count=5)
+        self.assertEqual(asyncio.run(scenario(fake_openai_server)), [' token0', ' token1', ' token2'])
+        self.assertEqual(fake_openai_server.stats['chunks'], 3)
+        self.assertEqual(REGISTRY.get_sample_value('chatbot_upstream_pool_requests_total') - requests_before, 1)
+        self.assertEqual(REGISTRY.get_sample_value('chatbot_upstream_pool_size'),
+                         upstream_transport.config['POOL_SIZE'])
+        self.assertEqual(REGISTRY.get_sample_value('chatbot_upstream_pool_waiting_requests'), 0)
+
+    @mock.patch('openai.api_key', new='fake-key')
+    @override_settings(CHATBOT_UPSTREAM_TRANSPORT={'POOL_SIZE': 10, 'KEEPALIVE_TIMEOUT': 30, 'CONNECT_TIMEOUT': 1,
+                                                   'FIRST_BYTE_TIMEOUT': 0.5, 'CHUNK_TIMEOUT': 0.5})
+    def test_stream_outlasting_the_timeouts_is_not_cut(self):
+        async def scenario(fake_openai_server):
+            with mock.patch('openai.api_base', new=await fake_openai_server.start()):
+                try:
+                    ai_model = AIModel(model_id='gpt-3.5-turbo', max_tokens=4096, compatibility='CHAT_COMPLETION')
+                    return [chunk async for chunk in stream_completion(ai_model, [], 8, 0)]
+                finally:
+                    await upstream_transport.get_aiohttp_session().close()
+                    await fake_openai_server.stop()
+
+        # Each chunk comes within the chunk timeout, the whole stream takes twice the first byte timeout.
+        fake_openai_server = FakeOpenAIServer(chunks_count=8, tokens_per_second=7)
+        self.assertEqual(len(asyncio.run(scenario(fake_openai_server))), 8)
+
+
+class ResponseRendererTestCase(SimpleTestCase):
+    """
+    Test cases for the response renderer.
+    """
+
+    def test_envelope_is_rendered_to_bytes(self):
+        response = mock.Mock(status_code=200)
+        rendered = CustomResponseRenderer().render({'data': {'price': Decimal('0.002')}}, None, {'response': response})
+
+        self.assertIsInstance(rendered, bytes)
+        self.assertEqual(json.loads(rendered), {'status_code': 200, 'data': {'price': '0.002'},
+                                                'error': None, 'message': 'SUCCESS'})
+
+    def test_async_streams_are_iterated_chunk_by_chunk(self):
+        produced = []
+
+        async def stream():
+            for index in range(3):
+                produced.append(index)
+                yield index
+
+        chunks = iterate_async(stream())
+
+        self.assertEqual(next(chunks), 0)
+        self.assertEqual(produced, [0])
+        chunks.close()
+        self.assertEqual(produced, [0])
+
+
+@tag('slow')
+@skipUnless(os.getenv('SLOW_TESTS') == 'True', 'Inserts a million rows, run with SLOW_TESTS=True')
+class IndexUsageTestCase(TestCase):
+    """
+    Test cases asserting, with EXPLAIN, that the conversation history queries are served by index scans
+    on large tables.
+    """
+    rows_count = 1000000
+    chat_sessions_count = 1000
+
+    @classmethod
+    def setUpTestData(cls):
+        if connection.vendor == 'postgresql':
+            created_at = "now() - n * interval '1 second'"
+        else:
+            created_at = "datetime('now', '-' || n || ' seconds')"
+
+        ChatSession.objects.bulk_create([ChatSession(title=f'Indexed {index}')
+                                         for index in range(cls.chat_sessions_count)])
+        first_chat_session_id = ChatSession.objects.order_by('id').values_list('id', flat=True).first()
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                WITH RECURSIVE series(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM series WHERE n < %s)
+                INSERT INTO chatbot_chatquery (content, tokens_count, chat_session_id, responses_count, created_at)
+                SELECT 'Query ' || n, '{{}}', %s + n %% %s, 1, {created_at} FROM series
+            """, [cls.rows_count, first_chat_session_id, cls.chat_sessions_count])
+            cursor.execute("""
+                INSERT INTO chatbot_chatresponse (content, tokens_count, chat_query_id, created_at)
+                SELECT 'Response ' || id, '{}', id, created_at FROM chatbot_chatquery
+            """)
+            cursor.execute('ANALYZE')
+        cls.chat_session = ChatSession.objects.get(id=first_chat_session_id)
+
+    def assertIndexScan(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan)
+        if connection.vendor == 'postgresql':
+            self.assertNotIn('Seq Scan', plan)
+        else:
+            self.assertNotIn('SCAN chatbot_', plan)
+        return plan
+
+    def test_chat_history_uses_index_scan(self):
+        plan = self.assertIndexScan(get_chat_history_queryset(self.chat_session, CHAT_HISTORY_LIMIT),
+                                    'chatquery_session_created_idx')
+        self.assertNotIn('Sort' if connection.vendor == 'postgresql' else 'TEMP B-TREE', plan)
+
+    def test_conversations_page_uses_index_scan(self):
+        chat_queries = ChatQuery.objects.filter(chat_session=self.chat_session).select_related('latest_response')
+        last_chat_query = chat_queries.order_by('-created_at', '-id')[CustomCursorPagination.page_size]
+        pagination = CustomCursorPagination()
+        page = chat_queries.filter(pagination.get_position_filter(pagination.get_position(last_chat_query), False)
+                                   ).order_by(*pagination.ordering)[:pagination.page_size + 1]
+        self.assertIndexScan(page, 'chatquery_session_created_idx')
+
+        chat_query_ids = list(page.values_list('id', flat=True))
+        self.assertIndexScan(ChatResponse.objects.filter(chat_query_id__in=chat_query_ids).order_by('created_at', 'id'),
+                             'chatresponse_query_created_idx')
+
+
+class SyntheticDataGeneratorTestCase(SimpleTestCase):
+    """
+    Test cases for the resumable synthetic training data generator.
+    """
+
+    @mock.patch('tiktoken.encoding_for_model', new=lambda model_id: FakeEncoding())
+    def test_rerun_resumes_from_results(self):
+        async def chat_completion_create(messages, **kwargs):
+            if 'fail' in messages[0]['content'] and not succeeding:
+                raise openai.error.InvalidRequestError('Invalid', param=None)
+            return {'choices': [{'message': {'content': messages[0]['content'].upper()}, 'finish_reason': 'stop'}],
+                    'usage': {'total_tokens': 10}}
+
+        with tempfile.TemporaryDirectory() as output_dir:
+            def get_generator():
+                return SyntheticDataGenerator(prompt_format='{kind} {size}', sub_prompt_format='{size}',
+                                              parameter_grid={'kind': ['pass', 'fail'], 'size': [1, 2, 3]},
+                                              samples_count=2, output_path=os.path.join(output_dir, 'data.jsonl'))
+
+            with mock.patch('openai.ChatCompletion.acreate', side_effect=chat_completion_create) as acreate:
+                succeeding = False
+                with self.assertLogs('chatbot.synthetic_data', 'ERROR'):
+                    first_summary = asyncio.run(get_generator().run())
+                succeeding = True
+                second_summary = asyncio.run(get_generator().run())
+
+            with open(os.path.join(output_dir, 'data.jsonl')) as output_file:
+                records = [json.loads(line) for line in output_file]
+            get_generator().export_csv(os.path.join(output_dir, 'data.csv'))
+            with open(os.path.join(output_dir, 'data.csv')) as csv_file:
+                csv_rows = list(csv.DictReader(csv_file))
+
+        self.assertEqual(first_summary, {'completed': 0, 'generated': 6, 'failed': 6})
+        self.assertEqual(second_summary, {'completed': 6, 'generated': 6, 'failed': 0})
+        self.assertEqual(acreate.call_count, 18)
+        self.assertEqual(len({record['key'] for record in records}), 12)
+        self.assertEqual(records[0]['response_text'], records[0]['prompt'].upper())
+        self.assertEqual(len(csv_rows), 12)
+        self.assertEqual(csv_rows[0]['sub_prompt'], str(records[0]['size']))
+
+    @mock.patch('tiktoken.encoding_for_model', new=lambda model_id: FakeEncoding())
+    def test_rerun_after_a_cut_line(self):
+        async def chat_completion_create(messages, **kwargs):
+            return {'choices': [{'message': {'content': messages[0]['content']}, 'finish_reason': 'stop'}],
+                    'usage': {'total_tokens': 10}}
+
+        with tempfile.TemporaryDirectory() as output_dir:
+            output_path = os.path.join(output_dir, 'data.jsonl')
+            with open(output_path, 'w') as output_file:
+                output_file.write('{"key": "cut')
+            generator = SyntheticDataGenerator(prompt_format='{size}', sub_prompt_format='{size}',
+                                               parameter_grid={'size': [1, 2]}, samples_count=1,
+                                               output_path=output_path)
+            with mock.patch('openai.ChatCompletion.acreate', side_effect=chat_completion_create):
+                summary = asyncio.run(generator.run())
+
+            self.assertEqual(summary['generated'], 2)
+            self.assertEqual(len(generator.read_completed_keys()), 2)
+
+
+class FineTuneDatasetTestCase(SimpleTestCase):
+    """
+    Test cases for the fine-tune dataset builder and dedup stage.
+    """
+
+    def setUp(self):
+        encoding_patcher = mock.patch('tiktoken.encoding_for_model', new=lambda model_id: FakeEncoding())
+        encoding_patcher.start()
+        self.addCleanup(encoding_patcher.stop)
+        self.addCleanup(get_encoding.cache_clear)
+        get_encoding.cache_clear()
+
+    def test_build_shards_and_flag_overflow(self):
+        with tempfile.TemporaryDirectory() as output_dir:
+            input_path = os.path.join(output_dir, 'training_data.csv')
+            with open(input_path, 'w', newline='') as input_file:
+                csv_writer = csv.writer(input_file)
+                csv_writer.writerow(['', 'sub_prompt', 'response_text'])
+                for index in range(10):
+                    csv_writer.writerow([index, f'prompt {index}', 'word ' * (50 if index == 9 else 5)])
+
+            stdout = io.StringIO()
+            call_command('build_fine_tune_dataset', input_path, output_dir=output_dir, chunk_size=3,
+                         max_example_tokens=20, shard_max_bytes=400, flag_overflow=True, stdout=stdout)
+            report = json.loads(stdout.getvalue())
+
+            shard_records = list()
+            for shard_path in report['shards']:
+                self.assertLessEqual(os.path.getsize(shard_path), 400)
+                with open(shard_path) as shard_file:
+                    shard_records.extend(json.loads(line) for line in shard_file)
+            with open(report['overflow_shards'][0]) as overflow_file:
+                overflow_records = [json.loads(line) for line in overflow_file]
+
+        # 2 prompt tokens, 5 response tokens and 2 format tokens by message.
+        self.assertEqual(report['examples'], 10)
+        self.assertEqual(report['written'], 9)
+        self.assertEqual(report['over_limit'], 1)
+        self.assertEqual(report['training_tokens'], 9 * 11)
+        self.assertGreater(len(report['shards']), 1)
+        self.assertEqual(len(shard_records), 9)
+        self.assertEqual(shard_records[0]['messages'], [{'role': 'user', 'content': 'prompt 0'},
+                                                        {'role': 'assistant', 'content': 'word ' * 5}])
+        self.assertEqual(overflow_records[0]['tokens_count'], 56)
+
+    def test_dedup_keeps_near_duplicates_on_one_side(self):
+        story = 'The {age} year old {gender} hero can {power} over the old city every night and ' \
+                'shares cookies with the neighbours before school starts in the morning'
+        with tempfile.TemporaryDirectory() as output_dir:
+            input_path = os.path.join(output_dir, 'training_data.jsonl')
+            with open(input_path, 'w') as input_file:
+                for age in range(6, 10):
+                    for power in ('fly', 'glide', 'teleport far'):
+                        for gender in ('male', 'female'):
+                            input_file.write(json.dumps({'sub_prompt': f'{age}, {power}, {gender}', 'response_text':
+                                             story.format(age=age, gender=gender, power=power)}) + '\n')
+                input_file.write(json.dumps({'sub_prompt': 'unique', 'response_text': 'Something else entirely'}) + '\n')
+
+            reports = list()
+            for _ in range(2):
+                stdout = io.StringIO()
+                call_command('dedup_fine_tune_dataset', input_path, output_dir=output_dir, threshold=0.5,
+                             validation_ratio=0.5, stdout=stdout)
+                reports.append(json.loads(stdout.getvalue()))
+            with open(reports[0]['cluster_report']) as report_file:
+                clusters = [json.loads(line) for line in report_file]
+
+        self.assertEqual(reports[0], reports[1])
+        self.assertEqual(reports[0]['examples'], 25)
+        self.assertLess(reports[0]['clusters'], 25)
+        self.assertEqual(reports[0]['removed'], 25 - reports[0]['clusters'])
+        self.assertEqual(reports[0]['train'] + reports[0]['validation'], reports[0]['clusters'])
+        self.assertNotIn(24, [row for cluster in clusters for row in cluster['rows']])
+        self.assertEqual(sum(cluster['size'] for cluster in clusters), 25 - reports[0]['clusters']
+                         + len(clusters))
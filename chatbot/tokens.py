@@ -0,0 +1,92 @@
+from functools import lru_cache
+
+import tiktoken
+
+from .constants import (AI_CHAT_SYSTEM_INSTRUCTION,
+                        AIModel_COMPATIBILITY_CHOICES)
+
+MESSAGE_FORMATS = {
+    AIModel_COMPATIBILITY_CHOICES[0][0]: {
+        'system': '-s> {}\n',
+        'user': '-u> {}\n',
+        'assistant': '-a> {}\n'
+    },
+    AIModel_COMPATIBILITY_CHOICES[1][0]: {
+        'system': 'role:system\ncontent:{}\n',
+        'user': 'role:user\ncontent:{}\n',
+        'assistant': 'role:assistant\ncontent:{}\n'
+    }
+}
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model_id):
+    """
+    Function to get the tiktoken encoding of a model.
+    :param model_id: Open AI model ID
+    :return: Encoding instance
+    """
+    return tiktoken.encoding_for_model(model_id)
+
+
+@lru_cache(maxsize=None)
+def get_message_overhead(encoding, compatibility, role):
+    """
+    Function to get the tokens count added by the prompt format around a message content.
+    :param encoding: Encoding instance
+    :param compatibility: AI Model compatibility
+    :param role: Message role
+    :return: Tokens count of the message format
+    """
+    return len(encoding.encode(MESSAGE_FORMATS[compatibility][role].format('')))
+
+
+def count_tokens(content, encoding):
+    """
+    Function to count the tokens of a text content.
+    :param content: Text content
+    :param encoding: Encoding instance
+    :return: Tokens count
+    """
+    return len(encoding.encode(content))
+
+
+def get_message_tokens_count(message_data, encoding, compatibility, role):
+    """
+    Function to get the prompt tokens count of a serialized Chat Query or Chat Response
+    from its stored per-encoding content tokens count.
+    :param message_data: Serialized Chat Query or Chat Response
+    :param encoding: Encoding instance
+    :param compatibility: AI Model compatibility
+    :param role: Message role
+    :return: Tokens count
+    """
+    return message_data['tokens_count'][encoding.name] + get_message_overhead(encoding, compatibility, role)
+
+
+def set_missing_tokens_count(message_data_list, encoding):
+    """
+    Function to compute the tokens count of serialized messages that have none stored for an encoding.
+    :param message_data_list: Serialized Chat Queries or Chat Responses
+    :param encoding: Encoding instance
+    :return: Messages for which the tokens count was computed
+    """
+    missing = [message_data for message_data in message_data_list
+               if encoding.name not in (message_data.get('tokens_count') or {})]
+
+    for message_data, tokens in zip(missing, encoding.encode_batch([message_data['content']
+                                                                     for message_data in missing])):
+        message_data['tokens_count'] = {**(message_data.get('tokens_count') or {}), encoding.name: len(tokens)}
+
+    return missing
+
+
+@lru_cache(maxsize=None)
+def get_system_instruction_tokens_count(encoding, compatibility):
+    """
+    Function to get the tokens count of the formatted chat system instruction.
+    :param encoding: Encoding instance
+    :param compatibility: AI Model compatibility
+    :return: Tokens count
+    """
+    return len(encoding.encode(MESSAGE_FORMATS[compatibility]['system'].format(AI_CHAT_SYSTEM_INSTRUCTION)))
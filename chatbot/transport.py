@@ -0,0 +1,169 @@
+import asyncio
+import weakref
+
+import openai
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+from .metrics import (UPSTREAM_POOLS,
+                      UPSTREAM_POOL_SIZE,
+                      UPSTREAM_POOL_WAITING,
+                      UPSTREAM_POOL_REQUESTS,
+                      UPSTREAM_POOL_CONNECTIONS,
+                      UPSTREAM_POOL_IDLE_CONNECTIONS)
+
+
+class TimeoutSession(requests.Session):
+    """
+    Requests session enforcing its own timeouts, as Open AI calls such as Moderation.create()
+    do not take a request timeout.
+    """
+
+    def __init__(self, timeout):
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, *args, **kwargs):
+        kwargs['timeout'] = self.timeout
+        return super().request(*args, **kwargs)
+
+
+class UpstreamTransport:
+    """
+    Pooled keep-alive HTTP transport of Open AI requests.
+    Asynchronous requests share one aiohttp session per event loop, synchronous requests one
+    requests session per thread, both with connection pools sized from the settings.
+    The pools of the aiohttp sessions are exported on /metrics, requests waiting for a connection
+    of a full pool included.
+    """
+
+    def __init__(self):
+        self._aiohttp_sessions = weakref.WeakKeyDictionary()
+        self.stats = {'requests': 0, 'connections_created': 0, 'connections_reused': 0}
+
+    @property
+    def config(self):
+        return settings.CHATBOT_UPSTREAM_TRANSPORT
+
+    @property
+    def request_timeout(self):
+        """
+        Open AI request timeout: connect and first byte timeouts in seconds.
+        """
+        return self.config['CONNECT_TIMEOUT'], self.config['FIRST_BYTE_TIMEOUT']
+
+    @property
+    def stream_timeout(self):
+        """
+        Open AI streaming request timeout: connect timeout in seconds, without a total timeout, as the
+        first byte and chunk timeouts of streams are enforced by iter_stream().
+        """
+        return self.config['CONNECT_TIMEOUT'], None
+
+    def get_trace_config(self):
+        trace_config = aiohttp.TraceConfig()
+
+        async def on_request_start(session, context, params):
+            self.stats['requests'] += 1
+            UPSTREAM_POOL_REQUESTS.inc()
+            self.export_pool_stats()
+
+        async def on_connection_queued_start(session, context, params):
+            UPSTREAM_POOL_WAITING.inc()
+
+        async def on_connection_queued_end(session, context, params):
+            UPSTREAM_POOL_WAITING.dec()
+
+        async def on_connection_create_end(session, context, params):
+            self.stats['connections_created'] += 1
+            UPSTREAM_POOL_CONNECTIONS.labels(event='created').inc()
+
+        async def on_connection_reuseconn(session, context, params):
+            self.stats['connections_reused'] += 1
+            UPSTREAM_POOL_CONNECTIONS.labels(event='reused').inc()
+
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_connection_queued_start.append(on_connection_queued_start)
+        trace_config.on_connection_queued_end.append(on_connection_queued_end)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+        return trace_config
+
+    def get_aiohttp_session(self):
+        """
+        Method to get the pooled aiohttp session of the running event loop.
+        """
+        loop = asyncio.get_running_loop()
+        session = self._aiohttp_sessions.get(loop)
+        if session is None or session.closed:
+            session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.config['POOL_SIZE'],
+                                               keepalive_timeout=self.config['KEEPALIVE_TIMEOUT'],
+                                               ttl_dns_cache=300),
+                trace_configs=[self.get_trace_config()])
+            self._aiohttp_sessions[loop] = session
+        return session
+
+    def activate(self):
+        """
+        Method to make the Open AI requests of the current context use the pooled aiohttp session.
+        """
+        openai.aiosession.set(self.get_aiohttp_session())
+
+    def build_requests_session(self):
+        """
+        Method to build a requests session with a sized keep-alive connection pool and the transport timeouts.
+        Open AI calls it once per thread.
+        """
+        session = TimeoutSession(self.request_timeout)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.config['POOL_SIZE'])
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    async def iter_stream(self, stream_request):
+        """
+        Method to iterate a streaming Open AI request, bounding the wait for the first chunk
+        and between two chunks.
+        :param stream_request: Awaitable Open AI streaming request
+        :return: Streaming chunks
+        """
+        try:
+            stream = await asyncio.wait_for(stream_request, self.config['FIRST_BYTE_TIMEOUT'])
+            chunks = stream.__aiter__()
+            timeout = self.config['FIRST_BYTE_TIMEOUT']
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), timeout)
+                except StopAsyncIteration:
+                    return
+                timeout = self.config['CHUNK_TIMEOUT']
+                yield chunk
+
+        except asyncio.TimeoutError as exception:
+            raise openai.error.Timeout('Request timed out') from exception
+
+    def get_pool_stats(self):
+        """
+        Method to get the request and connection counters along with the pool sizes.
+        """
+        return {**self.stats,
+                'pool_size': self.config['POOL_SIZE'],
+                'pools': len(self._aiohttp_sessions),
+                'idle_connections': sum(len(connections)
+                                        for session in self._aiohttp_sessions.values()
+                                        for connections in getattr(session.connector, '_conns', {}).values())}
+
+    def export_pool_stats(self):
+        """
+        Method to set the pool gauges of /metrics, refreshed as the requests start.
+        """
+        pool_stats = self.get_pool_stats()
+        UPSTREAM_POOLS.set(pool_stats['pools'])
+        UPSTREAM_POOL_SIZE.set(pool_stats['pool_size'])
+        UPSTREAM_POOL_IDLE_CONNECTIONS.set(pool_stats['idle_connections'])
+
+
+upstream_transport = UpstreamTransport()
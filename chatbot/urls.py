@@ -4,6 +4,7 @@ from .views import (GetAIModels,
                     GetChatSessions,
                     GetConversations,
                     ContentModeration,
+                    ContentModerationBatch,
                     CreateChatSession,
                     CreateConversation)
 
@@ -15,4 +16,5 @@ urlpatterns = [
     path('createConversation/<int:pk>', CreateConversation.as_view(), name='create-conversation'),
     path('getConversations/<int:pk>', GetConversations.as_view(), name='get-conversations'),
     path('contentModeration', ContentModeration.as_view(), name='content-moderation'),
+    path('contentModerationBatch', ContentModerationBatch.as_view(), name='content-moderation-batch'),
 ]
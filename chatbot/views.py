@@ -1,23 +1,66 @@
-from drf_yasg import openapi
 from django.db import transaction
+from django.db.models import Prefetch
 from rest_framework import status
 from rest_framework.response import Response
 from django.http import StreamingHttpResponse
-from drf_yasg.utils import swagger_auto_schema
+from django.core.handlers.asgi import ASGIRequest
+from asgiref.sync import async_to_sync
 from rest_framework.generics import (ListAPIView,
                                      CreateAPIView)
 
 from utilities import messages
-from utilities.utilities import CustomCursorPagination
+from utilities.utilities import (ExpandMixin,
+                                 iterate_async,
+                                 StreamingListMixin,
+                                 CustomCursorPagination,
+                                 UpdatedAtCursorPagination)
 
 from .open_ai import (completion,
-                      moderation)
-from .models import (AIModel,
-                     ChatQuery,
-                     ChatSession)
+                      moderation,
+                      moderation_batch,
+                      close_completion,
+                      prepare_completion)
+from .models import (ChatQuery,
+                     ChatSession,
+                     ChatResponse)
+from .registry import ai_model_registry
+from .persistence import conversation_writer
 from .serializers import (AIModelSerializer,
                           ChatSessionSerializer,
-                          ConversationSerializer)
+                          ConversationSerializer,
+                          ContentModerationBatchSerializer)
+
+
+class CompletionResponse(StreamingHttpResponse):
+    """
+    Streaming response of a prepared completion, releasing its admission when it is closed before its stream
+    started, as closing a generator that never started does not run its cleanup.
+    """
+
+    def __init__(self, completion_request, *args, **kwargs):
+        self.completion_request = completion_request
+        super().__init__(*args, **kwargs)
+
+    def close(self):
+        try:
+            close_completion(self.completion_request)
+        finally:
+            super().close()
+
+
+def get_completion_response(request, completion_request):
+    """
+    Function to stream a prepared completion, natively under ASGI and chunk by chunk on the event loop
+    of the worker thread under WSGI, where Django would otherwise collect the whole stream first.
+    The views preparing the completions stay synchronous under both, see the README.
+    :param request: Request of the view
+    :param completion_request: Completion request returned by prepare_completion()
+    :return: Streaming HTTP response
+    """
+    chunks = completion(completion_request)
+    if not isinstance(request._request, ASGIRequest):
+        chunks = iterate_async(chunks)
+    return CompletionResponse(completion_request, chunks, content_type='text/event-stream')
 
 
 class GetAIModels(ListAPIView):
@@ -26,11 +69,8 @@ class GetAIModels(ListAPIView):
     """
     serializer_class = AIModelSerializer
 
-    def get_queryset(self):
-        return AIModel.objects.all()
-
     def list(self, request, *args, **kwargs):
-        return Response({"data": self.get_serializer(self.get_queryset(), many=True).data,
+        return Response({"data": ai_model_registry.get_serialized_data(),
                          "message": messages.FETCHED.format('AI models')},
                         status=status.HTTP_200_OK)
 
@@ -41,45 +81,44 @@ class CreateChatSession(CreateAPIView):
     """
     serializer_class = ChatSessionSerializer
 
-    @swagger_auto_schema(
-        request_body=openapi.Schema(
-            type=openapi.TYPE_OBJECT,
-            required=['data', 'title', 'model_id', 'query_content'],
-            properties={
-                'title': openapi.Schema(type=openapi.TYPE_STRING,
-                                        description='Chat session title'),
-                'model_id': openapi.Schema(type=openapi.TYPE_STRING,
-                                           description='Open AI model ID'),
-                'query_content': openapi.Schema(type=openapi.TYPE_STRING,
-                                                description='Query text')
-            }
-        ),
-        responses={'200': 'Streaming text completion response'}
-    )
-    @transaction.atomic
     def post(self, request, *args, **kwargs):
-        chat_session_serialized = self.get_serializer(data={'title': request.data['title']})
-        chat_session_serialized.is_valid(raise_exception=True)
+        completion_request = dict()
+        try:
+            with transaction.atomic():
+                chat_session_serialized = self.get_serializer(data={'title': request.data['title']})
+                chat_session_serialized.is_valid(raise_exception=True)
 
-        return StreamingHttpResponse(
-            completion(
-                model_id=request.data["model_id"],
-                chat_session_instance=chat_session_serialized.save(),
-                query_content=request.data['query_content']),
-            content_type='text/event-stream')
+                completion_request = async_to_sync(prepare_completion)(
+                    model_id=request.data["model_id"],
+                    chat_session_instance=chat_session_serialized.save(),
+                    query_content=request.data['query_content'])
+        except BaseException:
+            close_completion(completion_request)
+            raise
 
+        return get_completion_response(request, completion_request)
 
-class GetChatSessions(ListAPIView):
+
+class GetChatSessions(ExpandMixin, StreamingListMixin, ListAPIView):
     """
-    API to fetch chat sessions.
+    API to fetch chat sessions, most recently active first.
     """
     serializer_class = ChatSessionSerializer
+    pagination_class = UpdatedAtCursorPagination
 
     def get_queryset(self):
-        return ChatSession.objects.all()
+        return ChatSession.objects.order_by('-updated_at', '-id')
+
+    # Overridden to carry the API docs of this view only, see chatbot.docs.
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
 
     def list(self, request, *args, **kwargs):
-        return Response({'data': {'chat_sessions': super().list(request, *args, **kwargs).data},
+        if self.should_stream_list():
+            return self.stream_list('chat_sessions', messages.FETCHED.format('Chat sessions'))
+
+        chat_sessions = super().list(request, *args, **kwargs)
+        return Response({'data': {'links': chat_sessions['links'], 'chat_sessions': chat_sessions['results']},
                          'message': messages.FETCHED.format('Chat sessions')},
                         status=status.HTTP_200_OK)
 
@@ -93,37 +132,25 @@ class CreateConversation(CreateAPIView):
     def get_object(self):
         return ChatSession.objects.get(id=self.kwargs['pk'])
 
-    @swagger_auto_schema(
-        request_body=openapi.Schema(
-            type=openapi.TYPE_OBJECT,
-            required=['data', 'model_id', 'query_content'],
-            properties={
-                'model_id': openapi.Schema(type=openapi.TYPE_STRING,
-                                           description='Open AI model ID'),
-                'query_content': openapi.Schema(type=openapi.TYPE_STRING,
-                                                description='Query text')
-            }
-        ),
-        manual_parameters=[openapi.Parameter(name='id', in_=openapi.IN_PATH,
-                                             type='string', description='ChatSession ID'),
-                           openapi.Parameter(name='regenerate', in_=openapi.IN_QUERY,
-                                             type='string', description='ChatQuery ID', required=False)],
-        responses={'200': 'Streaming text completion response'}
-    )
-    @transaction.atomic
     def post(self, request, *args, **kwargs):
-        return StreamingHttpResponse(
-            completion(
-                model_id=request.data["model_id"],
-                chat_session_instance=self.get_object(),
-                query_content=request.data.get('query_content'),
-                regenerate=int(request.GET.get('regenerate'))
-                if str(request.GET.get('regenerate')).isdigit() else None
-            ),
-            content_type='text/event-stream')
-
-
-class GetConversations(ListAPIView):
+        completion_request = dict()
+        try:
+            with transaction.atomic():
+                completion_request = async_to_sync(prepare_completion)(
+                    model_id=request.data["model_id"],
+                    chat_session_instance=self.get_object(),
+                    query_content=request.data.get('query_content'),
+                    regenerate=int(request.GET.get('regenerate'))
+                    if str(request.GET.get('regenerate')).isdigit() else None
+                )
+        except BaseException:
+            close_completion(completion_request)
+            raise
+
+        return get_completion_response(request, completion_request)
+
+
+class GetConversations(ExpandMixin, ListAPIView):
     """
     API to fetch conversations of a chat session.
     """
@@ -131,12 +158,17 @@ class GetConversations(ListAPIView):
     pagination_class = CustomCursorPagination
 
     def get_queryset(self):
-        return ChatQuery.objects.filter(chat_session=ChatSession.objects.get(id=self.kwargs['pk']))
+        chat_session_instance = ChatSession.objects.get(id=self.kwargs['pk'])
+        if conversation_writer.has_pending(chat_session_instance.id):
+            conversation_writer.flush()
+
+        queryset = ChatQuery.objects.filter(chat_session=chat_session_instance).select_related('latest_response')
+
+        if 'chat_responses' in self.get_expand():
+            queryset = queryset.prefetch_related(Prefetch('r_chat_responses',
+                                                          queryset=ChatResponse.objects.order_by('created_at', 'id')))
+        return queryset
 
-    @swagger_auto_schema(
-        manual_parameters=[openapi.Parameter(name='id', in_=openapi.IN_PATH, type='string',
-                                             description='ChatSession ID')],
-    )
     def get(self, request, *args, **kwargs):
         return Response({'data': super().list(request, *args, **kwargs),
                          'message': messages.FETCHED.format('Conversations')},
@@ -148,16 +180,22 @@ class ContentModeration(CreateAPIView):
     API to generate text-content moderation results.
     """
 
-    @swagger_auto_schema(
-        request_body=openapi.Schema(
-            type=openapi.TYPE_OBJECT,
-            required=['data', 'content'],
-            properties={'content': openapi.Schema(type=openapi.TYPE_STRING,
-                                                  description='Text-content to be moderated')}
-        ),
-        responses={'200': 'Moderation results'}
-    )
     def post(self, request, *args, **kwargs):
         return Response({'data': moderation(request.data['content']),
                          'message': messages.FETCHED.format('Moderation results')},
                         status=status.HTTP_200_OK)
+
+
+class ContentModerationBatch(CreateAPIView):
+    """
+    API to generate text-content moderation results of many contents at once.
+    """
+    serializer_class = ContentModerationBatchSerializer
+
+    def post(self, request, *args, **kwargs):
+        contents_serialized = self.get_serializer(data=request.data)
+        contents_serialized.is_valid(raise_exception=True)
+
+        return Response({'data': moderation_batch(contents_serialized.validated_data['contents']),
+                         'message': messages.FETCHED.format('Moderation results')},
+                        status=status.HTTP_200_OK)
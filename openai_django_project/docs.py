@@ -0,0 +1,25 @@
+"""
+URL configuration of the API docs, included by the root URL configuration when they are enabled.
+"""
+from django.urls import path
+from rest_framework.permissions import AllowAny
+from drf_yasg import openapi
+from drf_yasg.views import get_schema_view
+
+import chatbot.docs  # noqa: F401
+
+
+schema_view = get_schema_view(
+   openapi.Info(
+      title="Open-AI Integrated Django Project",
+      default_version='v1',
+   ),
+   public=True,
+   permission_classes=[AllowAny],
+)
+
+urlpatterns = [
+    path('swagger<format>/', schema_view.without_ui(cache_timeout=0), name='schema-json'),
+    path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
+    path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
+]
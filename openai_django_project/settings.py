@@ -32,6 +32,10 @@ DEBUG = os.getenv("DEBUG", False)
 ALLOWED_HOSTS = []
 
 
+# Django admin and API docs, left out of the workers serving the APIs alone to boot them faster
+ADMIN_ENABLED = os.getenv("ADMIN_ENABLED", "True") == "True"
+API_DOCS_ENABLED = os.getenv("API_DOCS_ENABLED", "True") == "True"
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -46,7 +50,14 @@ INSTALLED_APPS = [
     'chatbot'
 ]
 
+if not ADMIN_ENABLED:
+    INSTALLED_APPS.remove('django.contrib.admin')
+if not API_DOCS_ENABLED:
+    INSTALLED_APPS.remove('drf_yasg')
+
 MIDDLEWARE = [
+    'utilities.metrics.MetricsMiddleware',
+    'utilities.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -76,6 +87,8 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'openai_django_project.wsgi.application'
 
+ASGI_APPLICATION = 'openai_django_project.asgi.application'
+
 
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
@@ -88,6 +101,20 @@ DATABASES = {
         'PASSWORD': os.getenv("DB_PASSWORD"),
         'HOST': os.getenv("DB_HOST_SERVER"),
         'PORT': os.getenv("DB_PORT"),
+        'CONN_MAX_AGE': int(os.getenv("DB_CONN_MAX_AGE", 60)),
+        'CONN_HEALTH_CHECKS': True,
+    }
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache'
+        if os.getenv("REDIS_URL") else 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': os.getenv("REDIS_URL", ''),
     }
 }
 
@@ -133,6 +160,69 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Write-behind persistence of conversations: batch size, flush interval in seconds and
+# directory of the spool files holding writes that could not be flushed
+CHATBOT_WRITE_BEHIND = {
+    'MAX_BATCH_SIZE': int(os.getenv("WRITE_BEHIND_MAX_BATCH_SIZE", 100)),
+    'FLUSH_INTERVAL': float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", 0.5)),
+    'SPOOL_DIR': os.getenv("WRITE_BEHIND_SPOOL_DIR", BASE_DIR / 'spool'),
+}
+
+# Cached completion responses: seconds between two replayed chunks, 0 to replay at full speed
+CHATBOT_COMPLETION_CACHE = {
+    'REPLAY_DELAY': float(os.getenv("COMPLETION_CACHE_REPLAY_DELAY", 0)),
+}
+
+# Coalescing of identical in-flight completions into a single upstream stream. Only effective under ASGI, where
+# the requests of a worker share its event loop: under WSGI each request streams on the loop of its own thread,
+# so identical concurrent requests are never coalesced
+CHATBOT_SINGLE_FLIGHT = {
+    'ENABLED': os.getenv("SINGLE_FLIGHT_ENABLED", "True") == "True",
+}
+
+# Admission control of the completion streams against the budgets of their AI Model: seconds a request may wait,
+# requests waiting by AI Model and worker process beyond which requests are rejected at once, and seconds
+# between two budget checks of a waiting request
+CHATBOT_ADMISSION = {
+    'MAX_WAIT': float(os.getenv("ADMISSION_MAX_WAIT", 5)),
+    'MAX_QUEUE': int(os.getenv("ADMISSION_MAX_QUEUE", 100)),
+    'POLL_INTERVAL': float(os.getenv("ADMISSION_POLL_INTERVAL", 0.05)),
+}
+
+# Rolling summaries of the chat sessions: Open AI chat model writing them, conversations left out of the
+# prompt context window that trigger a refresh, maximum tokens of the summarized conversations and of the summary
+CHATBOT_CHAT_SUMMARY = {
+    'ENABLED': os.getenv("CHAT_SUMMARY_ENABLED", "True") == "True",
+    'MODEL': os.getenv("CHAT_SUMMARY_MODEL", "gpt-3.5-turbo"),
+    'REFRESH_TURNS': int(os.getenv("CHAT_SUMMARY_REFRESH_TURNS", 4)),
+    'MAX_INPUT_TOKENS': int(os.getenv("CHAT_SUMMARY_MAX_INPUT_TOKENS", 3000)),
+    'MAX_TOKENS': int(os.getenv("CHAT_SUMMARY_MAX_TOKENS", 300)),
+    'CONCURRENCY': int(os.getenv("CHAT_SUMMARY_CONCURRENCY", 4)),
+}
+
+# Warm-up of the workers before their first request: URL resolvers, AI Model registry and encodings
+CHATBOT_WARM_UP = {
+    'ENABLED': os.getenv("WARM_UP_ENABLED", "True") == "True",
+}
+
+# Pooled keep-alive HTTP transport of Open AI requests, timeouts in seconds
+CHATBOT_UPSTREAM_TRANSPORT = {
+    'POOL_SIZE': int(os.getenv("UPSTREAM_POOL_SIZE", 100)),
+    'KEEPALIVE_TIMEOUT': float(os.getenv("UPSTREAM_KEEPALIVE_TIMEOUT", 30)),
+    'CONNECT_TIMEOUT': float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", 5)),
+    'FIRST_BYTE_TIMEOUT': float(os.getenv("UPSTREAM_FIRST_BYTE_TIMEOUT", 30)),
+    'CHUNK_TIMEOUT': float(os.getenv("UPSTREAM_CHUNK_TIMEOUT", 15)),
+}
+
+# On-demand request profiling, triggered by the trusted HEADER carrying HEADER_TOKEN or by a SAMPLE_RATE of requests
+REQUEST_PROFILING = {
+    'HEADER': 'X-Profile-Request',
+    'HEADER_TOKEN': os.getenv("PROFILING_HEADER_TOKEN", ""),
+    'SAMPLE_RATE': float(os.getenv("PROFILING_SAMPLE_RATE", 0)),
+    'INTERVAL': float(os.getenv("PROFILING_INTERVAL", 0.005)),
+    'OUTPUT_DIR': os.getenv("PROFILING_OUTPUT_DIR", BASE_DIR / 'profiles'),
+}
+
 # REST framework configuration
 REST_FRAMEWORK = {
     'EXCEPTION_HANDLER': 'utilities.exception.custom_exception_handler',
@@ -140,3 +230,9 @@ REST_FRAMEWORK = {
         'utilities.utilities.CustomResponseRenderer',
     )
 }
+
+# Streaming of large unpaginated list responses, rendered by chunks of STREAM_CHUNK_SIZE items
+RESPONSE_RENDERER = {
+    'STREAM_LISTS': os.getenv("RESPONSE_STREAM_LISTS", "False") == "True",
+    'STREAM_CHUNK_SIZE': int(os.getenv("RESPONSE_STREAM_CHUNK_SIZE", 500)),
+}
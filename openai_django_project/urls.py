@@ -14,27 +14,24 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from django.contrib import admin
+from django.conf import settings
 from django.urls import (path,
                          include)
-from rest_framework.permissions import AllowAny
-from drf_yasg import openapi
-from drf_yasg.views import get_schema_view
 
-
-schema_view = get_schema_view(
-   openapi.Info(
-      title="Open-AI Integrated Django Project",
-      default_version='v1',
-   ),
-   public=True,
-   permission_classes=[AllowAny],
-)
+from utilities.metrics import metrics_view
 
 urlpatterns = [
-    path('admin/', admin.site.urls),
-    path('swagger<format>/', schema_view.without_ui(cache_timeout=0), name='schema-json'),
-    path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
-    path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
     path('chatbot/', include('chatbot.urls')),
+    path('metrics', metrics_view, name='metrics'),
 ]
+
+# The admin and the API docs, with their imports, are left out of the workers serving the APIs alone.
+if settings.ADMIN_ENABLED:
+    from django.contrib import admin
+
+    urlpatterns.append(path('admin/', admin.site.urls))
+
+if settings.API_DOCS_ENABLED:
+    from .docs import urlpatterns as docs_urlpatterns
+
+    urlpatterns.extend(docs_urlpatterns)
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'openai_django_project.settings')
 
 application = get_wsgi_application()
+
+# Warm the application up before the first request, and before forking the workers when it is preloaded.
+from chatbot.startup import warm_up  # noqa: E402
+
+warm_up()
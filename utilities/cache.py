@@ -0,0 +1,123 @@
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+
+from utilities.metrics import CACHE_LOOKUPS
+
+
+def get_hash_key(*parts):
+    """
+    Function to build a stable hash key out of JSON serializable parts.
+    """
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str).encode()).hexdigest()
+
+
+class TieredCache:
+    """
+    Two-tier cache of a size-bounded in-process LRU in front of the shared Django cache.
+    Entries of both tiers expire after the given timeout. Entries read from the shared tier are kept in-process
+    for refill_timeout seconds at most, as the time left before their shared expiry is unknown.
+    """
+    _missing = object()
+
+    def __init__(self, prefix, max_entries, timeout, refill_timeout=60):
+        self.prefix = prefix
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.refill_timeout = refill_timeout
+        self.stats = {'local_hits': 0, 'shared_hits': 0, 'misses': 0}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Method to get a cached value, looking up the in-process tier before the shared one.
+        """
+        value = self.get_local(key)
+        if value is not self._missing:
+            return value
+        return self.on_shared_lookup(key, cache.get(f'{self.prefix}:{key}', self._missing), default)
+
+    async def aget(self, key, default=None):
+        """
+        Asynchronous version of get(), looking up the shared tier outside of the event loop.
+        """
+        value = self.get_local(key)
+        if value is not self._missing:
+            return value
+        value = await sync_to_async(cache.get, thread_sensitive=False)(f'{self.prefix}:{key}', self._missing)
+        return self.on_shared_lookup(key, value, default)
+
+    def get_local(self, key):
+        """
+        Method to get a value of the in-process tier.
+        :return: Cached value, or TieredCache._missing
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.stats['local_hits'] += 1
+                CACHE_LOOKUPS.labels(cache=self.prefix, result='local_hit').inc()
+                return entry[1]
+            self._entries.pop(key, None)
+        return self._missing
+
+    def on_shared_lookup(self, key, value, default):
+        """
+        Method to record a lookup of the shared tier, refilling the in-process tier on a hit.
+        """
+        if value is self._missing:
+            self.stats['misses'] += 1
+            CACHE_LOOKUPS.labels(cache=self.prefix, result='miss').inc()
+            return default
+
+        self.stats['shared_hits'] += 1
+        CACHE_LOOKUPS.labels(cache=self.prefix, result='shared_hit').inc()
+        self.set_local(key, value, min(self.timeout, self.refill_timeout))
+        return value
+
+    def set(self, key, value, timeout=None):
+        """
+        Method to cache a value in both tiers.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        self.set_local(key, value, timeout)
+        cache.set(f'{self.prefix}:{key}', value, timeout=timeout)
+
+    async def aset(self, key, value, timeout=None):
+        """
+        Asynchronous version of set(), writing the shared tier outside of the event loop.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        self.set_local(key, value, timeout)
+        await sync_to_async(cache.set, thread_sensitive=False)(f'{self.prefix}:{key}', value, timeout=timeout)
+
+    def set_local(self, key, value, timeout):
+        """
+        Method to cache a value in the in-process tier, evicting the least recently used entries.
+        """
+        with self._lock:
+            self._entries[key] = (time.monotonic() + timeout, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear_local(self):
+        """
+        Method to empty the in-process tier.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def get_hit_rate(self):
+        """
+        Method to get the ratio of lookups served from either tier.
+        """
+        hits = self.stats['local_hits'] + self.stats['shared_hits']
+        return hits / (hits + self.stats['misses']) if hits + self.stats['misses'] else 0.0
@@ -35,6 +35,7 @@ def custom_exception_handler(exception, context):
     Function to handle exceptions.
     """
     status_code = status.HTTP_400_BAD_REQUEST
+    headers = dict()
     response_data = {
         'error': list(),
         'message': list()
@@ -56,6 +57,8 @@ def custom_exception_handler(exception, context):
 
         if exception_handler_response:
             status_code = exception_handler_response.status_code
+            headers = {header: exception_handler_response[header] for header in ('Retry-After', 'WWW-Authenticate')
+                       if exception_handler_response.has_header(header)}
             for error_detail in traverse_exception_handler_response_data(
                     exception_handler_response.data, list()):
                 response_data['error'].append(error_detail.code)
@@ -68,7 +71,7 @@ def custom_exception_handler(exception, context):
     set_rollback()
 
     if response_data['error'] or response_data['message']:
-        return Response(response_data, status=status_code)
+        return Response(response_data, status=status_code, headers=headers)
 
     else:
         logging.getLogger('django').exception(exception, exc_info=True)
@@ -83,8 +86,10 @@ def custom_exception_handler(exception, context):
 
 
 class CustomAPIException(APIException):
-    def __init__(self, status_code, error_code, error_detail):
+    def __init__(self, status_code, error_code, error_detail, wait=None):
         self.status_code = status_code
         self.default_code = error_code
         self.default_detail = error_detail
+        # Seconds before retrying, sent as the Retry-After header.
+        self.wait = wait
         super().__init__(self.default_detail, self.default_code)
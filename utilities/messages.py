@@ -9,7 +9,11 @@ FETCHED = "{} fetched successfully."
 DOES_NOT_EXIST = "{} does not exist."
 UNKNOWN_ERROR = "Something went wrong!"
 TOKEN_LIMIT_EXCEEDED = "Your request exceeds the maximum content length."
+CIRCUIT_OPEN = "The AI service is temporarily unavailable, please try again later."
+ADMISSION_REJECTED = "The AI model is at capacity, please try again later."
 
 ERROR_CODES = {
-    "token_limit_exceeded": TOKEN_LIMIT_EXCEEDED
+    "token_limit_exceeded": TOKEN_LIMIT_EXCEEDED,
+    "circuit_open": CIRCUIT_OPEN,
+    "admission_rejected": ADMISSION_REJECTED
 }
@@ -0,0 +1,98 @@
+import os
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import (iscoroutinefunction,
+                          markcoroutinefunction)
+from django.urls import (resolve,
+                         Resolver404)
+from django.http import HttpResponse
+from prometheus_client import (REGISTRY,
+                               CONTENT_TYPE_LATEST,
+                               Counter,
+                               Histogram,
+                               CollectorRegistry,
+                               multiprocess,
+                               generate_latest)
+
+# URL name of the endpoint serving the current request, also read while its response is streamed.
+current_endpoint = ContextVar('current_endpoint', default='other')
+
+REQUEST_DURATION = Histogram('request_duration_seconds',
+                             'Time to the response headers, by endpoint.',
+                             ['endpoint', 'method', 'status'])
+DB_QUERY_DURATION = Histogram('db_query_duration_seconds',
+                              'Database query durations, by endpoint.',
+                              ['endpoint'], buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5))
+CACHE_LOOKUPS = Counter('cache_lookups_total',
+                        'Tiered cache lookups, by cache and result: local_hit, shared_hit or miss.',
+                        ['cache', 'result'])
+
+
+def get_endpoint(request):
+    try:
+        return resolve(request.path_info).url_name or 'other'
+    except Resolver404:
+        return 'unmatched'
+
+
+class MetricsMiddleware:
+    """
+    Middleware recording the duration of each request and making its endpoint available to the metrics
+    recorded while it is served, its database queries included.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        started_at = time.perf_counter()
+        endpoint = get_endpoint(request)
+        current_endpoint.set(endpoint)
+        response = self.get_response(request)
+        self.observe(request, response, endpoint, started_at)
+        return response
+
+    async def __acall__(self, request):
+        started_at = time.perf_counter()
+        endpoint = get_endpoint(request)
+        current_endpoint.set(endpoint)
+        response = await self.get_response(request)
+        self.observe(request, response, endpoint, started_at)
+        return response
+
+    @staticmethod
+    def observe(request, response, endpoint, started_at):
+        REQUEST_DURATION.labels(endpoint=endpoint, method=request.method,
+                                status=response.status_code).observe(time.perf_counter() - started_at)
+
+
+def record_query_duration(execute, sql, params, many, context):
+    """
+    Database execute wrapper recording the query durations of the current endpoint.
+    """
+    started_at = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        DB_QUERY_DURATION.labels(endpoint=current_endpoint.get()).observe(time.perf_counter() - started_at)
+
+
+def metrics_view(request):
+    """
+    View exposing the metrics in the Prometheus text format, aggregated across the worker processes
+    when they share a PROMETHEUS_MULTIPROC_DIR.
+    """
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
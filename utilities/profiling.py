@@ -0,0 +1,222 @@
+import os
+import sys
+import hmac
+import json
+import time
+import uuid
+import random
+import logging
+import threading
+from collections import Counter
+
+from asgiref.sync import (iscoroutinefunction,
+                          markcoroutinefunction)
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from utilities.metrics import get_endpoint
+
+logger = logging.getLogger('django')
+
+# Innermost frames of parked threads, left out of the samples.
+IDLE_FRAMES = {('threading.py', 'wait'), ('queue.py', 'get'), ('thread.py', '_worker')}
+
+
+class StackSampler:
+    """
+    Sampling profiler recording the collapsed stacks of every thread of the process at a fixed interval,
+    so that the event loop and the threads running the synchronous ORM calls are both profiled.
+    The stacks of the requests served concurrently are recorded as well, see ProfilingMiddleware.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples_count = 0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self.run, name='request-profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def run(self):
+        sampler_id = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == sampler_id:
+                    continue
+                stack = self.collapse(frame, thread_names.get(thread_id, str(thread_id)))
+                if stack:
+                    self.stacks[stack] += 1
+            self.samples_count += 1
+
+    @staticmethod
+    def collapse(frame, thread_name):
+        """
+        Method to format a stack in the collapsed format of flame graph tools, outermost frame first.
+        :return: Collapsed stack, or None for a parked thread
+        """
+        if (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name) in IDLE_FRAMES:
+            return None
+
+        frames = list()
+        while frame is not None:
+            frames.append(f'{frame.f_code.co_name} ({frame.f_code.co_filename}:{frame.f_code.co_firstlineno})')
+            frame = frame.f_back
+        frames.append(thread_name)
+        return ';'.join(reversed(frames))
+
+
+class ProfilingMiddleware:
+    """
+    Middleware profiling the requests carrying the trusted profiling header, or a sample of all requests,
+    until their response is fully sent, streamed content included. Each profile is written to
+    REQUEST_PROFILING['OUTPUT_DIR'] as collapsed stacks along with a JSON file of request metadata.
+    As the sampler records every thread of the process, a single request is profiled at a time, requests
+    triggering a profile in the meantime are served unprofiled, and the metadata record the highest number of
+    other requests in flight during the profile as concurrent_requests.
+    The middleware is left out of the chain when profiling is disabled.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.config = settings.REQUEST_PROFILING
+        if not self.config['HEADER_TOKEN'] and not self.config['SAMPLE_RATE']:
+            raise MiddlewareNotUsed()
+
+        self.get_response = get_response
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._profile = None
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def get_trigger(self, request):
+        """
+        Method to get what requested the profiling of a request.
+        :return: 'header', 'sampling' or None
+        """
+        header_token = request.headers.get(self.config['HEADER'])
+        if header_token and self.config['HEADER_TOKEN'] and hmac.compare_digest(header_token,
+                                                                                self.config['HEADER_TOKEN']):
+            return 'header'
+        if self.config['SAMPLE_RATE'] and random.random() < self.config['SAMPLE_RATE']:
+            return 'sampling'
+        return None
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        profile = self.enter(request)
+        try:
+            response = self.get_response(request)
+        except Exception:
+            self.leave(profile, None)
+            raise
+        return self.attach(profile, response)
+
+    async def __acall__(self, request):
+        profile = self.enter(request)
+        try:
+            response = await self.get_response(request)
+        except Exception:
+            self.leave(profile, None)
+            raise
+        return self.attach(profile, response)
+
+    def enter(self, request):
+        """
+        Method to count a request in flight, and start its profile if it triggers one while none is running.
+        :return: Profile of the request, or None
+        """
+        trigger = self.get_trigger(request)
+        with self._lock:
+            self._in_flight += 1
+            if self._profile is not None:
+                self._profile['concurrent_requests'] = max(self._profile['concurrent_requests'], self._in_flight - 1)
+                if trigger is not None:
+                    logger.info('Request profile skipped, profile %s in progress', self._profile['metadata']['id'])
+                return None
+            if trigger is None:
+                return None
+            profile = self._profile = self.start(request, trigger, self._in_flight - 1)
+        profile['sampler'].start()
+        return profile
+
+    def leave(self, profile, response):
+        """
+        Method to stop counting a request in flight, ending its profile if it has one.
+        """
+        if profile is not None:
+            self.finish(profile, response)
+        with self._lock:
+            self._in_flight -= 1
+            if profile is not None:
+                self._profile = None
+
+    def start(self, request, trigger, concurrent_requests):
+        return {'sampler': StackSampler(self.config['INTERVAL']),
+                'started_at': time.perf_counter(),
+                'concurrent_requests': concurrent_requests,
+                'metadata': {'id': uuid.uuid4().hex,
+                             'trigger': trigger,
+                             'method': request.method,
+                             'path': request.get_full_path(),
+                             'endpoint': get_endpoint(request),
+                             'pid': os.getpid(),
+                             'started_at': time.time()}}
+
+    def attach(self, profile, response):
+        """
+        Method to end the request once the response is sent, after the streamed content is consumed.
+        """
+        if not response.streaming:
+            self.leave(profile, response)
+            return response
+
+        streaming_content = response.streaming_content
+        if response.is_async:
+            async def profiled_content():
+                try:
+                    async for chunk in streaming_content:
+                        yield chunk
+                finally:
+                    self.leave(profile, response)
+        else:
+            def profiled_content():
+                try:
+                    yield from streaming_content
+                finally:
+                    self.leave(profile, response)
+
+        response.streaming_content = profiled_content()
+        return response
+
+    def finish(self, profile, response):
+        sampler = profile['sampler']
+        sampler.stop()
+        metadata = {**profile['metadata'],
+                    'status_code': response.status_code if response is not None else None,
+                    'streaming': response.streaming if response is not None else None,
+                    'duration': time.perf_counter() - profile['started_at'],
+                    'interval': sampler.interval,
+                    'samples_count': sampler.samples_count,
+                    'concurrent_requests': profile['concurrent_requests']}
+
+        try:
+            os.makedirs(self.config['OUTPUT_DIR'], exist_ok=True)
+            file_path = os.path.join(self.config['OUTPUT_DIR'],
+                                     f"{int(metadata['started_at'])}_{metadata['endpoint']}_{metadata['id']}")
+            with open(f'{file_path}.collapsed', 'w') as stacks_file:
+                stacks_file.writelines(f'{stack} {count}\n' for stack, count in sampler.stacks.most_common())
+            with open(f'{file_path}.json', 'w') as metadata_file:
+                json.dump(metadata, metadata_file, indent=2)
+        except OSError:
+            logger.exception('Request profile %s could not be written', metadata['id'])
@@ -1,6 +1,75 @@
 import json
+import base64
+import asyncio
+import threading
+from decimal import Decimal
+from itertools import islice
+
+import orjson
+from django.conf import settings
+from django.utils.functional import Promise
+from django.db.models import Q
+from django.core.exceptions import (ValidationError,
+                                    FieldDoesNotExist)
+from django.http import StreamingHttpResponse
+from rest_framework.exceptions import NotFound
 from rest_framework.renderers import BaseRenderer
 from rest_framework.pagination import CursorPagination
+from rest_framework.utils.urls import (remove_query_param,
+                                       replace_query_param)
+
+_thread_local = threading.local()
+
+
+def default_serializer(value):
+    """
+    Function to serialize the values orjson does not support natively.
+    """
+    if isinstance(value, (Decimal, Promise)):
+        return str(value)
+    if hasattr(value, '__iter__'):
+        return list(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def dumps(data):
+    """
+    Function to serialize data to JSON bytes.
+    """
+    return orjson.dumps(data, default=default_serializer, option=orjson.OPT_NON_STR_KEYS)
+
+
+def get_thread_event_loop():
+    """
+    Function to get the event loop of the current thread, kept across requests so the connection pools
+    bound to it are reused.
+    """
+    loop = getattr(_thread_local, 'loop', None)
+    if loop is None or loop.is_closed():
+        loop = _thread_local.loop = asyncio.new_event_loop()
+    return loop
+
+
+def iterate_async(async_iterator):
+    """
+    Function to iterate an asynchronous iterator from synchronous code item by item, on the event loop of the
+    current thread, so WSGI servers send every item as soon as it is produced. Once the iteration is over or
+    closed, the background tasks it started are run to their end.
+    :param async_iterator: Asynchronous iterator
+    :return: Items of the asynchronous iterator
+    """
+    loop = get_thread_event_loop()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(async_iterator.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        loop.run_until_complete(async_iterator.aclose())
+        pending_tasks = asyncio.all_tasks(loop)
+        if pending_tasks:
+            loop.run_until_complete(asyncio.wait(pending_tasks))
 
 
 class CustomResponseRenderer(BaseRenderer):
@@ -10,32 +79,156 @@ class CustomResponseRenderer(BaseRenderer):
     format = 'txt'
     media_type = 'application/json'
 
-    def render(self, data, accepted_media_type=None, renderer_context=None):
+    @staticmethod
+    def get_envelope(data, status_code):
         if type(data) is dict:
-            response = {
-                'status_code': renderer_context['response'].status_code,
+            return {
+                'status_code': status_code,
                 'data': data.get('data', None),
                 'error': data.get('error', None),
-                'message': data.get('message',
-                                    'SUCCESS'
-                                    if renderer_context['response'].status_code in range(200, 300)
-                                    else 'FAILURE'),
+                'message': data.get('message', 'SUCCESS' if status_code in range(200, 300) else 'FAILURE'),
             }
+
+        return {
+            'status_code': status_code,
+            'data': data,
+            'error': None,
+            'message': 'SUCCESS' if status_code in range(200, 300) else 'FAILURE',
+        }
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return dumps(self.get_envelope(data, renderer_context['response'].status_code))
+
+    def render_stream(self, items, status_code, data_key, message, extra_data=None):
+        """
+        Method to render the envelope of a list payload chunk by chunk.
+        :param items: Iterable of serialized items, consumed lazily
+        :param status_code: Response status code
+        :param data_key: Key of the list in the data object
+        :param message: Response message
+        :param extra_data: Other keys of the data object, e.g. pagination links
+        :return: Rendered JSON bytes chunks
+        """
+        # The list is the first key of the data object, so the first '[]' of the envelope is its placeholder.
+        data = {data_key: [], **(extra_data or dict())}
+        envelope = dumps(self.get_envelope({'data': data, 'message': message}, status_code))
+        prefix, suffix = envelope.split(b'[]', 1)
+        yield prefix + b'['
+
+        items = iter(items)
+        separator = b''
+        while chunk := list(islice(items, settings.RESPONSE_RENDERER['STREAM_CHUNK_SIZE'])):
+            yield separator + dumps(chunk)[1:-1]
+            separator = b','
+        yield b']' + suffix
+
+
+class StreamingListMixin:
+    """
+    List view mixin streaming list payloads, serializing and rendering their items chunk by chunk
+    instead of at once. Paginated views stream the items of the requested page along with its links,
+    unpaginated views iterate their whole queryset.
+    """
+
+    def should_stream_list(self):
+        return settings.RESPONSE_RENDERER['STREAM_LISTS']
+
+    def stream_list(self, data_key, message):
+        """
+        Method to stream the rendered list of the view queryset, or of its requested page.
+        :param data_key: Key of the list in the data object
+        :param message: Response message
+        :return: Streaming HTTP response
+        """
+        serializer = self.get_serializer()
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            instances, extra_data = queryset.iterator(chunk_size=settings.RESPONSE_RENDERER['STREAM_CHUNK_SIZE']), None
         else:
-            response = {
-                'status_code': renderer_context['response'].status_code,
-                'data': data,
-                'error': None,
-                'message':
-                    'SUCCESS' if renderer_context['response'].status_code in range(200, 300) else 'FAILURE',
-            }
+            instances, extra_data = page, {'links': self.paginator.get_paginated_response(None)['links']}
 
-        return json.dumps(response)
+        items = (serializer.to_representation(instance) for instance in instances)
+        return StreamingHttpResponse(CustomResponseRenderer().render_stream(items, 200, data_key, message, extra_data),
+                                     content_type=CustomResponseRenderer.media_type)
 
 
-class CustomCursorPagination(CursorPagination):
+class KeysetCursorPagination(CursorPagination):
+    """
+    Cursor pagination over a unique ordering of several fields, e.g. ('-updated_at', '-id').
+    Pages are fetched with a row comparison against the edge row of the previous page, so that
+    any page is an index range scan instead of an offset over the preceding rows.
+    """
     page_size = 20
-    ordering = '-created_at'
+    ordering = ('-created_at', '-id')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.reverse, self.position = self.decode_cursor(request, queryset.model)
+
+        if self.position is not None:
+            queryset = queryset.filter(self.get_position_filter(self.position, self.reverse))
+
+        ordering = [self.invert(field_name) for field_name in self.ordering] if self.reverse else self.ordering
+        results = list(queryset.order_by(*ordering)[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+
+        if self.reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.position is not None
+        return self.page
+
+    @staticmethod
+    def invert(field_name):
+        return field_name[1:] if field_name.startswith('-') else f'-{field_name}'
+
+    def get_position_filter(self, position, reverse):
+        """
+        Method to build the filter of the rows after a position in the pagination ordering.
+        The leading field is also bounded on its own, so that the database scans an index range.
+        :param position: Ordering field values of the edge row
+        :param reverse: Whether the rows before the position are requested
+        :return: Filter Q object
+        """
+        position_filter = Q()
+        for index in reversed(range(len(self.ordering))):
+            field_name = self.ordering[index]
+            lookup = 'gt' if field_name.startswith('-') == reverse else 'lt'
+            field_filter = Q(**{f'{field_name.lstrip("-")}__{lookup}': position[index]})
+            position_filter = field_filter if index == len(self.ordering) - 1 else \
+                field_filter | (Q(**{field_name.lstrip('-'): position[index]}) & position_filter)
+
+        leading_field_name = self.ordering[0]
+        leading_lookup = 'gte' if leading_field_name.startswith('-') == reverse else 'lte'
+        return Q(**{f'{leading_field_name.lstrip("-")}__{leading_lookup}': position[0]}) & position_filter
+
+    def get_position(self, instance):
+        return [getattr(instance, field_name.lstrip('-')) for field_name in self.ordering]
+
+    def decode_cursor(self, request, model):
+        """
+        Method to decode the cursor query parameter into the direction and the position.
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return False, None
+
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            position = [model._meta.get_field(field_name.lstrip('-')).to_python(value)
+                        for field_name, value in zip(self.ordering, cursor['position'], strict=True)]
+            return bool(cursor['reverse']), position
+        except (TypeError, KeyError, ValueError, ValidationError, FieldDoesNotExist):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, reverse, position):
+        cursor = dumps({'reverse': reverse, 'position': position})
+        return replace_query_param(self.base_url, self.cursor_query_param,
+                                   base64.urlsafe_b64encode(cursor).decode())
 
     def get_paginated_response(self, data):
         return {
@@ -45,3 +238,37 @@ class CustomCursorPagination(CursorPagination):
                 },
                 'results': data
             }
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if not self.page:
+            return self.encode_cursor(False, self.position)
+        return self.encode_cursor(False, self.get_position(self.page[-1]))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(True, self.get_position(self.page[0]))
+
+
+class CustomCursorPagination(KeysetCursorPagination):
+    ordering = ('-created_at', '-id')
+
+
+class UpdatedAtCursorPagination(KeysetCursorPagination):
+    ordering = ('-updated_at', '-id')
+
+
+class ExpandMixin:
+    """
+    View mixin passing the comma separated 'expand' query parameter to the serializer context.
+    """
+
+    def get_expand(self):
+        return [field_name for field_name in self.request.query_params.get('expand', '').split(',') if field_name]
+
+    def get_serializer_context(self):
+        return {**super().get_serializer_context(), 'expand': self.get_expand()}